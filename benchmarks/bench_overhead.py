@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""Benchmark of what wllvm adds to a build, compared with the plain compiler.
+
+Generates a synthetic C project: a number of translation units, each
+including a chain of headers of the given depth, grouped into static
+archives and shared libraries, and a main program that calls into all
+of them. Then times, for the plain compiler and for wllvm:
+
+  - compile-only: each translation unit compiled on its own (-c),
+  - link: the shared libraries, and the program, linked from the
+    objects and archives,
+  - compile-and-link: the whole program compiled and linked by a
+    single invocation,
+  - extract-bc: extract-bc on the program and on each archive (wllvm
+    only, there is nothing to compare it with).
+
+The median of --iterations runs of each is reported, along with the
+difference between wllvm and the plain compiler.
+
+With --toolchain stub, clang, objcopy, llvm-link and llvm-ar are shell
+scripts that just write the files they are asked for, so what is left
+is the cost of wllvm itself. The stub program is not a real link of
+anything, so extract-bc is then only run on the archives. With
+--toolchain clang (the default) the real clang and LLVM tools are used,
+from LLVM_COMPILER_PATH or the PATH.
+
+Results can be saved as JSON, and an earlier JSON file compared with:
+
+    python3 benchmarks/bench_overhead.py --toolchain stub --tus 50 --output before.json
+    python3 benchmarks/bench_overhead.py --toolchain stub --tus 50 --compare before.json
+
+Environment variables given with --env (e.g. --env WLLVM_BITCODE_MODE=embed)
+apply to the wllvm runs. Each command runs against this checkout, not
+whatever wllvm is installed.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+runner = 'import sys; from wllvm.{0} import main; sys.argv[0] = "{1}"; sys.exit(main())'
+
+# Anything that changes what wllvm does comes from --env, not from whoever runs us.
+wllvmEnvPrefixes = ('WLLVM_', 'LLVM_')
+
+stubCompiler = """#!/bin/sh
+# a stand in for clang: writes the file it is asked for, and nothing else
+out=
+kind=object
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) out="$2"; shift ;;
+        -emit-llvm) kind=bitcode ;;
+        -E) kind=preprocessed ;;
+    esac
+    shift
+done
+if [ -z "$out" ]; then
+    [ "$kind" = preprocessed ] && exit 0
+    out=a.out
+fi
+case "$kind" in
+    bitcode) printf 'BC\\300\\336' > "$out" ;;
+    preprocessed) : > "$out" ;;
+    *) cp "{template}" "$out" ;;
+esac
+"""
+
+stubLinker = """#!/bin/sh
+# a stand in for llvm-link and llvm-ar: writes the output, and nothing else
+for arg in "$@"; do
+    case "$arg" in
+        -o=*) : > "${arg#-o=}" ;;
+    esac
+done
+[ "$1" = rs ] && : > "$2"
+exit 0
+"""
+
+stubObjcopy = """#!/bin/sh
+exit 0
+"""
+
+
+def writeTemplateObject(path):
+    """ Writes a minimal x86-64 relocatable ELF object: a .text section and the section name table.
+    """
+    ehdr, shdr = '<HHIQQQIHHHHHH', '<IIQQQQIIQQ'
+    ehsize = 16 + struct.calcsize(ehdr)
+    text = b'\xc3' * 16
+    names = b'\0.text\0.shstrtab\0'
+    shoff = ehsize + len(text) + len(names)
+    shoff += -shoff % 8
+    ident = b'\x7fELF' + bytes([2, 1, 1]) + b'\0' * 9
+    with open(path, 'wb') as f:
+        f.write(ident + struct.pack(ehdr, 1, 62, 1, 0, 0, shoff, 0, ehsize, 0, 0, struct.calcsize(shdr), 3, 2))
+        f.write(text)
+        f.write(names)
+        f.write(b'\0' * (shoff - f.tell()))
+        f.write(struct.pack(shdr, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        f.write(struct.pack(shdr, 1, 1, 6, 0, ehsize, len(text), 0, 0, 16, 0))
+        f.write(struct.pack(shdr, 7, 3, 0, 0, ehsize + len(text), len(names), 0, 0, 1, 0))
+
+
+def writeScript(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    os.chmod(path, 0o755)
+
+
+def makeStubToolchain(directory):
+    """ Writes the stub clang, clang++, objcopy, llvm-link and llvm-ar into directory.
+    """
+    os.makedirs(directory)
+    template = os.path.join(directory, 'template.o')
+    writeTemplateObject(template)
+    for name in ('clang', 'clang++'):
+        writeScript(os.path.join(directory, name), stubCompiler.replace('{template}', template))
+    for name in ('llvm-link', 'llvm-ar'):
+        writeScript(os.path.join(directory, name), stubLinker)
+    writeScript(os.path.join(directory, 'objcopy'), stubObjcopy)
+
+
+def generateProject(directory, tus, headerDepth, functions, archives, shared):
+    """ Writes the sources of the synthetic project, returning how its translation units are grouped.
+
+    The translation units are dealt out to the archives and shared
+    libraries in turn; with neither, they all go straight into the program.
+    """
+    os.makedirs(directory)
+    for depth in range(headerDepth):
+        with open(os.path.join(directory, f'header{depth}.h'), 'w') as f:
+            f.write(f'#ifndef HEADER{depth}_H\n#define HEADER{depth}_H\n')
+            if depth + 1 < headerDepth:
+                f.write(f'#include "header{depth + 1}.h"\n')
+            f.write('#include <stddef.h>\n')
+            f.write(f'#define SCALE{depth} {depth + 1}\n')
+            f.write(f'struct record{depth} {{ int key; long value; const char *name; }};\n')
+            f.write(f'static inline long combine{depth}(long a, long b) {{ return a * SCALE{depth} + b; }}\n')
+            f.write('#endif\n')
+
+    for tu in range(tus):
+        with open(os.path.join(directory, f'tu{tu}.c'), 'w') as f:
+            if headerDepth:
+                f.write('#include "header0.h"\n')
+            for fn in range(functions):
+                f.write(f'static long helper{tu}_{fn}(long x) {{\n'
+                        f'    long total = 0;\n'
+                        f'    for (long i = 0; i < x; i++) total += (i ^ {fn}) % 7;\n'
+                        f'    return total;\n}}\n')
+            calls = ' + '.join(f'helper{tu}_{fn}(x)' for fn in range(functions)) or '0'
+            f.write(f'long entry{tu}(long x) {{ return {calls}; }}\n')
+
+    with open(os.path.join(directory, 'main.c'), 'w') as f:
+        for tu in range(tus):
+            f.write(f'long entry{tu}(long x);\n')
+        f.write('int main(void) {\n    long total = 0;\n')
+        for tu in range(tus):
+            f.write(f'    total += entry{tu}({tu});\n')
+        f.write('    return (int)(total & 1);\n}\n')
+
+    groups = [('archive', f'libbench{i}') for i in range(archives)] + [('shared', f'bench{i}') for i in range(shared)]
+    layout = {name: (kind, []) for (kind, name) in groups}
+    loose = []
+    for tu in range(tus):
+        if groups:
+            layout[groups[tu % len(groups)][1]][1].append(tu)
+        else:
+            loose.append(tu)
+    return (layout, loose)
+
+
+def timeCommands(commands, env, cwd):
+    """ Runs the commands one after the other, returning the wall clock time they took, in seconds.
+    """
+    start = time.perf_counter()
+    for cmd in commands:
+        proc = subprocess.run(cmd, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+        if proc.returncode != 0:
+            raise RuntimeError(f'{" ".join(cmd)} failed:\n{proc.stderr.decode(errors="replace")}')
+    return time.perf_counter() - start
+
+
+class Build:
+    """ The commands that build the project with one compiler.
+    """
+
+    def __init__(self, compiler, layout, loose, tus):
+        self.compiler = compiler
+        self.layout = layout
+        self.loose = loose
+        self.tus = tus
+
+    def compileOnly(self):
+        return [self.compiler + ['-fPIC', '-O1', '-c', f'tu{tu}.c', '-o', f'tu{tu}.o'] for tu in range(self.tus)] + \
+            [self.compiler + ['-O1', '-c', 'main.c', '-o', 'main.o']]
+
+    def archive(self):
+        return [['ar', 'rcs', f'{name}.a'] + [f'tu{tu}.o' for tu in members]
+                for (name, (kind, members)) in self.layout.items() if kind == 'archive' and members]
+
+    def link(self):
+        commands = []
+        libraries = []
+        for (name, (kind, members)) in self.layout.items():
+            if not members:
+                continue
+            if kind == 'shared':
+                commands.append(self.compiler + ['-shared', '-o', f'lib{name}.so'] + [f'tu{tu}.o' for tu in members])
+                libraries.append(f'-l{name}')
+            else:
+                libraries.append(f'{name}.a')
+        commands.append(self.compiler + ['main.o'] + [f'tu{tu}.o' for tu in self.loose] + libraries +
+                        ['-L.', '-Wl,-rpath,$ORIGIN', '-o', 'prog'])
+        return commands
+
+    def compileAndLink(self):
+        return [self.compiler + ['-O1', 'main.c'] + [f'tu{tu}.c' for tu in range(self.tus)] + ['-o', 'prog_cl']]
+
+
+def median(times):
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'runs': times}
+
+
+def runBenchmarks(args, scratch):
+    """ Builds the project with each compiler, iterations times, and returns the results.
+    """
+    if args.toolchain == 'stub':
+        toolDir = os.path.join(scratch, 'stub')
+        makeStubToolchain(toolDir)
+    else:
+        toolDir = os.getenv('LLVM_COMPILER_PATH') or os.path.dirname(shutil.which('clang') or '')
+        if not toolDir or not os.path.exists(os.path.join(toolDir, 'clang')):
+            sys.exit('clang was not found; set LLVM_COMPILER_PATH, or use --toolchain stub')
+
+    baseEnv = {k: v for (k, v) in os.environ.items() if not k.startswith(wllvmEnvPrefixes)}
+    if args.toolchain == 'stub':
+        # the stub objcopy, too, should wllvm need one
+        baseEnv['PATH'] = os.pathsep.join([toolDir, baseEnv.get('PATH', '')])
+    wllvmEnv = dict(baseEnv, LLVM_COMPILER='clang', LLVM_COMPILER_PATH=toolDir,
+                    PYTHONPATH=os.pathsep.join([repoRoot] + [p for p in [os.getenv('PYTHONPATH')] if p]))
+    for setting in args.env:
+        (key, _, value) = setting.partition('=')
+        wllvmEnv[key] = value
+
+    compilers = {
+        'plain': ([os.path.join(toolDir, 'clang')], baseEnv),
+        'wllvm': ([sys.executable, '-c', runner.format('wllvm', 'wllvm')], wllvmEnv),
+    }
+    extractor = [sys.executable, '-c', runner.format('extractor', 'extract-bc')]
+
+    scenarios = ('compile-only', 'link', 'compile-and-link', 'extract-bc')
+    times = {scenario: {name: [] for name in compilers} for scenario in scenarios}
+    for iteration in range(args.iterations):
+        for (name, (compiler, env)) in compilers.items():
+            projectDir = os.path.join(scratch, f'{name}-{iteration}')
+            (layout, loose) = generateProject(projectDir, args.tus, args.header_depth, args.functions,
+                                              args.archives, args.shared)
+            build = Build(compiler, layout, loose, args.tus)
+            times['compile-only'][name].append(timeCommands(build.compileOnly(), env, projectDir))
+            timeCommands(build.archive(), env, projectDir)
+            times['link'][name].append(timeCommands(build.link(), env, projectDir))
+            times['compile-and-link'][name].append(timeCommands(build.compileAndLink(), env, projectDir))
+            if name == 'wllvm':
+                extractions = [extractor + ['-b', f'{lib}.a'] for (lib, (kind, members)) in layout.items()
+                               if kind == 'archive' and members]
+                if args.toolchain != 'stub':
+                    extractions.append(extractor + ['prog'])
+                times['extract-bc'][name].append(timeCommands(extractions, env, projectDir))
+            shutil.rmtree(projectDir)
+
+    results = {}
+    for scenario in scenarios:
+        results[scenario] = {name: median(runs) for (name, runs) in times[scenario].items() if runs}
+        if 'plain' in results[scenario] and 'wllvm' in results[scenario]:
+            plain = results[scenario]['plain']['median_s']
+            wllvm = results[scenario]['wllvm']['median_s']
+            results[scenario]['overhead_s'] = wllvm - plain
+            results[scenario]['overhead_pct'] = 100.0 * (wllvm - plain) / plain if plain else 0.0
+    return results
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repoRoot, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printResults(report, previous=None):
+    print(f'{report["toolchain"]} toolchain, {report["project"]["tus"]} translation units, '
+          f'median of {report["iterations"]} runs')
+    for (scenario, result) in report['results'].items():
+        wllvm = result.get('wllvm', {}).get('median_s')
+        if wllvm is None:
+            continue
+        line = f'{scenario:18}: wllvm {wllvm:8.3f} s'
+        if 'plain' in result:
+            line += f'   plain {result["plain"]["median_s"]:8.3f} s   overhead {result["overhead_s"]:8.3f} s ' \
+                    f'({result["overhead_pct"]:6.1f} %)'
+        if previous and scenario in previous.get('results', {}):
+            before = previous['results'][scenario].get('wllvm', {}).get('median_s')
+            if before:
+                line += f'   vs before {100.0 * (wllvm - before) / before:+6.1f} %'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--toolchain', choices=('clang', 'stub'), default='clang',
+                        help='The real clang and LLVM tools, or stubs that only write files. Default %(default)s')
+    parser.add_argument('--tus', type=int, default=20, help='Number of translation units. Default %(default)s')
+    parser.add_argument('--header-depth', type=int, default=3,
+                        help='Length of the chain of headers each unit includes. Default %(default)s')
+    parser.add_argument('--functions', type=int, default=5,
+                        help='Functions in each translation unit. Default %(default)s')
+    parser.add_argument('--archives', type=int, default=1, help='Number of static archives. Default %(default)s')
+    parser.add_argument('--shared', type=int, default=1, help='Number of shared libraries. Default %(default)s')
+    parser.add_argument('--iterations', '-n', type=int, default=3,
+                        help='Number of builds with each compiler. Default %(default)s')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='An environment variable for the wllvm runs; may be repeated.')
+    parser.add_argument('--output', '-o', help='Save the results as JSON in this file.')
+    parser.add_argument('--compare', help='Compare with the results saved in this JSON file.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='wllvm-bench-')
+    try:
+        results = runBenchmarks(args, scratch)
+    finally:
+        shutil.rmtree(scratch)
+
+    report = {
+        'commit': gitCommit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'toolchain': args.toolchain,
+        'project': {'tus': args.tus, 'headerDepth': args.header_depth, 'functions': args.functions,
+                    'archives': args.archives, 'shared': args.shared},
+        'env': args.env,
+        'iterations': args.iterations,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printResults(report, previous)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
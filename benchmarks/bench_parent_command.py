@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the ccache check that every wllvm invocation starts with.
+
+Compares the cost of learning the parent's command name by spawning ps, as
+wllvm used to, with reading /proc/<ppid>/comm, as getParentCommand does
+where it can.
+
+    python3 benchmarks/bench_parent_command.py --iterations 200
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wllvm.compilers import getParentCommand  # pylint: disable=wrong-import-position
+
+
+def viaPs():
+    return subprocess.check_output(['ps', '-o', 'comm=', '-p', str(os.getppid())], text=True).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', '-n', type=int, default=200,
+                        help='Number of calls to time for each method. Default %(default)s')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    if viaPs() != getParentCommand():
+        sys.stderr.write(f'warning: ps says "{viaPs()}" but getParentCommand says "{getParentCommand()}"\n')
+
+    results = {
+        'iterations': args.iterations,
+        'proc': os.path.exists(f'/proc/{os.getppid()}/comm'),
+        'ps_us': timeit.timeit(viaPs, number=args.iterations) / args.iterations * 1e6,
+        'getParentCommand_us': timeit.timeit(getParentCommand, number=args.iterations) / args.iterations * 1e6,
+    }
+    results['saving_us'] = results['ps_us'] - results['getParentCommand_us']
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'ps                : {results["ps_us"]:10.1f} us per call')
+        print(f'getParentCommand  : {results["getParentCommand_us"]:10.1f} us per call (/proc: {results["proc"]})')
+        print(f'saving            : {results["saving_us"]:10.1f} us per wllvm invocation')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Start-up benchmark for the wllvm entry points.
+
+Times, from interpreter start to exit, the invocations that do little
+more than start up:
+
+  - wllvm -E, -M and --version, which hand straight over to the compiler
+    (here a stub that exits at once, so what is left is our overhead),
+  - extract-bc --help and wparse-args on a typical compile line, which
+    import everything they need and then stop.
+
+An empty interpreter (python -c pass) is timed as the baseline, and the
+overhead column is the median less the baseline median. Each command
+runs against this checkout, not whatever wllvm is installed.
+
+    python3 benchmarks/bench_startup.py --iterations 50
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+runner = 'import sys; from wllvm.{0} import main; sys.argv[0] = "{1}"; sys.exit(main())'
+
+compileLine = ['-O2', '-g', '-Wall', '-DNDEBUG', '-Iinclude', '-c', 'foo.c', '-o', 'foo.o']
+
+
+def invocations():
+    """ The (name, argv) pairs we time.
+    """
+    return [
+        ('python -c pass', [sys.executable, '-c', 'pass']),
+        ('wllvm -E', [sys.executable, '-c', runner.format('wllvm', 'wllvm'), '-E', 'foo.c']),
+        ('wllvm -M', [sys.executable, '-c', runner.format('wllvm', 'wllvm'), '-M', 'foo.c']),
+        ('wllvm --version', [sys.executable, '-c', runner.format('wllvm', 'wllvm'), '--version']),
+        ('extract-bc --help', [sys.executable, '-c', runner.format('extractor', 'extract-bc'), '--help']),
+        ('wparse-args', [sys.executable, '-c', runner.format('wparser', 'wparse-args')] + compileLine),
+    ]
+
+
+def timeRuns(argv, env, cwd, iterations):
+    """ Returns the wall clock time of each of iterations runs of argv, in seconds.
+    """
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', '-n', type=int, default=30,
+                        help='Number of runs of each command. Default %(default)s')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    try:
+        # a compiler that does nothing at all, so we only time ourselves
+        stub = os.path.join(scratch, 'clang')
+        with open(stub, 'w') as f:
+            f.write('#!/bin/sh\nexit 0\n')
+        os.chmod(stub, 0o755)
+        with open(os.path.join(scratch, 'foo.c'), 'w') as f:
+            f.write('int foo(void) { return 0; }\n')
+
+        env = dict(os.environ, LLVM_COMPILER='clang', LLVM_COMPILER_PATH=scratch,
+                   PYTHONPATH=os.pathsep.join([repoRoot] + [p for p in [os.getenv('PYTHONPATH')] if p]))
+        for var in ('WLLVM_DAEMON_SOCKET', 'WLLVM_CONFIGURE_ONLY', 'WLLVM_OUTPUT_LEVEL', 'WLLVM_OUTPUT_FILE'):
+            env.pop(var, None)
+
+        results = {'iterations': args.iterations, 'python': sys.version.split()[0], 'commands': {}}
+        for (name, argv) in invocations():
+            # one untimed run to get the byte code compiled
+            timeRuns(argv, env, scratch, 1)
+            times = timeRuns(argv, env, scratch, args.iterations)
+            results['commands'][name] = {'median_ms': statistics.median(times) * 1e3, 'min_ms': min(times) * 1e3}
+    finally:
+        shutil.rmtree(scratch)
+
+    baseline = results['commands']['python -c pass']['median_ms']
+    for result in results['commands'].values():
+        result['overhead_ms'] = result['median_ms'] - baseline
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for (name, result) in results['commands'].items():
+            print(f'{name:20}: {result["median_ms"]:8.1f} ms median {result["min_ms"]:8.1f} ms min '
+                  f'{result["overhead_ms"]:8.1f} ms over python')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
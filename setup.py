@@ -38,6 +38,12 @@ setup(
             'wllvm-sanity-checker = wllvm.sanity:main',
             'extract-bc = wllvm.extractor:main',
             'wparse-args = wllvm.wparser:main',
+            'wllvm-bc-cache = wllvm.bccache:main',
+            'wllvm-bc-store = wllvm.bcstore:main',
+            'wllvm-daemon = wllvm.daemon:main',
+            'wllvm-bcd = wllvm.bcqueue:main',
+            'wllvm-flush = wllvm.bcqueue:flush',
+            'wllvm-metrics = wllvm.metrics:main',
         ],
     },
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from wllvm.archive import readArchive
+from wllvm.elf import appendToSection, mappedFile
+from wllvm.extraction import extract_from_thin_archive, extract_member_linux
+
+test_files_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_files")
+
+
+def bsd_header(name, size):
+    """
+    A BSD member header, with the name in front of the contents if it is long or has spaces
+    :return:
+    """
+    if len(name) > 16 or b' ' in name:
+        return b'#1/%-13d%-12d%-6d%-6d%-8s%-10d`\n' % (len(name), 0, 0, 0, b'644', len(name) + size), name
+    return b'%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (name, 0, 0, 0, b'644', size), b''
+
+
+class ArchiveReaderTest(unittest.TestCase):
+    """
+    Reads the members of GNU, BSD and thin archives, as ar would
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory, and some members: objects with bitcode paths, and text of odd lengths
+        :return:
+        """
+        if shutil.which('ar') is None or shutil.which('cc') is None:
+            self.skipTest('requires ar and cc')
+        self.directory = tempfile.mkdtemp()
+        self.members = {}
+        for name in ('foo', 'bar', 'baz'):
+            obj = self.path(name + '.o')
+            subprocess.check_call(['cc', '-c', os.path.join(test_files_directory, name + '.c'), '-o', obj])
+            self.assertTrue(appendToSection(obj, '.llvm_bc', '/tmp/.{}.o.bc\n'.format(name).encode()))
+            with open(obj, 'rb') as f:
+                self.members[name + '.o'] = f.read()
+        self.members['a_rather_long_member_name.txt'] = b'odd\n'
+        self.members['short.txt'] = b'x'
+        for (name, contents) in self.members.items():
+            with open(self.path(name), 'wb') as f:
+                f.write(contents)
+
+    def tearDown(self):
+        """
+        Removes the scratch directory
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, archive):
+        with mappedFile(archive) as data:
+            return [(name, None if offset is None else bytes(data[offset:offset + size]), size)
+                    for (name, offset, size) in readArchive(data)]
+
+    def ar(self, *args):
+        subprocess.check_call(['ar'] + list(args), cwd=self.directory)
+
+    def test_gnu(self):
+        """
+        Checks long names, odd sizes and the symbol table, against the members themselves
+        :return:
+        """
+        names = sorted(self.members)
+        self.ar('rcs', 'lib.a', *names)
+        self.assertEqual(self.read(self.path('lib.a')),
+                         [(name, self.members[name], len(self.members[name])) for name in names])
+
+    def test_duplicates(self):
+        """
+        Checks that members of the same name are each read, and each has its own bitcode paths
+        :return:
+        """
+        self.ar('qc', 'lib.a', 'foo.o', 'bar.o')
+        shutil.copyfile(self.path('baz.o'), self.path('foo.o'))
+        self.ar('qc', 'lib.a', 'foo.o')
+        archive = self.path('lib.a')
+        members = self.read(archive)
+        self.assertEqual([name for (name, _, _) in members], ['foo.o', 'bar.o', 'foo.o'])
+        paths = [extract_member_linux(archive, name, contents) for (name, contents, _) in members]
+        self.assertEqual(paths, [['/tmp/.foo.o.bc', ''], ['/tmp/.bar.o.bc', ''], ['/tmp/.baz.o.bc', '']])
+        self.assertEqual(extract_member_linux(archive, 'x.txt', b'not an object\n'), [])
+
+    def test_thin(self):
+        """
+        Checks the members of a thin archive are named relative to it, wherever we are
+        :return:
+        """
+        os.mkdir(self.path('sub'))
+        shutil.move(self.path('foo.o'), self.path(os.path.join('sub', 'foo.o')))
+        self.ar('rcsT', 'thin.a', os.path.join('sub', 'foo.o'), 'a_rather_long_member_name.txt', 'bar.o')
+        self.assertEqual(self.read(self.path('thin.a')),
+                         [('sub/foo.o', None, len(self.members['foo.o'])),
+                          ('a_rather_long_member_name.txt', None, 4), ('bar.o', None, len(self.members['bar.o']))])
+        self.assertEqual(extract_from_thin_archive(self.path('thin.a')),
+                         [self.path('sub/foo.o'), self.path('a_rather_long_member_name.txt'), self.path('bar.o')])
+
+    def test_bsd(self):
+        """
+        Checks a BSD archive, with its symbol table and names in front of the contents
+        :return:
+        """
+        archive = self.path('bsd.a')
+        with open(archive, 'wb') as f:
+            f.write(b'!<arch>\n')
+            for (name, contents) in [('__.SYMDEF SORTED', b'\0' * 8)] + sorted(self.members.items()):
+                (header, longName) = bsd_header(name.encode(), len(contents))
+                f.write(header + longName + contents)
+                if (len(longName) + len(contents)) % 2:
+                    f.write(b'\n')
+        self.assertEqual(self.read(archive), [(name, contents, len(contents))
+                                              for (name, contents) in sorted(self.members.items())])
+
+    def test_not_archive(self):
+        """
+        Checks that files that are not archives, or are cut short, are refused
+        :return:
+        """
+        archive = self.path('bsd.a')
+        with open(archive, 'wb') as f:
+            f.write(b'!<arch>\n' + bsd_header(b'foo.o', 100)[0] + b'\0' * 10)
+        for data in (b'', b'!<arch>', b'not an archive at all', b'!<arch>\n' + b' ' * 59):
+            with self.assertRaises(ValueError):
+                list(readArchive(data))
+        with self.assertRaises(ValueError):
+            self.read(archive)
+        self.assertIsNone(extract_from_thin_archive(archive + '.missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import random
+import re
+import unittest
+
+from wllvm.arglistfilter import (ArgumentListFilter, defaultArgExactMatches, defaultArgPatterns,
+                                 getArgumentTable)
+
+# Arguments the patterns are there for, and some they are not.
+samples = ['foo.c', 'foo.cpp', 'foo.cc', 'foo.C', 'foo.cxx', 'foo.i', 'foo.s', 'foo.S', 'foo.bc', 'foo.f',
+           'foo.F90', 'foo.for', 'foo.FPP', 'foo.o', 'foo.lo', 'foo.So', 'foo.po', 'libfoo.a', 'libfoo.so',
+           'libfoo.so.1.2', 'libfoo.dylib', 'libfoo.dylib.3', '-lm', '-L/usr/lib', '-Iinclude', '-DFOO=1',
+           '-UFOO', '-Wl,-rpath,/lib', '-Wl,', '-Wall', '-Wno-unused', '-W', '-fPIC', '-fsanitize=address',
+           '-rtlib=compiler-rt', '-std=c99', '-stdlib=libc++', '-mtune=native', '-march=x86-64',
+           '-mcmodel=small', '--param=max-inline-insns=10', '-mmacosx-version-min=10.9', '--sysroot=/sys',
+           '--gcc-toolchain=/gcc', '-print-file-name=', '-print-prog-name=ld', '-xc', '-Q', 'README',
+           'foo.c\n', '', '-', '--']
+
+
+def reference_lookup(arg, exactMatches, patternMatches):
+    """
+    How ArgumentListFilter used to classify arg: the exact matches, then each pattern in turn
+    :return:
+    """
+    if arg in exactMatches:
+        return exactMatches[arg]
+    for (pattern, entry) in patternMatches.items():
+        if re.match(pattern, arg):
+            return entry
+    return None
+
+
+def lookup(table, arg):
+    if arg in table.exactMatches:
+        return table.exactMatches[arg]
+    return table.matchPattern(arg)
+
+
+class ArgumentTableTest(unittest.TestCase):
+    """
+    Checks the combined pattern classifies every argument as the pattern by pattern loop did
+    """
+
+    def corpus(self):
+        args = list(defaultArgExactMatches) + samples
+        return args + [arg + suffix for arg in args for suffix in ('=x', 'x', '.c', '.o', ',a', '.so.1')]
+
+    def test_same_as_loop(self):
+        """
+        Checks the default table against the loop, argument by argument
+        :return:
+        """
+        table = getArgumentTable()
+        for arg in self.corpus():
+            self.assertEqual(lookup(table, arg), reference_lookup(arg, defaultArgExactMatches, defaultArgPatterns), arg)
+
+    def test_first_pattern_wins(self):
+        """
+        Checks that where patterns overlap, the earlier one still wins
+        :return:
+        """
+        # '^-f.+$' comes before '^-fsanitize=.+$', so the sanitizer does not reach the link
+        af = ArgumentListFilter(['-fsanitize=address', '-c', 'foo.c'])
+        self.assertEqual((af.compileArgs, af.linkArgs), (['-fsanitize=address'], []))
+
+    def test_additions(self):
+        """
+        Checks a subclass's additions override, or follow, the defaults, as dict.update would
+        :return:
+        """
+        def callback(self, flag):
+            pass
+        exact = {'-o': (0, callback)}
+        patterns = {r'^-f.+$': (0, callback), r'^-Q.*$': (0, callback)}
+        table = getArgumentTable(exact, patterns)
+        self.assertIs(getArgumentTable(exact, patterns), table)
+        mergedExact = dict(defaultArgExactMatches, **exact)
+        mergedPatterns = dict(defaultArgPatterns)
+        mergedPatterns.update(patterns)
+        for arg in self.corpus():
+            self.assertEqual(lookup(table, arg), reference_lookup(arg, mergedExact, mergedPatterns), arg)
+
+    def test_command_lines(self):
+        """
+        Checks whole command lines are split up as before
+        :return:
+        """
+        random.seed(0)
+        corpus = [arg for arg in self.corpus() if arg not in ('-E', '-S')]
+        for _ in range(500):
+            cmd = random.sample(corpus, random.randint(1, 20)) + ['tail.c', 'tail.o']
+            af = ArgumentListFilter(list(cmd))
+            compileArgs = []
+            linkArgs = []
+            rest = list(cmd)
+            while rest:
+                arg = rest.pop(0)
+                if arg == '-Wl,--start-group':
+                    break
+                entry = reference_lookup(arg, defaultArgExactMatches, defaultArgPatterns)
+                (arity, handler) = entry if entry else (0, ArgumentListFilter.compileUnaryCallback)
+                values = [rest.pop(0) for _ in range(min(arity, len(rest)))]
+                if handler in (ArgumentListFilter.compileUnaryCallback, ArgumentListFilter.compileBinaryCallback,
+                               ArgumentListFilter.dependencyOnlyCallback, ArgumentListFilter.dependencyBinaryCallback,
+                               ArgumentListFilter.compileLinkUnaryCallback, ArgumentListFilter.compileLinkBinaryCallback):
+                    compileArgs.extend([arg] + values)
+                if handler in (ArgumentListFilter.linkUnaryCallback, ArgumentListFilter.linkBinaryCallback,
+                               ArgumentListFilter.compileLinkUnaryCallback, ArgumentListFilter.compileLinkBinaryCallback):
+                    linkArgs.extend([arg] + values)
+            else:
+                self.assertEqual((af.compileArgs, af.linkArgs), (compileArgs, linkArgs), cmd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from wllvm.bccache import BitcodeCache, parseSize
+
+
+class BitcodeCacheTest(unittest.TestCase):
+    """
+    Exercises the cache directory operations, without a compiler
+    """
+
+    def setUp(self):
+        """
+        Creates the cache and a scratch build directory
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.cache = BitcodeCache(os.path.join(self.directory, 'cache'), 256 * 1024)
+        self.build = os.path.join(self.directory, 'build')
+        os.makedirs(self.build)
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def bitcode(self, name, size=100):
+        """
+        Writes a fake bitcode file into the build directory
+        :return:
+        """
+        path = os.path.join(self.build, name)
+        with open(path, 'wb') as f:
+            f.write(b'BC\xc0\xde' + os.urandom(size))
+        return path
+
+    def test_parse_size(self):
+        """
+        Checks the size suffixes
+        :return:
+        """
+        self.assertEqual(parseSize('100'), 100)
+        self.assertEqual(parseSize('2k'), 2048)
+        self.assertEqual(parseSize('1.5M'), 3 << 19)
+        self.assertEqual(parseSize('5GB'), 5 << 30)
+        self.assertRaises(ValueError, parseSize, 'lots')
+
+    def test_miss_insert_hit(self):
+        """
+        Checks that an inserted file comes back, byte for byte
+        :return:
+        """
+        key = 'ab' + '0' * 62
+        bc = self.bitcode('.foo.o.bc')
+        contents = open(bc, 'rb').read()
+        self.assertFalse(self.cache.fetch(key, bc))
+        self.cache.insert(key, bc)
+        os.remove(bc)
+        self.assertTrue(self.cache.fetch(key, bc))
+        self.assertEqual(open(bc, 'rb').read(), contents)
+        stats = self.cache.statistics()
+        self.assertEqual((stats['hits'], stats['misses'], stats['inserts'], stats['entries']), (1, 1, 1, 1))
+
+    def test_not_shared(self):
+        """
+        Checks that neither the entry nor the file fetched from it change when the build rewrites its bitcode
+        :return:
+        """
+        key = 'ef' + '0' * 62
+        bc = self.bitcode('.foo.o.bc')
+        contents = open(bc, 'rb').read()
+        self.cache.insert(key, bc)
+        self.assertNotEqual(os.stat(bc).st_ino, os.stat(self.cache.entryPath(key)).st_ino)
+        with open(bc, 'r+b') as f:
+            f.write(b'XX')
+        fetched = os.path.join(self.build, '.bar.o.bc')
+        self.assertTrue(self.cache.fetch(key, fetched))
+        self.assertEqual(os.stat(self.cache.entryPath(key)).st_nlink, 1)
+        with open(fetched, 'r+b') as f:
+            f.write(b'YY')
+        self.assertEqual(open(self.cache.entryPath(key), 'rb').read(), contents)
+
+    def test_evicts_least_recently_used(self):
+        """
+        Checks that a full shard loses its oldest entries first
+        :return:
+        """
+        # 1K per shard: four 304 byte entries do not fit, three do
+        keys = ['cd{:062d}'.format(i) for i in range(4)]
+        for (i, key) in enumerate(keys):
+            bc = self.bitcode('.{}.o.bc'.format(i), 300)
+            self.cache.insert(key, bc)
+            os.utime(self.cache.entryPath(key), ns=(i * 10**9, i * 10**9))
+        self.cache.trim(self.cache.shardPath(keys[0]), 1024)
+        self.assertEqual([os.path.exists(self.cache.entryPath(key)) for key in keys], [False, True, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
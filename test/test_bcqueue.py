@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.bcqueue import BitcodeQueue, awaitDeferredBitcode, drain, getJobName
+from wllvm.compilers import getBuilder
+
+# the bitcode compiler writes its -o file, unless the source says to fail
+stub_compiler = """#!/bin/sh
+out=
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) out="$2"; shift ;;
+        *.c) grep -q fail "$1" && exit 1 ;;
+    esac
+    shift
+done
+echo bitcode > "$out"
+"""
+
+
+class BitcodeQueueTest(unittest.TestCase):
+    """
+    Runs deferred bitcode jobs through the queue, with a stub compiler
+    """
+
+    def setUp(self):
+        """
+        Creates the queue, a scratch build directory and the stub compiler
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.queue = BitcodeQueue(os.path.join(self.directory, 'queue'))
+        self.build = os.path.join(self.directory, 'build')
+        os.makedirs(self.build)
+        compiler = os.path.join(self.directory, 'clang')
+        with open(compiler, 'w') as f:
+            f.write(stub_compiler)
+        os.chmod(compiler, 0o755)
+        env = {'LLVM_COMPILER': 'clang', 'LLVM_COMPILER_PATH': self.directory, 'WLLVM_BC_QUEUE': self.queue.directory}
+        self.env = mock.patch.dict(os.environ, env)
+        self.env.start()
+        self.cwd = os.getcwd()
+        os.chdir(self.build)
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        os.chdir(self.cwd)
+        self.env.stop()
+        shutil.rmtree(self.directory)
+
+    def push(self, name, source='int x;\n'):
+        """
+        Queues the bitcode compile of name.c, returning the bitcode path
+        :return:
+        """
+        with open(f'{name}.c', 'w') as f:
+            f.write(source)
+        bcFile = os.path.join(self.build, f'.{name}.o.bc')
+        self.queue.push(getBuilder(['-c', f'{name}.c'], 'wllvm'), f'{name}.c', bcFile)
+        return bcFile
+
+    def test_drain(self):
+        """
+        Checks that draining builds every job, and records the failures
+        :return:
+        """
+        good = self.push('good')
+        bad = self.push('bad', 'fail\n')
+        self.assertEqual(len(self.queue.listJobs('queue')), 2)
+        self.assertEqual(drain(self.queue, 2, untilEmpty=True, poll=0.01), (1, 1))
+        self.assertTrue(os.path.isfile(good))
+        self.assertFalse(os.path.exists(bad))
+        self.assertTrue(self.queue.isIdle())
+        self.assertEqual(self.queue.listJobs('failed'), [getJobName(bad)])
+        self.assertTrue(os.path.isfile(self.queue.logPath('failed', getJobName(bad))))
+
+        # queueing it again clears the failure
+        self.push('bad')
+        self.assertEqual(self.queue.listJobs('failed'), [])
+
+    def test_private(self):
+        """
+        Checks that the queue is ours alone, and jobs keep only the environment the compile needs
+        :return:
+        """
+        with mock.patch.dict(os.environ, {'API_TOKEN': 'secret', 'CPATH': '/inc', 'WLLVM_BITCODE_MODE': 'deferred'}):
+            bcFile = self.push('foo')
+        path = self.queue.path('queue', getJobName(bcFile))
+        self.assertEqual(os.stat(self.queue.directory).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        with open(path) as f:
+            env = json.load(f)['env']
+        self.assertNotIn('API_TOKEN', env)
+        self.assertEqual((env['CPATH'], env['WLLVM_BITCODE_MODE'], env['PATH']),
+                         ('/inc', 'deferred', os.environ['PATH']))
+
+    def test_source_gone(self):
+        """
+        Checks that a job whose source has gone is dropped, not failed
+        :return:
+        """
+        bcFile = self.push('gone')
+        os.remove('gone.c')
+        self.assertEqual(drain(self.queue, 1, untilEmpty=True, poll=0.01), (1, 0))
+        self.assertFalse(os.path.exists(bcFile))
+        self.assertEqual(self.queue.listJobs('failed'), [])
+
+    def test_source_changed(self):
+        """
+        Checks that a job whose source changed since it was queued fails, and builds nothing
+        :return:
+        """
+        bcFile = self.push('changed')
+        with open('changed.c', 'a') as f:
+            f.write('int y;\n')
+        self.assertEqual(drain(self.queue, 1, untilEmpty=True, poll=0.01), (0, 1))
+        self.assertFalse(os.path.exists(bcFile))
+        self.assertEqual(self.queue.listJobs('failed'), [getJobName(bcFile)])
+        with open(self.queue.logPath('failed', getJobName(bcFile))) as f:
+            self.assertIn('has changed since it was compiled', f.read())
+
+    def test_recover(self):
+        """
+        Checks that only the jobs nobody holds go back in the queue
+        :return:
+        """
+        self.push('foo')
+        claimed = self.queue.claimNext()
+        self.assertIsNotNone(claimed)
+        self.assertIsNone(self.queue.claimNext())
+        self.queue.recover()
+        self.assertEqual(self.queue.listJobs('running'), [claimed.name])
+        # as if the worker died
+        claimed.release()
+        self.queue.recover()
+        self.assertEqual(self.queue.listJobs('queue'), [claimed.name])
+        self.assertEqual(self.queue.listJobs('running'), [])
+
+    def test_await_only_what_is_needed(self):
+        """
+        Checks that extract-bc builds the bitcode it needs, and nothing else
+        :return:
+        """
+        foo = self.push('foo')
+        bar = self.push('bar')
+        self.assertEqual(awaitDeferredBitcode([foo, os.path.join(self.build, '.other.o.bc')]), [])
+        self.assertTrue(os.path.isfile(foo))
+        self.assertFalse(os.path.exists(bar))
+        self.assertEqual(self.queue.listJobs('queue'), [getJobName(bar)])
+        self.assertEqual(awaitDeferredBitcode([self.push('bad', 'fail\n')]), [os.path.join(self.build, '.bad.o.bc')])
+
+    def test_await_takes_job_slots(self):
+        """
+        Checks that under make, extract-bc's deferred compiles stay within the slots make hands out
+        :return:
+        """
+        log = os.path.join(self.directory, 'log')
+        compiler = os.path.join(self.directory, 'clang')
+        with open(compiler, 'w') as f:
+            f.write(stub_compiler.replace('out=\n', 'out=\necho start >> "$WLLVM_TEST_LOG"; sleep 0.2; '
+                                                   'echo end >> "$WLLVM_TEST_LOG"\n'))
+        (readFd, writeFd) = os.pipe()
+        # one token, and the implicit slot: two compiles at a time
+        os.write(writeFd, b'+')
+        try:
+            with mock.patch.dict(os.environ, {'WLLVM_TEST_LOG': log, 'WLLVM_JOBS': '4',
+                                              'MAKEFLAGS': f' -j2 --jobserver-auth={readFd},{writeFd}'}):
+                bcFiles = [self.push(f'foo{i}') for i in range(4)]
+                self.assertEqual(awaitDeferredBitcode(bcFiles), [])
+            self.assertEqual(os.read(readFd, 8), b'+')
+        finally:
+            os.close(readFd)
+            os.close(writeFd)
+        running = peak = 0
+        with open(log) as f:
+            for line in f:
+                running += 1 if line.strip() == 'start' else -1
+                peak = max(peak, running)
+        self.assertEqual(peak, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.bcstore import (bcStoreCompressionEnv, bcStoreEnv, compressStore, getHashedPathName, getStorePath,
+                           getStoredBitcode, statistics, storeBitcode)
+
+
+class BitcodeStoreTest(unittest.TestCase):
+    """
+    Exercises the WLLVM_BC_STORE layout, without a compiler
+    """
+
+    def setUp(self):
+        """
+        Creates the store and two scratch build trees
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.store = os.path.join(self.directory, 'store')
+        os.makedirs(self.store)
+        self.saved = os.environ.get(bcStoreEnv)
+        os.environ[bcStoreEnv] = self.store
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        if self.saved is None:
+            del os.environ[bcStoreEnv]
+        else:
+            os.environ[bcStoreEnv] = self.saved
+        shutil.rmtree(self.directory)
+
+    def bitcode(self, tree, contents):
+        """
+        Writes a fake bitcode file into a build tree
+        :return:
+        """
+        path = os.path.join(self.directory, tree, '.foo.o.bc')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_identical_bitcode_stored_once(self):
+        """
+        Checks that two trees with the same bitcode share one object
+        :return:
+        """
+        first = self.bitcode('a', b'BC\xc0\xde same')
+        second = self.bitcode('b', b'BC\xc0\xde same')
+        self.assertEqual(storeBitcode(self.store, first), storeBitcode(self.store, second))
+        objects = [f for (_, _, files) in os.walk(os.path.join(self.store, 'objects')) for f in files]
+        self.assertEqual(len(objects), 1)
+        os.remove(first)
+        with open(getStorePath(first), 'rb') as f:
+            self.assertEqual(f.read(), b'BC\xc0\xde same')
+
+    def test_rewritten_in_place(self):
+        """
+        Checks that a build rewriting its bitcode file in place leaves the stored object alone
+        :return:
+        """
+        path = self.bitcode('a', b'BC\xc0\xde old')
+        objectPath = storeBitcode(self.store, path)
+        self.assertEqual(os.stat(objectPath).st_nlink, 1)
+        with open(path, 'r+b') as f:
+            f.write(b'XX')
+        with open(objectPath, 'rb') as f:
+            self.assertEqual(f.read(), b'BC\xc0\xde old')
+
+    def test_pointer_follows_rebuild(self):
+        """
+        Checks that storing a rebuilt file repoints its entry
+        :return:
+        """
+        path = self.bitcode('a', b'BC\xc0\xde old')
+        storeBitcode(self.store, path)
+        self.bitcode('a', b'BC\xc0\xde new')
+        storeBitcode(self.store, path)
+        with open(getStorePath(path), 'rb') as f:
+            self.assertEqual(f.read(), b'BC\xc0\xde new')
+
+    def test_old_style_copy(self):
+        """
+        Checks that stores holding plain copies are still read
+        :return:
+        """
+        path = os.path.join(self.directory, 'a', '.foo.o.bc')
+        copy = os.path.join(self.store, getHashedPathName(path))
+        with open(copy, 'wb') as f:
+            f.write(b'BC\xc0\xde')
+        self.assertEqual(getStorePath(path), copy)
+        self.assertIsNone(getStorePath(os.path.join(self.directory, 'missing.bc')))
+        self.assertIsNone(getStorePath(''))
+
+    def test_compressed(self):
+        """
+        Checks each codec writes compressed objects, which come back out decompressed
+        :return:
+        """
+        scratch = os.path.join(self.directory, 'scratch')
+        os.makedirs(scratch)
+        contents = b'BC\xc0\xde' + b'compressible ' * 1000
+        for (codec, suffix) in (('gzip', '.gz'), ('bz2', '.bz2'), ('lzma', '.xz')):
+            path = self.bitcode(codec, contents + codec.encode())
+            with mock.patch.dict(os.environ, {bcStoreCompressionEnv: codec}):
+                objectPath = storeBitcode(self.store, path)
+            self.assertTrue(objectPath.endswith(suffix))
+            self.assertLess(os.path.getsize(objectPath), len(contents))
+            os.remove(path)
+            with open(getStoredBitcode(path, scratch), 'rb') as f:
+                self.assertEqual(f.read(), contents + codec.encode())
+        stats = statistics(self.store)
+        self.assertEqual(sorted(stats['compress']), ['bz2', 'gzip', 'lzma'])
+        for entry in stats['compress'].values():
+            self.assertEqual(entry['count'], 1)
+            self.assertGreater(entry['size'], entry['stored'])
+        self.assertEqual(sum(entry['count'] for entry in stats['decompress'].values()), 3)
+
+    def test_compress_store(self):
+        """
+        Checks that compressing a store in place leaves its pointers working
+        :return:
+        """
+        path = self.bitcode('a', b'BC\xc0\xde plain')
+        plain = storeBitcode(self.store, path)
+        self.assertEqual(compressStore(self.store, 'gzip'), 1)
+        self.assertFalse(os.path.exists(plain))
+        self.assertEqual(getStorePath(path), plain + '.gz')
+        self.assertEqual(statistics(self.store)['objects'], {'gzip': {'count': 1, 'stored': os.path.getsize(plain + '.gz')}})
+        # storing the same bitcode again, uncompressed, reuses the compressed object
+        self.assertEqual(storeBitcode(self.store, path), plain + '.gz')
+        with open(getStoredBitcode(path, self.directory), 'rb') as f:
+            self.assertEqual(f.read(), b'BC\xc0\xde plain')
+
+
+if __name__ == '__main__':
+    unittest.main()
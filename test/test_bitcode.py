@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.bitcode import splitBitcode, WRAPPER_MAGIC
+from wllvm.elf import clearSectionFlags, SHF_EXCLUDE
+from wllvm.extraction import ScratchDir, extract_embedded_bitcode
+
+module_source = """define i32 @{0}() {{
+  ret i32 {1}
+}}
+"""
+
+
+class SplitBitcodeTest(unittest.TestCase):
+    """
+    Checks the splitting of concatenated .llvmbc sections into modules
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory
+        :return:
+        """
+        if shutil.which('llvm-as') is None:
+            self.skipTest('requires llvm-as')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the scratch directory
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def module(self, name, value):
+        path = os.path.join(self.directory, name + '.ll')
+        with open(path, 'w') as f:
+            f.write(module_source.format(name, value))
+        subprocess.check_call(['llvm-as', path, '-o', path + '.bc'])
+        with open(path + '.bc', 'rb') as f:
+            return f.read()
+
+    def test_split_padded_modules(self):
+        """
+        Checks the modules come back out, whatever the padding between them
+        :return:
+        """
+        modules = [self.module('foo', 1), self.module('bar', 2), self.module('baz', 3)]
+        data = modules[0] + b'\0' * 12 + modules[1] + modules[2] + b'\0' * 4
+        self.assertEqual(splitBitcode(data), modules)
+
+    def test_split_wrapped_module(self):
+        """
+        Checks a module inside the wrapper header
+        :return:
+        """
+        module = self.module('foo', 1)
+        wrapped = WRAPPER_MAGIC + struct.pack('<III', 0, 20, len(module)) + b'\0' * 4 + module
+        self.assertEqual(splitBitcode(wrapped + module), [module, module])
+
+    def test_split_garbage(self):
+        """
+        Checks that anything that is not bitcode is an error
+        :return:
+        """
+        module = self.module('foo', 1)
+        with self.assertRaises(ValueError):
+            splitBitcode(module + b'not bitcode')
+        with self.assertRaises(ValueError):
+            splitBitcode(module[:-8])
+
+    def test_kept_for_manifest(self):
+        """
+        Checks the embedded modules go in the kept directory, made when the first is written, and stay there
+        :return:
+        """
+        kept = os.path.join(self.directory, 'prog.llvm.bitcode')
+        scratch = ScratchDir()
+        scratch.keep(kept)
+        self.assertFalse(os.path.exists(kept))
+        modules = [self.module('foo', 1), self.module('bar', 2)]
+        with mock.patch('wllvm.extraction._scratch', scratch):
+            fileNames = extract_embedded_bitcode('prog', modules[0] + modules[1])
+        self.assertEqual([os.path.dirname(f) for f in fileNames], [kept, kept])
+        self.assertEqual(len(set(fileNames)), 2)
+        for (fileName, module) in zip(fileNames, modules):
+            with open(fileName, 'rb') as f:
+                self.assertEqual(f.read(), module)
+
+
+class ClearSectionFlagsTest(unittest.TestCase):
+    """
+    Checks the section flags are cleared in place
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory
+        :return:
+        """
+        if shutil.which('objcopy') is None or shutil.which('readelf') is None or shutil.which('cc') is None:
+            self.skipTest('requires cc and binutils')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the scratch directory
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_clear_exclude(self):
+        """
+        Checks that an excluded section is no longer excluded
+        :return:
+        """
+        source = os.path.join(self.directory, 'foo.c')
+        obj = os.path.join(self.directory, 'foo.o')
+        contents = os.path.join(self.directory, 'contents')
+        with open(source, 'w') as f:
+            f.write('int foo(void) { return 1; }\n')
+        with open(contents, 'wb') as f:
+            f.write(b'BC\xc0\xde')
+        subprocess.check_call(['cc', '-c', source, '-o', obj])
+        subprocess.check_call(['objcopy', '--add-section', '.llvmbc=' + contents,
+                               '--set-section-flags', '.llvmbc=exclude,readonly', obj])
+
+        def flags():
+            out = subprocess.check_output(['readelf', '-SW', obj]).decode()
+            line = next(l for l in out.splitlines() if '.llvmbc' in l)
+            fields = line.split(']', 1)[1].split()
+            # name, type, address, offset, size, entry size, flags (may be empty), link, info, alignment
+            return fields[6] if len(fields) == 10 else ''
+
+        self.assertIn('E', flags())
+        self.assertTrue(clearSectionFlags(obj, '.llvmbc', SHF_EXCLUDE))
+        self.assertNotIn('E', flags())
+        self.assertFalse(clearSectionFlags(obj, '.missing', SHF_EXCLUDE))
+
+
+if __name__ == '__main__':
+    unittest.main()
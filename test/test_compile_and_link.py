@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.compilers import wcompile
+
+# gcc builds the objects and links; -emit-llvm just writes its -o file.
+# Every run is logged, one line of arguments each.
+stub_compiler = """#!/bin/sh
+echo "$*" >> "$(dirname "$0")/runs"
+for arg in "$@"; do
+    if [ "$arg" = -emit-llvm ]; then
+        while [ $# -gt 0 ]; do
+            [ "$1" = -o ] && echo bitcode > "$2"
+            shift
+        done
+        exit 0
+    fi
+done
+exec gcc "$@"
+"""
+
+
+class CompileAndLinkTest(unittest.TestCase):
+    """
+    Checks the compile and link case compiles each source, and links, once
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch build directory, its sources and the stub compiler
+        :return:
+        """
+        if shutil.which('gcc') is None or shutil.which('objcopy') is None:
+            self.skipTest('requires gcc and objcopy')
+        self.directory = tempfile.mkdtemp()
+        self.build = os.path.join(self.directory, 'build')
+        os.makedirs(self.build)
+        compiler = os.path.join(self.directory, 'clang')
+        with open(compiler, 'w') as f:
+            f.write(stub_compiler)
+        os.chmod(compiler, 0o755)
+        with open(os.path.join(self.build, 'foo.c'), 'w') as f:
+            f.write('int foo(void) { return 0; }\n')
+        with open(os.path.join(self.build, 'main.c'), 'w') as f:
+            f.write('int foo(void);\nint main(void) { return foo(); }\n')
+        env = {'LLVM_COMPILER': 'clang', 'LLVM_COMPILER_PATH': self.directory, 'WLLVM_BITCODE_MODE': 'attach'}
+        self.env = mock.patch.dict(os.environ, env)
+        self.env.start()
+        self.cwd = os.getcwd()
+        os.chdir(self.build)
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        os.chdir(self.cwd)
+        self.env.stop()
+        shutil.rmtree(self.directory)
+
+    def wllvm(self, *args):
+        """
+        Runs wllvm with args, returning its exit status and the compiler runs
+        :return:
+        """
+        with mock.patch.object(sys, 'argv', ['wllvm'] + list(args)):
+            try:
+                rc = wcompile('wllvm')
+            except SystemExit as e:
+                rc = e.code
+        with open(os.path.join(self.directory, 'runs')) as f:
+            return (rc, f.read().splitlines())
+
+    def test_once(self):
+        """
+        Checks there is one object compile per source, one bitcode compile per source, and one link
+        :return:
+        """
+        (rc, runs) = self.wllvm('-O1', 'foo.c', 'main.c', '-o', 'prog')
+        self.assertEqual(rc, 0)
+        self.assertTrue(os.access('prog', os.X_OK))
+        objects = [run for run in runs if ' -c ' in f' {run} ' and '-emit-llvm' not in run]
+        bitcode = [run for run in runs if '-emit-llvm' in run]
+        links = [run for run in runs if ' -c ' not in f' {run} ']
+        self.assertEqual(len(objects), 2)
+        self.assertEqual(len(bitcode), 2)
+        self.assertEqual(links, ['.foo.o .main.o -o prog'])
+        for name in ('.foo.o.bc', '.main.o.bc'):
+            self.assertTrue(os.path.isfile(name))
+
+    def test_compile_failure(self):
+        """
+        Checks a source that does not compile fails the build, and nothing is linked
+        :return:
+        """
+        with open('main.c', 'w') as f:
+            f.write('int main(void) { return bar; }\n')
+        (rc, runs) = self.wllvm('foo.c', 'main.c', '-o', 'prog')
+        self.assertNotEqual(rc, 0)
+        self.assertFalse(os.path.exists('prog'))
+        self.assertFalse(any(' -c ' not in f' {run} ' for run in runs))
+
+    def test_dependency_files(self):
+        """
+        Checks a command that writes dependency files runs as given, and the hidden compiles write none
+        :return:
+        """
+        (rc, runs) = self.wllvm('-Wp,-MD,deps.d', 'foo.c', 'main.c', '-o', 'prog')
+        self.assertEqual(rc, 0)
+        self.assertTrue(os.access('prog', os.X_OK))
+        self.assertIn('-Wp,-MD,deps.d foo.c main.c -o prog', runs)
+        objects = [run for run in runs if ' -c ' in f' {run} ' and '-emit-llvm' not in run]
+        self.assertEqual(len(objects), 2)
+        self.assertFalse(any('-M' in run for run in objects))
+        with open('deps.d') as f:
+            self.assertIn('main.c', f.read())
+        self.assertEqual([name for name in os.listdir('.') if name.endswith('.d')], ['deps.d'])
+
+    def test_hidden_objects_without_dependencies(self):
+        """
+        Checks the hidden object compiles drop the dependency flags, whatever the command
+        :return:
+        """
+        from wllvm.compilers import buildObjectFile, getBuilder
+        builder = getBuilder(['-MD', '-MF', 'deps.d', '-O1', 'foo.c', 'main.c', '-o', 'prog'], 'wllvm')
+        buildObjectFile(builder, 'foo.c', '.foo.o')
+        with open(os.path.join(self.directory, 'runs')) as f:
+            self.assertEqual(f.read().splitlines(), ['-O1 foo.c -c -o .foo.o'])
+        self.assertFalse(os.path.exists('deps.d'))
+
+
+if __name__ == '__main__':
+    unittest.main()
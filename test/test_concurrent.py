@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from wllvm.compilers import runInParallel, wcompile
+from wllvm.metrics import metricsPhase, readEntries
+
+
+def succeed(name, delay, done):
+    """
+    A task that takes delay seconds, then notes it is done
+    :return:
+    """
+    time.sleep(delay)
+    done.append(name)
+    return name
+
+
+def fail(name, delay, done):
+    """
+    A task that takes delay seconds, then fails as a compile does
+    :return:
+    """
+    time.sleep(delay)
+    done.append(name)
+    sys.exit(name)
+
+
+class RunInParallelTest(unittest.TestCase):
+    """
+    Runs stub tasks on the worker pool, and checks how failures come out
+    """
+
+    def setUp(self):
+        """
+        Gives us two workers, whatever the machine or make says
+        :return:
+        """
+        self.env = mock.patch.dict(os.environ, {'WLLVM_JOBS': '2', 'MAKEFLAGS': ''})
+        self.env.start()
+
+    def tearDown(self):
+        """
+        Restores the environment
+        :return:
+        """
+        self.env.stop()
+
+    def run_tasks(self, *tasks):
+        done = []
+        with self.assertRaises(SystemExit) as cm:
+            runInParallel(lambda task, name, delay: task(name, delay, done), tasks)
+        return (cm.exception.code, done)
+
+    def test_first_fails(self):
+        """
+        Checks the exit status of the first task comes out, once the second has finished
+        :return:
+        """
+        (code, done) = self.run_tasks((fail, 2, 0), (succeed, 'second', 0.2))
+        self.assertEqual(code, 2)
+        self.assertEqual(done, [2, 'second'])
+
+    def test_second_fails(self):
+        """
+        Checks the exit status of the second task comes out, once the first has finished
+        :return:
+        """
+        (code, done) = self.run_tasks((succeed, 'first', 0.2), (fail, 3, 0))
+        self.assertEqual(code, 3)
+        self.assertEqual(done, [3, 'first'])
+
+    def test_both_fail(self):
+        """
+        Checks the earlier task's exit status wins, whichever fails first
+        :return:
+        """
+        (code, done) = self.run_tasks((fail, 4, 0.2), (fail, 5, 0))
+        self.assertEqual(code, 4)
+        self.assertEqual(done, [5, 4])
+
+    def test_both_succeed(self):
+        """
+        Checks the results come back in the order of the tasks, not the order they finished in
+        :return:
+        """
+        done = []
+        results = runInParallel(succeed, [('first', 0.2, done), ('second', 0, done)])
+        self.assertEqual(results, ['first', 'second'])
+        self.assertEqual(done, ['second', 'first'])
+
+    def test_not_started(self):
+        """
+        Checks that one worker runs nothing after a failure
+        :return:
+        """
+        os.environ['WLLVM_JOBS'] = '1'
+        (code, done) = self.run_tasks((fail, 6, 0), (succeed, 'second', 0))
+        self.assertEqual(code, 6)
+        self.assertEqual(done, [6])
+
+
+class ConcurrentBitcodeTest(unittest.TestCase):
+    """
+    Runs a compile with WLLVM_CONCURRENT_BITCODE, with stub object and bitcode compiles
+    """
+
+    def setUp(self):
+        """
+        Sets up a compile of a single file, in a scratch directory
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        env = {'LLVM_COMPILER': 'clang', 'WLLVM_CONCURRENT_BITCODE': '1', 'WLLVM_BITCODE_MODE': 'attach',
+               'WLLVM_JOBS': '2', 'MAKEFLAGS': '', 'WLLVM_METRICS_DIR': '', 'WLLVM_PREPROCESS_ONCE': ''}
+        self.patches = [mock.patch.dict(os.environ, env),
+                        mock.patch.object(sys, 'argv', ['wllvm', '-c', 'foo.c']),
+                        mock.patch('wllvm.compilers.getParentCommand', return_value='make'),
+                        mock.patch('wllvm.compilers.attachBitcodePathToObject', side_effect=self.attach)]
+        for patch in self.patches:
+            patch.start()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        """
+        Undoes the stubs, and removes the scratch directory
+        :return:
+        """
+        for patch in reversed(self.patches):
+            patch.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def note(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def attach(self, bcFile, objFile):
+        self.note(('attach', bcFile, objFile))
+
+    def compile(self, objectStatus, objectDelay, bitcodeStatus, bitcodeDelay):
+        def buildObject(builder):
+            time.sleep(objectDelay)
+            self.note('object')
+            return objectStatus
+
+        def buildBitcodeFile(builder, srcFile, bcFile, compileArgs=None):
+            with metricsPhase('bitcode'):
+                time.sleep(bitcodeDelay)
+                self.note('bitcode')
+                if bitcodeStatus:
+                    sys.exit(bitcodeStatus)
+
+        with mock.patch('wllvm.compilers.buildObject', buildObject), \
+             mock.patch('wllvm.compilers.buildBitcodeFile', buildBitcodeFile):
+            try:
+                return wcompile('wllvm')
+            except SystemExit as e:
+                return e.code
+
+    def test_object_fails(self):
+        """
+        Checks the object compile's exit status comes out, once the bitcode compile has finished
+        :return:
+        """
+        self.assertEqual(self.compile(2, 0, 0, 0.2), 2)
+        self.assertEqual(self.events, ['object', 'bitcode'])
+
+    def test_bitcode_fails(self):
+        """
+        Checks the bitcode compile's exit status comes out, and nothing is attached
+        :return:
+        """
+        self.assertEqual(self.compile(0, 0.2, 3, 0), 3)
+        self.assertEqual(self.events, ['bitcode', 'object'])
+
+    def test_both_succeed(self):
+        """
+        Checks the bitcode is attached once both compiles are done, whichever finishes first
+        :return:
+        """
+        for (objectDelay, bitcodeDelay) in ((0.2, 0), (0, 0.2)):
+            self.events = []
+            self.assertEqual(self.compile(0, objectDelay, 0, bitcodeDelay), 0)
+            self.assertEqual(sorted(self.events[:2]), ['bitcode', 'object'])
+            self.assertEqual(self.events[2:], [('attach', '.foo.o.bc', 'foo.o')])
+
+    def test_metrics(self):
+        """
+        Checks the bitcode compile is timed once, and the wait for it apart
+        :return:
+        """
+        os.environ['WLLVM_METRICS_DIR'] = self.directory
+        self.assertEqual(self.compile(0, 0, 0, 0.2), 0)
+        (entry,) = readEntries(self.directory)
+        self.assertEqual(entry['phases']['bitcode']['count'], 1)
+        self.assertEqual(entry['phases']['bitcode-wait']['count'], 1)
+        self.assertGreaterEqual(entry['phases']['bitcode']['wall'], 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
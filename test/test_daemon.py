@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from wllvm import arglistfilter
+from wllvm.arglistfilter import ClangBitcodeArgumentListFilter
+from wllvm.daemon import _hangUpWatcher, _warmUp, getJobServerFds
+
+# the compiler just says who started it: its parent, and its parent's parent
+stub_compiler = """#!/bin/sh
+echo "$WLLVM_TEST_MARK $(cut -d' ' -f4 /proc/$PPID/stat)"
+exit 3
+"""
+
+client = 'import sys; from wllvm.wllvm import main; sys.exit(main())'
+
+
+class DaemonTest(unittest.TestCase):
+    """
+    Runs wllvm through wllvm-daemon, with a stub compiler
+    """
+
+    def setUp(self):
+        """
+        Starts a daemon
+        :return:
+        """
+        if not os.path.isdir('/proc'):
+            self.skipTest('requires /proc')
+        self.directory = tempfile.mkdtemp()
+        compiler = os.path.join(self.directory, 'clang')
+        with open(compiler, 'w') as f:
+            f.write(stub_compiler)
+        os.chmod(compiler, 0o755)
+        self.socket = os.path.join(self.directory, 'wllvm.sock')
+        self.env = dict(os.environ, LLVM_COMPILER='clang', LLVM_COMPILER_PATH=self.directory,
+                        WLLVM_DAEMON_SOCKET=self.socket, WLLVM_TEST_MARK='forwarded')
+        self.daemon = subprocess.Popen([sys.executable, '-m', 'wllvm.daemon', '--idle-timeout', '60'],
+                                       env=dict(self.env, WLLVM_TEST_MARK='stale'))
+        for _ in range(100):
+            if os.path.exists(self.socket):
+                break
+            time.sleep(0.1)
+
+    def tearDown(self):
+        """
+        Stops the daemon, and removes all temporary test files
+        :return:
+        """
+        self.daemon.terminate()
+        self.daemon.wait()
+        shutil.rmtree(self.directory)
+
+    def wllvm(self, env):
+        return subprocess.run([sys.executable, '-c', client, '-c', 'foo.c'], env=env, cwd=self.directory,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+
+    def test_daemon_compiles(self):
+        """
+        Checks that the daemon ran the compile, with our environment and output
+        :return:
+        """
+        proc = self.wllvm(self.env)
+        self.assertEqual(proc.returncode, 3)
+        self.assertEqual(proc.stdout.decode().split(), ['forwarded', str(self.daemon.pid)])
+
+    def test_falls_back_without_daemon(self):
+        """
+        Checks that wllvm still works when the daemon is not there
+        :return:
+        """
+        proc = self.wllvm(dict(self.env, WLLVM_DAEMON_SOCKET=os.path.join(self.directory, 'missing')))
+        self.assertEqual(proc.returncode, 3)
+        self.assertEqual(proc.stdout.decode().split()[0], 'forwarded')
+        self.assertNotEqual(proc.stdout.decode().split()[1], str(self.daemon.pid))
+
+
+class JobServerFdsTest(unittest.TestCase):
+    """
+    Checks which descriptors a client passes on for the make jobserver
+    """
+
+    def test_fds(self):
+        """
+        Checks the pipes make names are passed on, and nothing else
+        :return:
+        """
+        self.assertEqual(getJobServerFds(None), [])
+        self.assertEqual(getJobServerFds('-j8'), [])
+        self.assertEqual(getJobServerFds('-j8 --jobserver-auth=3,4'), [3, 4])
+        self.assertEqual(getJobServerFds('-j --jobserver-fds=5,6 -j8 --jobserver-auth=7,8'), [7, 8])
+        self.assertEqual(getJobServerFds('-j8 --jobserver-auth=fifo:/tmp/GMfifo1'), [])
+        self.assertEqual(getJobServerFds('-j8 --jobserver-auth=-2,-2'), [])
+        self.assertEqual(getJobServerFds('-j8 --jobserver-auth=x,y'), [])
+
+
+class HangUpWatcherTest(unittest.TestCase):
+    """
+    Checks when a request's child takes itself down
+    """
+
+    def hangUp(self, replied):
+        """
+        Runs the watcher until the client hangs up, returning whether it killed the compile
+        :return:
+        """
+        (conn, client) = socket.socketpair()
+        event = threading.Event()
+        if replied:
+            event.set()
+        with conn, mock.patch('os.killpg') as killpg:
+            client.close()
+            _hangUpWatcher(conn, event)
+        return killpg.called
+
+    def test_hang_up(self):
+        """
+        Checks the compile is killed when the client goes away, but not once it has its reply
+        :return:
+        """
+        self.assertTrue(self.hangUp(False))
+        self.assertFalse(self.hangUp(True))
+
+
+class WarmUpTest(unittest.TestCase):
+    """
+    Checks what the daemon does before it takes any requests
+    """
+
+    def test_tables_built(self):
+        """
+        Checks the clang builder's argument table is built once, by the warm up
+        :return:
+        """
+        with mock.patch.dict(arglistfilter._tables, clear=True):
+            self.assertIsNone(_warmUp())
+            self.assertEqual(len(arglistfilter._tables), 1)
+            ClangBitcodeArgumentListFilter(['-c', 'foo.c'])
+            self.assertEqual(len(arglistfilter._tables), 1)
+        for name in ('concurrent.futures', 'wllvm.bccache', 'wllvm.preprocess'):
+            self.assertIn(name, sys.modules)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.compilers import attachLineToObject
+from wllvm.elf import appendToSection, getSections, mappedFile, ELFCLASS32, ELFCLASS64, ELFDATA2LSB, ELFDATA2MSB
+from wllvm.extraction import extract_section_linux, getObjdumpSectionSizesAndOffsets
+
+test_files_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_files")
+
+
+def make_object(path, elfClass, elfData, machine):
+    """
+    Writes a minimal relocatable ELF object: a .text section and the section name table
+    :return:
+    """
+    order = '<' if elfData == ELFDATA2LSB else '>'
+    if elfClass == ELFCLASS64:
+        ehdr, shdr = order + 'HHIQQQIHHHHHH', order + 'IIQQQQIIQQ'
+    else:
+        ehdr, shdr = order + 'HHIIIIIHHHHHH', order + 'IIIIIIIIII'
+    ehsize, shentsize = 16 + struct.calcsize(ehdr), struct.calcsize(shdr)
+    text = b'\x90' * 16
+    names = b'\0.text\0.shstrtab\0'
+    shoff = ehsize + len(text) + len(names)
+    shoff += -shoff % 8
+    ident = b'\x7fELF' + bytes([elfClass, elfData, 1]) + b'\0' * 9
+    with open(path, 'wb') as f:
+        f.write(ident + struct.pack(ehdr, 1, machine, 1, 0, 0, shoff, 0, ehsize, 0, 0, shentsize, 3, 2))
+        f.write(text)
+        f.write(names)
+        f.write(b'\0' * (shoff - f.tell()))
+        f.write(struct.pack(shdr, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        f.write(struct.pack(shdr, 1, 1, 6, 0, ehsize, len(text), 0, 0, 16, 0))
+        f.write(struct.pack(shdr, 7, 3, 0, 0, ehsize + len(text), len(names), 0, 0, 1, 0))
+
+
+class ElfWriterTest(unittest.TestCase):
+    """
+    Checks the in place ELF section writer against binutils
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the scratch directory
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def section_contents(self, path, section):
+        """
+        Uses readelf to dump the section
+        :return:
+        """
+        output = subprocess.check_output(['readelf', '-x', section, path]).decode()
+        # "  0x00000000 2f746d70 2f2e782e 6f2e6263 0a       /tmp/.x.o.bc."
+        words = [line[13:48] for line in output.splitlines() if line.startswith('  0x')]
+        return bytes.fromhex(''.join(words).replace(' ', ''))
+
+    def section_strings(self, path):
+        """
+        Returns the lines in the .llvm_bc section
+        :return:
+        """
+        return self.section_contents(path, '.llvm_bc').decode().replace('\0', '').splitlines()
+
+    def test_all_classes_and_byte_orders(self):
+        """
+        Checks 32/64 bit, little/big endian objects
+        :return:
+        """
+        if shutil.which('readelf') is None:
+            self.skipTest('requires readelf')
+        for (elfClass, elfData, machine) in ((ELFCLASS32, ELFDATA2LSB, 3), (ELFCLASS64, ELFDATA2LSB, 62),
+                                             (ELFCLASS32, ELFDATA2MSB, 20), (ELFCLASS64, ELFDATA2MSB, 21)):
+            path = os.path.join(self.directory, 'x{}{}.o'.format(elfClass, elfData))
+            make_object(path, elfClass, elfData, machine)
+            self.assertTrue(appendToSection(path, '.llvm_bc', b'/tmp/.x.o.bc\n'))
+            self.assertEqual(self.section_strings(path), ['/tmp/.x.o.bc'])
+            self.assertEqual(self.section_contents(path, '.text'), b'\x90' * 16)
+            # a second append extends the section
+            self.assertTrue(appendToSection(path, '.llvm_bc', b'/tmp/.y.o.bc\n'))
+            self.assertEqual(self.section_strings(path), ['/tmp/.x.o.bc', '/tmp/.y.o.bc'])
+
+    def test_leaves_other_files_alone(self):
+        """
+        Checks that executables and non ELF files are left to objcopy
+        :return:
+        """
+        path = os.path.join(self.directory, 'x.o')
+        make_object(path, ELFCLASS64, ELFDATA2LSB, 62)
+        with open(path, 'r+b') as f:
+            f.seek(16)
+            f.write(struct.pack('<H', 2))
+        before = open(path, 'rb').read()
+        self.assertFalse(appendToSection(path, '.llvm_bc', b'/tmp/.x.o.bc\n'))
+        self.assertEqual(open(path, 'rb').read(), before)
+
+        path = os.path.join(self.directory, 'x.txt')
+        with open(path, 'w') as f:
+            f.write('not an object\n')
+        self.assertFalse(appendToSection(path, '.llvm_bc', b'/tmp/.x.o.bc\n'))
+
+    def test_linker_accepts_result(self):
+        """
+        Checks that the linker concatenates our sections, just as it does objcopy's
+        :return:
+        """
+        if shutil.which('cc') is None or shutil.which('readelf') is None:
+            self.skipTest('requires cc and readelf')
+        objects = []
+        for name in ('foo', 'bar', 'baz', 'main'):
+            obj = os.path.join(self.directory, name + '.o')
+            subprocess.check_call(['cc', '-c', os.path.join(test_files_directory, name + '.c'), '-o', obj])
+            self.assertTrue(appendToSection(obj, '.llvm_bc', '/tmp/.{}.o.bc\n'.format(name).encode()))
+            objects.append(obj)
+        program = os.path.join(self.directory, 'main')
+        subprocess.check_call(['cc'] + objects + ['-o', program])
+        self.assertEqual(self.section_strings(program), ['/tmp/.{}.o.bc'.format(n) for n in ('foo', 'bar', 'baz', 'main')])
+        self.assertEqual(subprocess.call([program], stderr=subprocess.DEVNULL), 0)
+
+    def test_attach_falls_back(self):
+        """
+        Checks objcopy gets the line when we cannot append it, and a deleted object is no failure
+        :return:
+        """
+        if shutil.which('cc') is None or shutil.which('objcopy') is None or shutil.which('readelf') is None:
+            self.skipTest('requires cc, objcopy and readelf')
+        obj = os.path.join(self.directory, 'foo.o')
+        subprocess.check_call(['cc', '-c', os.path.join(test_files_directory, 'foo.c'), '-o', obj])
+        with mock.patch('wllvm.elf.appendToSection', side_effect=PermissionError(obj)):
+            attachLineToObject('/tmp/.foo.o.bc', obj)
+        self.assertEqual(self.section_strings(obj), ['/tmp/.foo.o.bc'])
+        with self.assertRaises(SystemExit) as cm:
+            attachLineToObject('/tmp/.gone.o.bc', os.path.join(self.directory, 'gone.o'))
+        self.assertEqual(cm.exception.code, 0)
+
+
+class ElfReaderTest(unittest.TestCase):
+    """
+    Checks the section reader extract-bc uses against objdump
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the scratch directory
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def sections(self, path):
+        with mappedFile(path) as data:
+            return getSections(data)
+
+    def test_all_classes_and_byte_orders(self):
+        """
+        Checks 32/64 bit, little/big endian objects, with and without our section
+        :return:
+        """
+        for (elfClass, elfData, machine) in ((ELFCLASS32, ELFDATA2LSB, 3), (ELFCLASS64, ELFDATA2LSB, 62),
+                                             (ELFCLASS32, ELFDATA2MSB, 20), (ELFCLASS64, ELFDATA2MSB, 21)):
+            path = os.path.join(self.directory, 'x{}{}.o'.format(elfClass, elfData))
+            make_object(path, elfClass, elfData, machine)
+            ehsize = 52 if elfClass == ELFCLASS32 else 64
+            self.assertEqual(self.sections(path), {'.text': (16, ehsize), '.shstrtab': (17, ehsize + 16)})
+            self.assertTrue(appendToSection(path, '.llvm_bc', b'/tmp/.x.o.bc\n'))
+            (size, offset) = self.sections(path)['.llvm_bc']
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read()[offset:offset + size], b'/tmp/.x.o.bc\n')
+            self.assertEqual(extract_section_linux(path), ['/tmp/.x.o.bc', ''])
+
+    def test_not_elf(self):
+        """
+        Checks that empty, truncated and non ELF files are not read
+        :return:
+        """
+        path = os.path.join(self.directory, 'x.o')
+        make_object(path, ELFCLASS64, ELFDATA2LSB, 62)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertIsNone(getSections(data[:40]))
+        self.assertIsNone(getSections(data[:-8]))
+        self.assertIsNone(getSections(b'not an object\n'))
+        open(path, 'w').close()
+        self.assertIsNone(self.sections(path))
+
+    def test_same_as_objdump(self):
+        """
+        Checks objects, and an executable linked from them, against objdump
+        :return:
+        """
+        if shutil.which('cc') is None or shutil.which('objdump') is None:
+            self.skipTest('requires cc and objdump')
+        objects = []
+        for name in ('foo', 'bar', 'baz', 'main'):
+            obj = os.path.join(self.directory, name + '.o')
+            subprocess.check_call(['cc', '-g', '-c', os.path.join(test_files_directory, name + '.c'), '-o', obj])
+            self.assertTrue(appendToSection(obj, '.llvm_bc', '/tmp/.{}.o.bc\n'.format(name).encode()))
+            objects.append(obj)
+        program = os.path.join(self.directory, 'main')
+        subprocess.check_call(['cc'] + objects + ['-o', program])
+        for path in objects + [program]:
+            # objdump -h leaves out the relocations, symbols and string tables
+            sections = self.sections(path)
+            for (name, entry) in getObjdumpSectionSizesAndOffsets(path).items():
+                self.assertEqual(sections.get(name), entry, (path, name))
+        self.assertEqual(extract_section_linux(program),
+                         ['/tmp/.{}.o.bc'.format(n) for n in ('foo', 'bar', 'baz', 'main')] + [''])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from wllvm.filetype import FileType, _fileTypeCacheSize
+
+test_files_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_files")
+
+
+def file_type_via_file(path):
+    """
+    The way FileType.getFileType used to work: grep the output of file(1)
+    :return:
+    """
+    foutput = subprocess.check_output(['file', os.path.realpath(path)]).decode().split(' ', 1)[1]
+    if 'ELF' in foutput and 'executable' in foutput:
+        return FileType.ELF_EXECUTABLE
+    if 'Mach-O' in foutput and 'executable' in foutput:
+        return FileType.MACH_EXECUTABLE
+    if 'ELF' in foutput and 'shared' in foutput:
+        return FileType.ELF_SHARED
+    if 'Mach-O' in foutput and 'dynamically linked shared' in foutput:
+        return FileType.MACH_SHARED
+    if 'current ar archive' in foutput:
+        return FileType.ARCHIVE
+    if 'thin archive' in foutput:
+        return FileType.THIN_ARCHIVE
+    if 'ELF' in foutput and 'relocatable' in foutput:
+        return FileType.ELF_OBJECT
+    if 'Mach-O' in foutput and 'object' in foutput:
+        return FileType.MACH_OBJECT
+    return FileType.UNKNOWN
+
+
+class FileTypeTest(unittest.TestCase):
+    """
+    Checks the magic number based FileType against file(1)
+    """
+
+    def setUp(self):
+        """
+        Builds a few objects, executables, libraries and archives
+        :return:
+        """
+        if shutil.which('cc') is None or shutil.which('ar') is None:
+            self.skipTest('requires cc and ar')
+        self.directory = tempfile.mkdtemp()
+        self.files = {}
+
+        def build(name, *args):
+            path = os.path.join(self.directory, name)
+            subprocess.check_call(list(args) + ['-o', path], cwd=self.directory)
+            self.files[name] = path
+
+        sources = [os.path.join(test_files_directory, f) for f in ('foo.c', 'bar.c', 'baz.c', 'main.c')]
+        for source in sources:
+            build(os.path.basename(source)[:-2] + '.o', 'cc', '-c', '-fPIC', source)
+        objects = [self.files[n] for n in ('foo.o', 'bar.o', 'baz.o')]
+        build('main', 'cc', *(objects + [self.files['main.o']]))
+        build('main.pie', 'cc', '-pie', '-fPIE', *sources)
+        build('main.nopie', 'cc', '-no-pie', *sources)
+        build('libfoo.so', 'cc', '-shared', *objects)
+        for (name, flags) in (('libfoo.a', 'cr'), ('libthin.a', 'crT')):
+            path = os.path.join(self.directory, name)
+            subprocess.check_call(['ar', flags, path] + objects)
+            self.files[name] = path
+        self.files['text'] = os.path.join(test_files_directory, 'foo.c')
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_agrees_with_file(self):
+        """
+        Checks that we classify everything the way file(1) did
+        :return:
+        """
+        if shutil.which('file') is None:
+            self.skipTest('requires file')
+        for (name, path) in self.files.items():
+            self.assertEqual(FileType.getFileTypeString(FileType.getFileType(path)),
+                             FileType.getFileTypeString(file_type_via_file(path)), name)
+
+    def test_expected_types(self):
+        """
+        Checks the types we expect for each kind of file
+        :return:
+        """
+        expected = {'foo.o': 'ELF_OBJECT', 'main.nopie': 'ELF_EXECUTABLE', 'main.pie': 'ELF_EXECUTABLE',
+                    'libfoo.so': 'ELF_SHARED', 'libfoo.a': 'ARCHIVE', 'libthin.a': 'THIN_ARCHIVE', 'text': 'UNKNOWN'}
+        for (name, typeName) in expected.items():
+            self.assertEqual(FileType.getFileTypeString(FileType.getFileType(self.files[name])), typeName, name)
+        self.assertEqual(FileType.getFileType(os.path.join(self.directory, 'missing')), FileType.UNKNOWN)
+
+    def test_notices_changes(self):
+        """
+        Checks that the memoized answer is dropped when the file changes
+        :return:
+        """
+        path = os.path.join(self.directory, 'changes')
+        shutil.copyfile(self.files['foo.o'], path)
+        self.assertEqual(FileType.getFileType(path), FileType.ELF_OBJECT)
+        shutil.copyfile(self.files['libfoo.a'], path)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual(FileType.getFileType(path), FileType.ARCHIVE)
+
+    def test_bounded(self):
+        """
+        Checks that the memoized answers do not pile up without end
+        :return:
+        """
+        for n in range(_fileTypeCacheSize + 10):
+            path = os.path.join(self.directory, f'many.{n}')
+            with open(path, 'wb'):
+                pass
+            self.assertEqual(FileType.getFileType(path), FileType.UNKNOWN)
+        self.assertEqual(FileType._getCachedFileType.cache_info().currsize, _fileTypeCacheSize)
+        self.assertEqual(FileType.getFileType(self.files['foo.o']), FileType.ELF_OBJECT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from wllvm.jobserver import JobServer, jobSlot
+from wllvm.compilers import runInParallel
+
+
+class FakeJobServerTest(unittest.TestCase):
+    """
+    Plays the part of make: a pipe (or fifo) holding the tokens, advertised in MAKEFLAGS.
+    """
+    tokens = 2
+
+    def setUp(self):
+        """
+        Creates the jobserver pipe and fills it with tokens
+        :return:
+        """
+        self.saved_makeflags = os.environ.get('MAKEFLAGS')
+        (self.readFd, self.writeFd) = os.pipe()
+        os.write(self.writeFd, b'+' * self.tokens)
+        os.environ['MAKEFLAGS'] = ' -j{} --jobserver-auth={},{}'.format(self.tokens + 1, self.readFd, self.writeFd)
+
+    def tearDown(self):
+        """
+        Restores MAKEFLAGS and closes the pipe
+        :return:
+        """
+        if self.saved_makeflags is None:
+            del os.environ['MAKEFLAGS']
+        else:
+            os.environ['MAKEFLAGS'] = self.saved_makeflags
+        os.close(self.readFd)
+        os.close(self.writeFd)
+
+    def tokens_in_pipe(self):
+        """
+        Drains the pipe, returning the number of tokens that were in it
+        :return:
+        """
+        os.set_blocking(self.readFd, False)
+        try:
+            return len(os.read(self.readFd, 64))
+        except BlockingIOError:
+            return 0
+        finally:
+            os.set_blocking(self.readFd, True)
+
+    def test_parses_makeflags(self):
+        """
+        Checks the flavours of MAKEFLAGS we can come across
+        :return:
+        """
+        self.assertIsNone(JobServer.fromMakeflags(None))
+        self.assertIsNone(JobServer.fromMakeflags('k -j1'))
+        server = JobServer.fromMakeflags(os.environ['MAKEFLAGS'])
+        self.assertEqual((server.readFd, server.writeFd), (self.readFd, self.writeFd))
+        server = JobServer.fromMakeflags(' -j3 --jobserver-fds={},{} -j'.format(self.readFd, self.writeFd))
+        self.assertEqual((server.readFd, server.writeFd), (self.readFd, self.writeFd))
+        # make closes the pipe for commands that are not recursive makes
+        self.assertIs(JobServer.fromMakeflags(' -j3 --jobserver-auth=97,98'), False)
+        self.assertIs(JobServer.fromMakeflags(' -j3 --jobserver-auth=-2,-2'), False)
+        # descriptors that are not a pipe, or not a pair of them
+        with tempfile.TemporaryFile() as f:
+            self.assertIs(JobServer.fromMakeflags(' -j3 --jobserver-auth={0},{0}'.format(f.fileno())), False)
+        self.assertIs(JobServer.fromMakeflags(' -j3 --jobserver-auth={}'.format(self.readFd)), False)
+        self.assertIs(JobServer.fromMakeflags(' -j3 --jobserver-auth=x,y'), False)
+
+    def test_acquire_and_release(self):
+        """
+        Checks that the implicit slot is used first, and that tokens go back to make
+        :return:
+        """
+        server = JobServer.fromMakeflags(os.environ['MAKEFLAGS'])
+        held = [server.acquire() for _ in range(self.tokens + 1)]
+        self.assertEqual(held, [None] + [b'+'] * self.tokens)
+        for token in held:
+            server.release(token)
+        self.assertEqual(self.tokens_in_pipe(), self.tokens)
+
+    def test_stays_within_budget(self):
+        """
+        Checks that a wide pool never runs more jobs than make allows
+        :return:
+        """
+        lock = threading.Lock()
+        state = {'running': 0, 'most': 0}
+
+        def task(_):
+            with jobSlot():
+                with lock:
+                    state['running'] += 1
+                    state['most'] = max(state['most'], state['running'])
+                time.sleep(0.05)
+                with lock:
+                    state['running'] -= 1
+
+        saved_jobs = os.environ.get('WLLVM_JOBS')
+        os.environ['WLLVM_JOBS'] = '8'
+        try:
+            runInParallel(task, [(i,) for i in range(12)])
+        finally:
+            if saved_jobs is None:
+                del os.environ['WLLVM_JOBS']
+            else:
+                os.environ['WLLVM_JOBS'] = saved_jobs
+
+        self.assertEqual(state['most'], self.tokens + 1)
+        self.assertEqual(self.tokens_in_pipe(), self.tokens)
+
+
+class FifoJobServerTest(unittest.TestCase):
+    """
+    The named fifo style of jobserver used by make 4.4 and later.
+    """
+
+    def test_fifo(self):
+        """
+        Checks that we take and return tokens through the fifo
+        :return:
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            fifo = os.path.join(directory, 'GMfifo')
+            os.mkfifo(fifo)
+            keeper = os.open(fifo, os.O_RDWR)
+            os.write(keeper, b'ab')
+            server = JobServer.fromMakeflags(' -j3 --jobserver-auth=fifo:{}'.format(fifo))
+            self.assertEqual([server.acquire() for _ in range(3)], [None, b'a', b'b'])
+            server.release(b'a')
+            self.assertEqual(os.read(keeper, 1), b'a')
+            os.close(server.readFd)
+            os.close(keeper)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from wllvm.arglistfilter import ArgumentListFilter
+from wllvm.compilers import execCompiler
+from wllvm.launcher import isNoBitcodeInvocation
+
+
+class LauncherTest(unittest.TestCase):
+    """
+    Checks the quick look at the arguments against ArgumentListFilter
+    """
+
+    def setUp(self):
+        """
+        Makes sure configure only mode is off
+        :return:
+        """
+        self.saved = os.environ.pop('WLLVM_CONFIGURE_ONLY', None)
+
+    def tearDown(self):
+        """
+        Restores the environment
+        :return:
+        """
+        if self.saved is not None:
+            os.environ['WLLVM_CONFIGURE_ONLY'] = self.saved
+
+    def test_agrees_with_filter(self):
+        """
+        Checks that whenever the launcher skips the bitcode, so would wcompile
+        :return:
+        """
+        invocations = [
+            [],
+            ['--version'],
+            ['-v'],
+            ['-dumpmachine'],
+            ['-print-prog-name=ld'],
+            ['-E', 'foo.c'],
+            ['-E', '-o', 'foo.i', 'foo.c'],
+            ['-M', 'foo.c'],
+            ['-MM', '-MF', 'foo.d', 'foo.c'],
+            ['-S', 'foo.c', '-o', 'foo.s'],
+            ['-x', 'c', '-', '-o', 'foo.o'],
+            ['-c', 'foo.c'],
+            ['-c', '-MD', '-MF', 'foo.d', 'foo.c'],
+            ['-c', '-MM', 'foo.c'],
+            ['-v', '-c', 'foo.c'],
+            ['-c', 'foo.c', '-o', '-E'],
+            ['-c', 'foo.c', '-dead_strip', '-E'],
+            ['foo.o', 'bar.o', '-o', 'prog'],
+            ['@args.rsp'],
+            ['-c', 'foo.c', '-mllvm', '-E'],
+            ['-c', 'foo.c', '-isystem', '-E'],
+            ['-c', 'foo.c', '-D', '-M'],
+            ['-c', 'foo.c', '--param', '-S'],
+            ['-c', 'foo.c', '-Xarch_x86_64', '-E'],
+        ]
+        for args in invocations:
+            (skipit, _) = ArgumentListFilter(list(args)).skipBitcodeGeneration()
+            if isNoBitcodeInvocation(args):
+                self.assertTrue(skipit, args)
+
+    def test_fast_paths(self):
+        """
+        Checks the common cases do take the fast path
+        :return:
+        """
+        for args in (['-E', 'foo.c'], ['-M', 'foo.c'], ['--version'], ['-S', 'foo.c']):
+            self.assertTrue(isNoBitcodeInvocation(args), args)
+        for args in (['-c', 'foo.c'], ['-c', 'foo.c', '-o', '-E'], ['foo.o', '-o', 'prog']):
+            self.assertFalse(isNoBitcodeInvocation(args), args)
+        for args in (['-c', 'foo.c', '-mllvm', '-E'], ['-c', 'foo.c', '-MF', '-M'], ['-c', 'foo.c', '-Xarch_x86_64', '-E'],
+                     ['-c', 'foo.c', '-unknown', '-E']):
+            self.assertFalse(isNoBitcodeInvocation(args), args)
+        for args in (['-O2', '-Wall', '-DFOO', '-I', 'inc', '-E', 'foo.c'], ['-std=c99', '-MM', 'foo.c']):
+            self.assertTrue(isNoBitcodeInvocation(args), args)
+        os.environ['WLLVM_CONFIGURE_ONLY'] = '1'
+        self.assertTrue(isNoBitcodeInvocation(['-c', 'foo.c']))
+        del os.environ['WLLVM_CONFIGURE_ONLY']
+
+
+class ExecCompilerTest(unittest.TestCase):
+    """
+    Checks what happens before the wrapper becomes the compiler
+    """
+
+    def test_flushes_logging(self):
+        """
+        Checks held log records are written out before the exec
+        :return:
+        """
+        events = []
+        env = {'LLVM_COMPILER': 'clang', 'LLVM_COMPILER_PATH': '', 'WLLVM_METRICS_DIR': ''}
+        with mock.patch.dict(os.environ, env), \
+             mock.patch('wllvm.compilers.getParentCommand', return_value='make'), \
+             mock.patch('wllvm.compilers.flushLogging', side_effect=lambda: events.append('flush')), \
+             mock.patch('os.execvp', side_effect=lambda *args: events.append(args)):
+            execCompiler('wllvm', ['-E', 'foo.c'])
+        self.assertEqual(events, ['flush', ('clang', ['clang', '-E', 'foo.c'])])
+
+    def test_no_argument_tables(self):
+        """
+        Checks getting to the exec does not import the argument tables
+        :return:
+        """
+        script = 'import sys; import wllvm.compilers; print("wllvm.arglistfilter" in sys.modules)'
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+        self.assertEqual(output.decode().strip(), 'False')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.logconfig import AppendHandler, resetLogging
+
+
+class LogConfigTest(unittest.TestCase):
+    """
+    Configures logging once, and appends whole records to a shared log file
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory to hold the log
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'wllvm.log')
+
+    def tearDown(self):
+        """
+        Puts logging back as the environment has it, and removes the log
+        :return:
+        """
+        resetLogging()
+        shutil.rmtree(self.directory)
+
+    def test_level(self):
+        """
+        Checks WLLVM_OUTPUT_LEVEL reaches loggers that never called logConfig, and only them
+        :return:
+        """
+        with mock.patch.dict(os.environ, {'WLLVM_OUTPUT_LEVEL': 'info'}):
+            resetLogging()
+            self.assertTrue(logging.getLogger('wllvm.arglistfilter').isEnabledFor(logging.INFO))
+            self.assertFalse(logging.getLogger('wllvm.arglistfilter').isEnabledFor(logging.DEBUG))
+            self.assertFalse(logging.getLogger('elsewhere').isEnabledFor(logging.INFO))
+        with mock.patch.dict(os.environ, {'WLLVM_OUTPUT_LEVEL': ''}):
+            resetLogging()
+            self.assertFalse(logging.getLogger('wllvm.compilers').isEnabledFor(logging.INFO))
+
+    def test_buffered(self):
+        """
+        Checks records are held until there is a buffer full, a warning, or a flush
+        :return:
+        """
+        handler = AppendHandler(self.log, capacity=100)
+        logger = logging.getLogger('wllvm.test.buffered')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            logger.info('held')
+            self.assertEqual(os.path.getsize(self.log), 0)
+            logger.warning('written')
+            self.assertEqual(self.read(), ['held', 'written'])
+            # fifty bytes a record, so two fill the buffer
+            for i in range(9):
+                logger.info('%d%s', i, 'x' * 48)
+            self.assertEqual(len(self.read()), 2 + 8)
+            handler.flush()
+            self.assertEqual(len(self.read()), 2 + 9)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+    def test_concurrent(self):
+        """
+        Checks the records of processes logging at once come out whole
+        :return:
+        """
+        writers = []
+        for i in range(8):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    handler = AppendHandler(self.log, capacity=4096)
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    for j in range(500):
+                        handler.handle(logging.makeLogRecord({'msg': f'{i}:{j}:' + 'x' * (j % 300)}))
+                    handler.close()
+                finally:
+                    os._exit(0)
+            writers.append(pid)
+        for pid in writers:
+            os.waitpid(pid, 0)
+        lines = self.read()
+        self.assertEqual(len(lines), 8 * 500)
+        for line in lines:
+            (i, j, xs) = line.split(':')
+            self.assertEqual(xs, 'x' * (int(j) % 300), line)
+        self.assertEqual(len(set(lines)), len(lines))
+
+    def read(self):
+        with open(self.log) as f:
+            return f.read().splitlines()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.metrics import (metricsPhase, noteBitcodeFile, noteInvocation, percentile, readEntries,
+                           runWithMetrics, summarize, waitProcess)
+
+
+def compile_twice():
+    noteInvocation(argvClass='compile', tu='foo.c')
+    with metricsPhase('compile'):
+        waitProcess(subprocess.Popen([sys.executable, '-c', 'pass']))
+    with metricsPhase('bitcode'):
+        rc = waitProcess(subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(3)']))
+    noteBitcodeFile(__file__)
+    return rc
+
+
+def fail():
+    with metricsPhase('link'):
+        sys.exit(2)
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    Records metrics for stand in invocations, and reports on them
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch metrics directory
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def test_off_by_default(self):
+        """
+        Checks that nothing is recorded without WLLVM_METRICS_DIR
+        :return:
+        """
+        with mock.patch.dict(os.environ, {'WLLVM_METRICS_DIR': ''}):
+            self.assertEqual(runWithMetrics('wllvm', compile_twice), 3)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_record(self):
+        """
+        Checks an entry has the phases, their child usage, and the exit status
+        :return:
+        """
+        with mock.patch.dict(os.environ, {'WLLVM_METRICS_DIR': self.directory}):
+            self.assertEqual(runWithMetrics('wllvm', compile_twice), 3)
+            with self.assertRaises(SystemExit):
+                runWithMetrics('wllvm', fail)
+        (entry, failed) = readEntries(self.directory)
+        self.assertEqual((entry['tool'], entry['rc'], entry['argvClass'], entry['tu']), ('wllvm', 3, 'compile', 'foo.c'))
+        self.assertEqual(sorted(entry['phases']), ['bitcode', 'compile'])
+        self.assertEqual((entry['bitcodeFiles'], entry['bitcodeBytes']), (1, os.path.getsize(__file__)))
+        for phase in entry['phases'].values():
+            self.assertEqual(phase['count'], 1)
+            self.assertGreater(phase['wall'], 0)
+            self.assertGreater(phase['user'] + phase['sys'], 0)
+            self.assertGreater(phase['maxrss'], 0)
+        self.assertGreaterEqual(entry['wall'], entry['phases']['compile']['wall'] + entry['phases']['bitcode']['wall'])
+        self.assertEqual((failed['rc'], list(failed['phases'])), (2, ['link']))
+
+    def test_profiles(self):
+        """
+        Checks the bitcode files are added up per profile
+        :return:
+        """
+        def entry(profile, files, size, wall):
+            return {'tool': 'wllvm', 'wall': wall, 'rc': 0, 'bitcodeProfile': profile, 'bitcodeFiles': files,
+                    'bitcodeBytes': size,
+                    'phases': {'bitcode': {'count': files, 'wall': wall, 'user': wall, 'sys': 0.0, 'maxrss': 100}}}
+        summary = summarize([entry('full', 1, 4000, 2.0), entry('full', 2, 6000, 3.0), entry('fast', 1, 1000, 0.5),
+                             {'tool': 'wllvm', 'wall': 1.0, 'rc': 0, 'bitcodeProfile': 'fast', 'phases': {}}])
+        self.assertEqual(summary['profiles'], {
+            'full': {'invocations': 2, 'files': 3, 'bytes': 10000, 'wall': 5.0, 'cpu': 5.0},
+            'fast': {'invocations': 1, 'files': 1, 'bytes': 1000, 'wall': 0.5, 'cpu': 0.5},
+        })
+
+    def test_summarize(self):
+        """
+        Checks the totals, percentiles and worst translation units
+        :return:
+        """
+        def entry(tu, wall, compile_):
+            return {'tool': 'wllvm', 'argvClass': 'compile', 'tu': tu, 'cwd': '/src', 'wall': wall, 'rc': 0,
+                    'phases': {'compile': {'count': 1, 'wall': compile_, 'user': compile_, 'sys': 0.0, 'maxrss': 100}}}
+        entries = [entry(f'{i}.c', 2.0 * i, 1.0 * i) for i in range(1, 11)]
+        summary = summarize(entries, top=3)
+        self.assertEqual(summary['invocations'], 10)
+        self.assertEqual(summary['classes'], {'compile': 10})
+        self.assertAlmostEqual(summary['wall'], 110.0)
+        self.assertAlmostEqual(summary['addedWall'], 55.0)
+        compile_ = summary['phases']['compile']
+        self.assertEqual((compile_['p50'], compile_['p90'], compile_['max']), (5.0, 9.0, 10.0))
+        self.assertEqual([w['tu'] for w in summary['worst']], ['10.c', '9.c', '8.c'])
+        self.assertEqual(summary['profiles'], {})
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([1.0], 99), 1.0)
+
+    def test_compile_and_link(self):
+        """
+        Checks the hidden object compiles and their link count as the compile asked for, unless it ran as given
+        :return:
+        """
+        def phase(wall):
+            return {'count': 1, 'wall': wall, 'user': wall, 'sys': 0.0, 'maxrss': 100}
+        entries = [{'tool': 'wllvm', 'argvClass': 'compile-and-link', 'wall': 10.0, 'rc': 0,
+                    'phases': {'object': phase(3.0), 'link': phase(1.0), 'bitcode': phase(4.0)}},
+                   {'tool': 'wllvm', 'argvClass': 'compile-and-link', 'wall': 10.0, 'rc': 0,
+                    'phases': {'compile': phase(2.0), 'object': phase(3.0), 'link': phase(1.0)}}]
+        summary = summarize(entries)
+        self.assertAlmostEqual(summary['compileWall'], 6.0)
+        self.assertAlmostEqual(summary['addedWall'], 14.0)
+        self.assertEqual(sorted(summary['phases']), ['bitcode', 'compile', 'link', 'object'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from wllvm.compilers import getParentCommand
+
+
+class ParentCommandTest(unittest.TestCase):
+    """
+    Checks the command name of a process, from /proc and from ps
+    """
+
+    def setUp(self):
+        """
+        Starts a child named ccache, which sleeps until we are done with it
+        :return:
+        """
+        sleep = shutil.which('sleep')
+        if sleep is None:
+            self.skipTest('requires sleep')
+        self.directory = tempfile.mkdtemp()
+        ccache = os.path.join(self.directory, 'ccache')
+        shutil.copy(sleep, ccache)
+        self.child = subprocess.Popen([ccache, '60'])
+        # the child can go on looking like us for a moment after Popen returns
+        for _ in range(100):
+            if not os.path.isdir('/proc') or self.comm(self.child.pid) == 'ccache':
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        """
+        Stops the child, and removes its directory
+        :return:
+        """
+        self.child.kill()
+        self.child.wait()
+        shutil.rmtree(self.directory)
+
+    def comm(self, pid):
+        with open(f'/proc/{pid}/comm') as f:
+            return f.read().strip()
+
+    def goneProcess(self):
+        """
+        The pid of a process that has exited and been waited for
+        :return:
+        """
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        return proc.pid
+
+    def withoutProc(self, error=FileNotFoundError):
+        """
+        Makes /proc look missing (or unreadable) to getParentCommand
+        :return:
+        """
+        return mock.patch('wllvm.compilers.open', create=True, side_effect=error('/proc'))
+
+    def requirePs(self):
+        if shutil.which('ps') is None:
+            self.skipTest('requires ps')
+
+    def test_known_pid(self):
+        """
+        Checks the name of our child, and of our own parent
+        :return:
+        """
+        if not os.path.isdir('/proc'):
+            self.skipTest('requires /proc')
+        self.assertEqual(getParentCommand(self.child.pid), 'ccache')
+        self.assertEqual(getParentCommand(), self.comm(os.getppid()))
+
+    def test_no_proc(self):
+        """
+        Checks ps is asked when /proc is missing or unreadable
+        :return:
+        """
+        self.requirePs()
+        for error in (FileNotFoundError, PermissionError):
+            with self.withoutProc(error):
+                self.assertEqual(getParentCommand(self.child.pid), 'ccache')
+
+    def test_empty_name(self):
+        """
+        Checks an empty name comes back empty, from /proc or from ps
+        :return:
+        """
+        with mock.patch('wllvm.compilers.open', create=True, return_value=io.StringIO('\n')):
+            self.assertEqual(getParentCommand(self.child.pid), '')
+        with self.withoutProc(), mock.patch('subprocess.check_output', return_value='\n'):
+            self.assertEqual(getParentCommand(self.child.pid), '')
+
+    def test_gone(self):
+        """
+        Checks a process that does not exist has the empty name, and so does one ps cannot be run for
+        :return:
+        """
+        pid = self.goneProcess()
+        self.assertEqual(getParentCommand(pid), '')
+        with self.withoutProc():
+            self.requirePs()
+            self.assertEqual(getParentCommand(pid), '')
+            with mock.patch('subprocess.check_output', side_effect=FileNotFoundError('ps')):
+                self.assertEqual(getParentCommand(self.child.pid), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.compilers import ClangBuilder, wcompile
+from wllvm.preprocess import getPreprocessedSuffix, withoutPreprocessorArgs
+
+
+# gcc builds the objects; the "bitcode" is a copy of the source it was compiled from.
+stub_compiler = """#!/bin/sh
+for arg in "$@"; do
+    if [ "$arg" = -emit-llvm ]; then
+        while [ $# -gt 0 ]; do
+            case "$1" in
+                -c) src="$2"; shift ;;
+                -o) out="$2"; shift ;;
+            esac
+            shift
+        done
+        echo bitcode >> "$(dirname "$0")/runs"
+        exec cp "$src" "$out"
+    fi
+done
+exec gcc "$@"
+"""
+
+
+class PreprocessOnceTest(unittest.TestCase):
+    """
+    Checks which compiles WLLVM_PREPROCESS_ONCE takes on, without a compiler
+    """
+
+    def suffix(self, cmd, mode='wllvm'):
+        builder = ClangBuilder(cmd, mode)
+        return getPreprocessedSuffix(builder, builder.getBitcodeArglistFilter())
+
+    def test_suffixes(self):
+        """
+        Checks the preprocessed suffix follows the language
+        :return:
+        """
+        self.assertEqual(self.suffix(['-c', 'foo.c']), '.i')
+        self.assertEqual(self.suffix(['-c', 'foo.cpp', '-o', 'foo.o']), '.ii')
+        self.assertEqual(self.suffix(['-c', 'foo.c'], 'wllvm++'), '.ii')
+        self.assertEqual(self.suffix(['-c', '-MD', '-MF', 'foo.d', 'foo.c']), '.i')
+
+    def test_declined(self):
+        """
+        Checks the compiles we leave alone
+        :return:
+        """
+        for cmd in (['foo.c', '-o', 'foo'],
+                    ['-c', 'foo.c', 'bar.c'],
+                    ['-c', 'foo.m'],
+                    ['-c', '-x', 'c', 'foo.txt'],
+                    ['-c', '-Wp,-MD,foo.d', 'foo.c'],
+                    ['-c', '-save-temps', 'foo.c'],
+                    ['-c', 'foo.c', '-MT', 'foo.c']):
+            self.assertIsNone(self.suffix(cmd), cmd)
+        self.assertIsNone(self.suffix(['-c', 'foo.f'], 'wfortran'))
+
+    def test_without_preprocessor_args(self):
+        """
+        Checks the preprocessor flags, and their values, go
+        :return:
+        """
+        args = ['-O2', '-DX=1', '-D', 'Y', '-Iinc', '-I', 'inc2', '-include', 'config.h', '-g', '-Wall']
+        self.assertEqual(withoutPreprocessorArgs(args), ['-O2', '-g', '-Wall'])
+
+
+class PreprocessOnceCacheTest(unittest.TestCase):
+    """
+    Compiles with WLLVM_PREPROCESS_ONCE and WLLVM_BC_CACHE, with a stub bitcode compiler
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch build directory, its sources, the cache directory and the stub compiler
+        :return:
+        """
+        if shutil.which('gcc') is None or shutil.which('objcopy') is None:
+            self.skipTest('requires gcc and objcopy')
+        self.directory = tempfile.mkdtemp()
+        self.build = os.path.join(self.directory, 'build')
+        os.makedirs(self.build)
+        compiler = os.path.join(self.directory, 'clang')
+        with open(compiler, 'w') as f:
+            f.write(stub_compiler)
+        os.chmod(compiler, 0o755)
+        for name in ('foo', 'bar'):
+            with open(os.path.join(self.build, f'{name}.c'), 'w') as f:
+                f.write(f'int {name}(void) {{ return 0; }}\n')
+        env = {'LLVM_COMPILER': 'clang', 'LLVM_COMPILER_PATH': self.directory, 'WLLVM_BITCODE_MODE': 'attach',
+               'WLLVM_PREPROCESS_ONCE': '1', 'WLLVM_BC_CACHE': os.path.join(self.directory, 'cache'),
+               'WLLVM_CONCURRENT_BITCODE': '', 'WLLVM_METRICS_DIR': ''}
+        self.env = mock.patch.dict(os.environ, env)
+        self.env.start()
+        self.cwd = os.getcwd()
+        os.chdir(self.build)
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        os.chdir(self.cwd)
+        self.env.stop()
+        shutil.rmtree(self.directory)
+
+    def wllvm(self, *args):
+        """
+        Runs wllvm with args, returning its exit status
+        :return:
+        """
+        with mock.patch.object(sys, 'argv', ['wllvm'] + list(args)):
+            try:
+                return wcompile('wllvm')
+            except SystemExit as e:
+                return e.code
+
+    def bitcodeCompiles(self):
+        runs = os.path.join(self.directory, 'runs')
+        if not os.path.exists(runs):
+            return 0
+        with open(runs) as f:
+            return len(f.read().splitlines())
+
+    def bitcode(self, name):
+        with open(f'.{name}.o.bc') as f:
+            return f.read()
+
+    def test_own_bitcode(self):
+        """
+        Checks each source gets bitcode of its own from the cache, and the same source hits it
+        :return:
+        """
+        for name in ('foo', 'bar'):
+            self.assertEqual(self.wllvm('-c', f'{name}.c'), 0)
+            self.assertIn(f'int {name}(void)', self.bitcode(name))
+        self.assertNotIn('int foo(void)', self.bitcode('bar'))
+        self.assertEqual(self.bitcodeCompiles(), 2)
+        os.remove('.foo.o.bc')
+        self.assertEqual(self.wllvm('-c', 'foo.c'), 0)
+        self.assertIn('int foo(void)', self.bitcode('foo'))
+        self.assertEqual(self.bitcodeCompiles(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+from unittest import mock
+
+from wllvm.compilers import ClangBuilder, filterBitcodeArgs, getBitcodeProfile
+
+compile_args = ['-O2', '-g', '-gdwarf-4', '-Wall', '-fsanitize=address', '-fno-sanitize-recover=all',
+                '-pg', '-fprofile-instr-generate', '--coverage', '-DNDEBUG', '-Xclang', '-ggnu-pubnames',
+                '-gcc-toolchain', '/opt/gcc']
+
+
+class BitcodeProfileTest(unittest.TestCase):
+    """
+    Checks which flags each WLLVM_BITCODE_PROFILE lets into the bitcode compile
+    """
+
+    def test_full(self):
+        """
+        Checks the full profile keeps everything
+        :return:
+        """
+        self.assertEqual(filterBitcodeArgs(compile_args, 'full'), compile_args)
+
+    def test_nodebug(self):
+        """
+        Checks the nodebug profile drops just the debug info flags
+        :return:
+        """
+        self.assertEqual(filterBitcodeArgs(compile_args, 'nodebug'),
+                         ['-O2', '-Wall', '-fsanitize=address', '-fno-sanitize-recover=all', '-pg',
+                          '-fprofile-instr-generate', '--coverage', '-DNDEBUG', '-Xclang', '-ggnu-pubnames',
+                          '-gcc-toolchain', '/opt/gcc'])
+
+    def test_fast(self):
+        """
+        Checks the fast profile drops the debug, sanitizer and profiling flags, and the passes
+        :return:
+        """
+        self.assertEqual(filterBitcodeArgs(compile_args, 'fast'),
+                         ['-O2', '-Wall', '-DNDEBUG', '-Xclang', '-ggnu-pubnames', '-gcc-toolchain', '/opt/gcc'])
+        with mock.patch.dict(os.environ, {'WLLVM_BITCODE_PROFILE': 'fast', 'LLVM_BITCODE_GENERATION_FLAGS': ''}):
+            builder = ClangBuilder(['-c', 'foo.c'], 'wllvm')
+            self.assertEqual(builder.getBitcodeCompiler(), ['clang', '-emit-llvm', '-Xclang', '-disable-llvm-passes'])
+            self.assertEqual(builder.getBitcodeArgs(['-O1', '-g']), ['-O1'])
+
+    def test_unknown(self):
+        """
+        Checks an unknown profile means full
+        :return:
+        """
+        with mock.patch.dict(os.environ, {'WLLVM_BITCODE_PROFILE': 'tiny'}):
+            self.assertEqual(getBitcodeProfile(), 'full')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from wllvm.recipe import buildRecipes, formatRecipe, isRecipe, makeRecipe, parseRecipe
+
+# the bitcode compiler writes its -o file, and counts how often it ran
+stub_compiler = """#!/bin/sh
+echo >> "$(dirname "$0")/runs"
+while [ $# -gt 0 ]; do
+    [ "$1" = -o ] && echo bitcode > "$2"
+    shift
+done
+exit 0
+"""
+
+
+class RecipeTest(unittest.TestCase):
+    """
+    Builds bitcode from recipes, with a stub compiler
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch build directory, a cache and the stub compiler
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.build = os.path.join(self.directory, 'build')
+        self.output = os.path.join(self.directory, 'output')
+        os.makedirs(self.build)
+        os.makedirs(self.output)
+        self.compiler = os.path.join(self.directory, 'clang')
+        with open(self.compiler, 'w') as f:
+            f.write(stub_compiler)
+        os.chmod(self.compiler, 0o755)
+        self.env = mock.patch.dict(os.environ, {'WLLVM_BC_CACHE': os.path.join(self.directory, 'cache')})
+        self.env.start()
+        self.cwd = os.getcwd()
+        os.chdir(self.build)
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        os.chdir(self.cwd)
+        self.env.stop()
+        shutil.rmtree(self.directory)
+
+    def recipe(self, name, source='int x;\n'):
+        """
+        Writes name.c, and returns the line the lazy mode would attach for it
+        :return:
+        """
+        with open(f'{name}.c', 'w') as f:
+            f.write(source)
+        return formatRecipe(makeRecipe([self.compiler, '-emit-llvm', '-O2'], f'{name}.c'))
+
+    def runs(self):
+        try:
+            with open(os.path.join(self.directory, 'runs')) as f:
+                return len(f.readlines())
+        except OSError:
+            return 0
+
+    def test_round_trip(self):
+        """
+        Checks a recipe is one line, and comes back as it went in
+        :return:
+        """
+        line = self.recipe('foo')
+        self.assertTrue(isRecipe(line))
+        self.assertNotIn('\n', line)
+        recipe = parseRecipe(line)
+        self.assertEqual(recipe['cwd'], self.build)
+        self.assertEqual(recipe['src'], 'foo.c')
+        self.assertEqual(recipe['cmd'], [self.compiler, '-emit-llvm', '-O2'])
+        self.assertFalse(isRecipe('/path/to/.foo.o.bc'))
+
+    def test_build_once(self):
+        """
+        Checks the recipes are built, once, and the other lines are left alone
+        :return:
+        """
+        lines = ['/path/to/.bar.o.bc', self.recipe('foo'), self.recipe('baz'), '']
+        (built, ok) = buildRecipes(lines, self.output, 2)
+        self.assertTrue(ok)
+        self.assertEqual(self.runs(), 2)
+        self.assertEqual((built[0], built[3]), ('/path/to/.bar.o.bc', ''))
+        for path in built[1:3]:
+            self.assertEqual(os.path.dirname(path), self.output)
+            self.assertTrue(os.path.isfile(path))
+
+        shutil.rmtree(self.output)
+        os.makedirs(self.output)
+        (again, ok) = buildRecipes(lines, self.output, 2)
+        self.assertTrue(ok)
+        self.assertEqual(again, built)
+        self.assertEqual(self.runs(), 2)
+        self.assertTrue(all(os.path.isfile(path) for path in again[1:3]))
+
+    def test_changed_source(self):
+        """
+        Checks that bitcode is not built from a source that changed since its compile
+        :return:
+        """
+        line = self.recipe('foo')
+        with open('foo.c', 'w') as f:
+            f.write('int y;\n')
+        (_, ok) = buildRecipes([line], self.output, 1)
+        self.assertFalse(ok)
+        self.assertEqual(self.runs(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from wllvm.arglistfilter import ArgumentListFilter
+from wllvm.responsefile import readResponseFile, responseFileCommand, splitResponseFile
+
+
+class ResponseFileTest(unittest.TestCase):
+    """
+    Expands response files while parsing, and writes them for long commands
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory to hold the response files
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        os.makedirs(os.path.dirname(name) or '.', exist_ok=True)
+        with open(name, 'w') as f:
+            f.write(text)
+        return name
+
+    def test_split(self):
+        """
+        Checks the whitespace, quoting and escapes
+        :return:
+        """
+        self.assertEqual(list(splitResponseFile('-O2\n  -DX=1\t-c')), ['-O2', '-DX=1', '-c'])
+        self.assertEqual(list(splitResponseFile('-DMSG="hello world" \'-I/a b\' c\\ d e\\"f ""')),
+                         ['-DMSG=hello world', '-I/a b', 'c d', 'e"f', ''])
+        self.assertEqual(list(splitResponseFile('"a\\"b" \'c\\\'d\'')), ['a"b', "c'd"])
+
+    def test_expand(self):
+        """
+        Checks response files, nested ones too, are expanded where they stand
+        :return:
+        """
+        self.write('inner.rsp', '-DINNER "-Iinc dir"')
+        self.write('flags.rsp', '-O2 @inner.rsp -c')
+        af = ArgumentListFilter(['-Wall', '@flags.rsp', 'foo.c', '-o', 'foo.o'])
+        self.assertEqual(af.compileArgs, ['-Wall', '-O2', '-DINNER', '-Iinc dir'])
+        self.assertEqual((af.inputFiles, af.outputFilename, af.isCompileOnly), (['foo.c'], 'foo.o', True))
+
+    def test_flag_spans_files(self):
+        """
+        Checks a flag at the end of a response file takes its value from what follows
+        :return:
+        """
+        self.write('out.rsp', '-c foo.c -o')
+        af = ArgumentListFilter(['@out.rsp', 'foo.o'])
+        self.assertEqual(af.outputFilename, 'foo.o')
+
+    def test_relative_to_response_file(self):
+        """
+        Checks a nested response file is found next to the one naming it
+        :return:
+        """
+        self.write(os.path.join('sub', 'inner.rsp'), '-DINNER')
+        self.write(os.path.join('sub', 'outer.rsp'), '@inner.rsp')
+        af = ArgumentListFilter(['@sub/outer.rsp', '-c', 'foo.c'])
+        self.assertEqual(af.compileArgs, ['-DINNER'])
+
+    def test_cycle_and_missing(self):
+        """
+        Checks a response file including itself stops, and a missing one is an argument
+        :return:
+        """
+        self.write('a.rsp', '-DA @b.rsp')
+        self.write('b.rsp', '-DB @a.rsp')
+        af = ArgumentListFilter(['@a.rsp', '@missing.rsp', '-c', 'foo.c'])
+        self.assertEqual(af.compileArgs, ['-DA', '-DB', '@missing.rsp'])
+
+    def test_write(self):
+        """
+        Checks long commands go in a response file that reads back the same, and is removed
+        :return:
+        """
+        cmd = ['clang', '-DMSG="a b"', "-I'x'", 'back\\slash', '', '-c', 'foo.c']
+        with responseFileCommand(cmd) as short:
+            self.assertIs(short, cmd)
+        with responseFileCommand(cmd, threshold=10) as short:
+            self.assertEqual(len(short), 2)
+            self.assertEqual(short[0], 'clang')
+            path = short[1][1:]
+            self.assertEqual(list(readResponseFile(path)), cmd[1:])
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from wllvm.wparser import parseCommands, readCommands
+
+
+class BatchParseTest(unittest.TestCase):
+    """
+    Runs the wparse-args batch mode over a compile_commands.json and an argv log
+    """
+
+    def setUp(self):
+        """
+        Creates a scratch directory
+        :return:
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        remove all temporary test files
+        :return:
+        """
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_compile_commands(self):
+        """
+        Checks both forms of entry, the classifications and the match counts
+        :return:
+        """
+        self.write('flags.rsp', '-O2 -frobnicate')
+        database = [
+            {'directory': self.directory, 'file': 'a.c', 'arguments': ['clang', '-c', 'a.c', '-o', 'a.o', '-Zweird']},
+            {'directory': self.directory, 'file': 'b.c', 'command': 'cc -DMSG="a b" @flags.rsp -c b.c'},
+            {'directory': self.directory, 'file': 'c.c', 'command': 'cc -c c.c -E'},
+        ]
+        commands = readCommands(self.write('compile_commands.json', json.dumps(database)))
+        self.assertEqual(commands[1], (self.directory, 'b.c', ['-DMSG=a b', '@flags.rsp', '-c', 'b.c']))
+
+        (results, counts, seconds) = parseCommands(commands, repeat=2)
+        self.assertEqual([r['skipReason'] for r in results], [None, None, 'Preprocess Only'])
+        self.assertEqual((results[0]['outputFile'], results[0]['compileArgs']), ('a.o', ['-Zweird']))
+        self.assertEqual(results[1]['compileArgs'], ['-DMSG=a b', '-O2', '-frobnicate'])
+        self.assertEqual(counts['exact'], {'-c': 3, '-o': 1, '-O2': 1, '-E': 1})
+        self.assertEqual(counts['pattern'], {r'^-D.+$': 1, r'^-f.+$': 1, r'^.+\.(c|cc|cpp|C|cxx|i|s|S|bc)$': 3})
+        self.assertEqual(counts['unrecognized'], {'-Zweird': 1})
+        self.assertGreater(seconds, 0)
+
+    def test_argv_log(self):
+        """
+        Checks a log of one command a line, with comments and blank lines
+        :return:
+        """
+        log = self.write('argv.log', '# a build\ncc -O2 a.c b.c -o prog -lm\n\ncc --version\n')
+        commands = readCommands(log)
+        self.assertEqual([argv for (_, _, argv) in commands], [['-O2', 'a.c', 'b.c', '-o', 'prog', '-lm'], ['--version']])
+        (results, _, _) = parseCommands(commands)
+        self.assertEqual((results[0]['inputFiles'], results[0]['linkArgs']), (['a.c', 'b.c'], ['-lm']))
+        self.assertEqual(results[1]['skipReason'], 'No input files')
+
+
+if __name__ == '__main__':
+    unittest.main()
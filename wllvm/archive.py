@@ -0,0 +1,95 @@
+"""
+Just enough of the ar format to find the members of an archive without ar.
+
+extract-bc used to list an archive with ar -t, then extract every member,
+one ar run per member, into a scratch directory, before reading the
+sections of each. readArchive walks the member headers of the archive,
+mapped into memory, instead, so that the sections of each member can be
+read where it lies.
+
+Both flavours of the format are understood. GNU (System V) archives keep
+names longer than 15 characters in a // member, and refer to them as
+/offset; BSD archives put them in front of the member's contents, as
+#1/length. The symbol tables are skipped. A thin archive (!<thin>) holds
+just the headers: its members are files, named relative to the archive.
+"""
+
+import sys
+
+ARMAG = b'!<arch>\n'
+THINMAG = b'!<thin>\n'
+
+# name[16] date[12] uid[6] gid[6] mode[8] size[10] fmag[2]
+_headerSize = 60
+_headerMagic = b'`\n'
+
+# The GNU and BSD symbol tables.
+_symbolTables = ('/', '/SYM64/', '__.SYMDEF', '__.SYMDEF SORTED', '__.SYMDEF_64', '__.SYMDEF_64 SORTED')
+
+
+def _decode(name):
+    return bytes(name).decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+
+def readArchive(data):
+    """ Yields the name, offset and size of each member of the archive in data.
+
+    data is the whole archive, as bytes or an mmap. Members that share a
+    name are each yielded in turn. The offset is None in a thin archive,
+    whose members are not in data. Raises ValueError if data is not an
+    archive, or is cut short.
+    """
+    magic = bytes(data[:len(ARMAG)])
+    if magic not in (ARMAG, THINMAG):
+        raise ValueError('not an ar archive')
+    thin = magic == THINMAG
+    longNames = b''
+    pos = len(ARMAG)
+    while pos < len(data):
+        header = bytes(data[pos:pos + _headerSize])
+        if len(header) < _headerSize or header[58:60] != _headerMagic:
+            raise ValueError(f'bad member header at {pos}')
+        try:
+            size = int(header[48:58])
+        except ValueError:
+            raise ValueError(f'bad member size at {pos}') from None
+        start = pos + _headerSize
+        end = start + size
+        rawName = _decode(header[:16]).rstrip(' ')
+
+        if rawName.startswith('#1/'):
+            # BSD: the name comes first in the contents
+            try:
+                nameLength = int(rawName[3:])
+            except ValueError:
+                raise ValueError(f'bad member name at {pos}') from None
+            name = _decode(data[start:start + nameLength]).rstrip('\0')
+            start += nameLength
+            size -= nameLength
+        elif rawName == '//':
+            longNames = bytes(data[start:end])
+            name = None
+        elif rawName in _symbolTables:
+            name = rawName
+        elif rawName.startswith('/') and rawName[1:].isdigit():
+            # GNU: an offset into the long name table, whose entries end with /\n
+            offset = int(rawName[1:])
+            nameEnd = longNames.find(b'\n', offset)
+            if offset >= len(longNames) or nameEnd < 0:
+                raise ValueError(f'bad long member name at {pos}')
+            name = _decode(longNames[offset:nameEnd]).rstrip('/')
+        else:
+            name = rawName[:-1] if rawName.endswith('/') else rawName
+
+        isSymbolTable = name in _symbolTables
+        if thin and name is not None and not isSymbolTable:
+            # only the symbol table and the long names are in a thin archive
+            yield (name, None, size)
+            pos = start
+            continue
+        if end > len(data):
+            raise ValueError(f'member at {pos} runs past the end of the archive')
+        if name is not None and not isSymbolTable:
+            yield (name, start, size)
+        # members start on even offsets
+        pos = end + (end & 1)
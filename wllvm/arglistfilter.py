@@ -1,9 +1,10 @@
 import logging
-import collections
 import os
 import re
 import sys
 
+from .responsefile import ArgumentStream
+
 # Internal logger
 _logger = logging.getLogger(__name__)
 
@@ -24,275 +25,17 @@ DUMPING = False
 #
 # Most flags can be handled with a simple lookup in a table - these
 # are exact matches.  Other flags are more complex and can be
-# recognized by regular expressions.  All regular expressions must be
-# tried, obviously.  The first one that matches is taken, and no order
-# is specified.  Try to avoid overlapping patterns.
+# recognized by regular expressions.  The first one that matches, in
+# the order of the table, is taken (see ArgumentTable), but try to
+# avoid overlapping patterns.  The tables themselves are at the end
+# of this file.
 class ArgumentListFilter:
-    def __init__(self, inputList, exactMatches={}, patternMatches={}):
-        defaultArgExactMatches = {
-
-            '-' : (0, ArgumentListFilter.standardInCallback),
-
-            '-o' : (1, ArgumentListFilter.outputFileCallback),
-            '-c' : (0, ArgumentListFilter.compileOnlyCallback),
-            '-E' : (0, ArgumentListFilter.preprocessOnlyCallback),
-            '-S' : (0, ArgumentListFilter.assembleOnlyCallback),
-
-            '-v' : (0, ArgumentListFilter.verboseFlagCallback),
-            '--verbose' : (0, ArgumentListFilter.verboseFlagCallback),
-            '--param' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-aux-info' : (1, ArgumentListFilter.defaultBinaryCallback),
-
-            #iam: presumably the len(inputFiles) == 0 in this case
-            '--version' : (0, ArgumentListFilter.compileOnlyCallback),
-
-            #warnings (apart from the regex below)
-            '-w' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-W' : (0, ArgumentListFilter.compileUnaryCallback),
-
-
-            #iam: if this happens, then we need to stop and think.
-            '-emit-llvm' : (0, ArgumentListFilter.emitLLVMCallback),
-
-            #iam: buildworld and buildkernel use these flags
-            '-pipe' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-undef' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-nostdinc' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-nostdinc++' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-Qunused-arguments' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-no-integrated-as' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-integrated-as' : (0, ArgumentListFilter.compileUnaryCallback),
-            #iam: gcc uses this in both compile and link, but clang only in compile
-            #iam: actually on linux it looks to be both
-            '-pthread' : (0, ArgumentListFilter.compileLinkUnaryCallback),
-            # I think this is a compiler search path flag.  It is
-            # clang only, so I don't think it counts as a separate CPP
-            # flag.  Android uses this flag with its clang builds.
-            '-nostdlibinc': (0, ArgumentListFilter.compileUnaryCallback),
-
-            #iam: arm stuff
-            '-mno-omit-leaf-frame-pointer' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-maes' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-aes' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mavx' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-avx' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mcmodel=kernel' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-red-zone' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mmmx' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-mmx' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-msse' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-sse2' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-msse2' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-sse3' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-msse3' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-sse' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-msoft-float' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-m3dnow' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-mno-3dnow' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-m16': (0, ArgumentListFilter.compileLinkUnaryCallback),
-            '-m32': (0, ArgumentListFilter.compileLinkUnaryCallback),
-            '-mx32': (0, ArgumentListFilter.compileLinkUnaryCallback),
-            '-m64': (0, ArgumentListFilter.compileLinkUnaryCallback),
-            '-miamcu': (0, ArgumentListFilter.compileUnaryCallback),
-            '-mstackrealign': (0, ArgumentListFilter.compileUnaryCallback),
-            '-mretpoline-external-thunk': (0, ArgumentListFilter.compileUnaryCallback),  #iam: linux kernel stuff
-            '-mno-fp-ret-in-387': (0, ArgumentListFilter.compileUnaryCallback),          #iam: linux kernel stuff
-            '-mskip-rax-setup': (0, ArgumentListFilter.compileUnaryCallback),            #iam: linux kernel stuff
-            '-mindirect-branch-register': (0, ArgumentListFilter.compileUnaryCallback),  #iam: linux kernel stuff
-            # Preprocessor assertion
-            '-A' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-D' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-U' : (1, ArgumentListFilter.compileBinaryCallback),
-
-            '-arch' : (1, ArgumentListFilter.compileBinaryCallback),  #iam: openssl
-
-            # Dependency generation
-            '-M'  : (0, ArgumentListFilter.dependencyOnlyCallback),
-            '-MM' : (0, ArgumentListFilter.dependencyOnlyCallback),
-            '-MF' : (1, ArgumentListFilter.dependencyBinaryCallback),
-            '-MG' : (0, ArgumentListFilter.dependencyOnlyCallback),
-            '-MP' : (0, ArgumentListFilter.dependencyOnlyCallback),
-            '-MT' : (1, ArgumentListFilter.dependencyBinaryCallback),
-            '-MQ' : (1, ArgumentListFilter.dependencyBinaryCallback),
-            '-MD' : (0, ArgumentListFilter.dependencyOnlyCallback),
-            '-MMD' : (0, ArgumentListFilter.dependencyOnlyCallback),
-
-            # Include
-            '-I' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-idirafter' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-include' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-imacros' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-iprefix' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-iwithprefix' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-iwithprefixbefore' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-isystem' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-isysroot' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-iquote' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-imultilib' : (1, ArgumentListFilter.compileBinaryCallback),
-
-            # Sysroot
-            # Driver expands this into include options when compiling and
-            # library options when linking
-            '--sysroot' : (1, ArgumentListFilter.compileLinkBinaryCallback),
-
-            # Architecture
-            '-target' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-marm' : (0, ArgumentListFilter.compileUnaryCallback),
-
-            # Language
-            '-ansi' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-pedantic' : (0, ArgumentListFilter.compileUnaryCallback),
-            #iam: i notice that yices configure passes -xc so
-            # we should have a fall back pattern that captures the case
-            # when there is no space between the x and the langauge.
-            # for what its worth: the manual says the language can be one of
-            # c  objective-c  c++ c-header  cpp-output  c++-cpp-output
-            # assembler  assembler-with-cpp
-            # BD: care to comment on your configure?
-
-            '-x' : (1, ArgumentListFilter.compileBinaryCallback),
-
-            # Debug
-            '-g' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-g0' : (0, ArgumentListFilter.compileUnaryCallback),     #iam: clang not gcc
-            '-ggdb' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-ggdb3' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-gdwarf-2' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-gdwarf-3' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-gdwarf-4' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-gline-tables-only' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-grecord-gcc-switches': (0, ArgumentListFilter.compileUnaryCallback),
-
-            '-p' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-pg' : (0, ArgumentListFilter.compileUnaryCallback),
-
-            # Optimization
-            '-O' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-O0' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-O1' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-O2' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-O3' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-Os' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-Ofast' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-Og' : (0, ArgumentListFilter.compileUnaryCallback),
-            # Component-specifiers
-            '-Xclang' : (1, ArgumentListFilter.compileBinaryCallback),
-            '-Xpreprocessor' : (1, ArgumentListFilter.defaultBinaryCallback),
-            '-Xassembler' : (1, ArgumentListFilter.defaultBinaryCallback),
-            '-Xlinker' : (1, ArgumentListFilter.defaultBinaryCallback),
-            # Linker
-            '-l' : (1, ArgumentListFilter.linkBinaryCallback),
-            '-L' : (1, ArgumentListFilter.linkBinaryCallback),
-            '-T' : (1, ArgumentListFilter.linkBinaryCallback),
-            '-u' : (1, ArgumentListFilter.linkBinaryCallback),
-            #iam: specify the entry point
-            '-e' : (1, ArgumentListFilter.linkBinaryCallback),
-            # runtime library search path
-            '-rpath' : (1, ArgumentListFilter.linkBinaryCallback),
-            # iam: showed up in buildkernel
-            '-shared' : (0, ArgumentListFilter.linkUnaryCallback),
-            '-static' : (0, ArgumentListFilter.linkUnaryCallback),
-            '-pie' : (0, ArgumentListFilter.linkUnaryCallback),
-            '-nostdlib' : (0, ArgumentListFilter.linkUnaryCallback),
-            '-nodefaultlibs' : (0, ArgumentListFilter.linkUnaryCallback),
-            '-rdynamic' : (0, ArgumentListFilter.linkUnaryCallback),
-            # darwin flags
-            '-dynamiclib' : (0, ArgumentListFilter.linkUnaryCallback),
-            '-current_version' : (1, ArgumentListFilter.linkBinaryCallback),
-            '-compatibility_version' : (1, ArgumentListFilter.linkBinaryCallback),
-            '-framework' : (1, ArgumentListFilter.linkBinaryCallback),
-
-            # dragonegg mystery argument
-            '--64' : (0, ArgumentListFilter.compileUnaryCallback),
-
-            # binutils nonsense
-            '-print-multi-directory' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-print-multi-lib' : (0, ArgumentListFilter.compileUnaryCallback),
-            '-print-libgcc-file-name' : (0, ArgumentListFilter.compileUnaryCallback),
-
-            # Code coverage instrumentation
-            '-fprofile-arcs' : (0, ArgumentListFilter.compileLinkUnaryCallback),
-            '-coverage' : (0, ArgumentListFilter.compileLinkUnaryCallback),
-            '--coverage' : (0, ArgumentListFilter.compileLinkUnaryCallback),
-
-            # ian's additions while building the linux kernel
-            '/dev/null' : (0, ArgumentListFilter.inputFileCallback),
-            '-mno-80387': (0, ArgumentListFilter.compileUnaryCallback), #gcc Don't generate output containing 80387 instructions for floating point.
-
-
-            #
-            # BD: need to warn the darwin user that these flags will rain on their parade
-            # (the Darwin ld is a bit single minded)
-            #
-            # 1) compilation with -fvisibility=hidden causes trouble when we try to
-            #    attach bitcode filenames to an object file. The global symbols in object
-            #    files get turned into local symbols when we invoke 'ld -r'
-            #
-            # 2) all stripping commands (e.g., -dead_strip) remove the __LLVM segment after
-            #    linking
-            #
-            # Update: found a fix for problem 1: add flag -keep_private_externs when
-            # calling ld -r.
-            #
-            '-Wl,-dead_strip' :  (0, ArgumentListFilter.warningLinkUnaryCallback),
-            '-dead_strip' :  (0, ArgumentListFilter.warningLinkUnaryCallback),
-            '-Oz' : (0, ArgumentListFilter.compileUnaryCallback),   #did not find this in the GCC options.
-            '-mno-global-merge' : (0, ArgumentListFilter.compileUnaryCallback),  #clang (do not merge globals)
-
-        }
-
-        #
-        # Patterns for other command-line arguments:
-        # - inputFiles
-        # - objectFiles (suffix .o)
-        # - libraries + linker options as in -lxxx -Lpath or -Wl,xxxx
-        # - preprocessor options as in -DXXX -Ipath
-        # - compiler warning options: -W....
-        # - optimiziation and other flags: -f...
-        #
-        defaultArgPatterns = {
-            r'^-f.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^.+\.(c|cc|cpp|C|cxx|i|s|S|bc)$' : (0, ArgumentListFilter.inputFileCallback),
-            # FORTRAN file types
-            r'^.+\.([fF](|[0-9][0-9]|or|OR|pp|PP))$' : (0, ArgumentListFilter.inputFileCallback),
-            #iam: the object file recogition is not really very robust, object files
-            # should be determined by their existance and contents...
-            r'^.+\.(o|lo|So|so|po|a|dylib)$' : (0, ArgumentListFilter.objectFileCallback),
-            #iam: library.so.4.5.6 probably need a similar pattern for .dylib too.
-            r'^.+\.dylib(\.\d)+$' : (0, ArgumentListFilter.objectFileCallback),
-            r'^.+\.(So|so)(\.\d)+$' : (0, ArgumentListFilter.objectFileCallback),
-            r'^-(l|L).+$' : (0, ArgumentListFilter.linkUnaryCallback),
-            r'^-I.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-D.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-U.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-Wl,.+$' : (0, ArgumentListFilter.linkUnaryCallback),
-            r'^-W(?!l,).*$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-fsanitize=.+$' : (0, ArgumentListFilter.compileLinkUnaryCallback),
-            r'^-rtlib=.+$' : (0, ArgumentListFilter.linkUnaryCallback),
-            r'^-std=.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-stdlib=.+$' : (0, ArgumentListFilter.compileLinkUnaryCallback),
-            r'^-mtune=.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-mstack-alignment=.+$': (0, ArgumentListFilter.compileUnaryCallback),                     #iam: linux kernel stuff
-            r'^-mcmodel=.+$': (0, ArgumentListFilter.compileUnaryCallback),                              #iam: linux kernel stuff
-            r'^-mpreferred-stack-boundary=.+$': (0, ArgumentListFilter.compileUnaryCallback),            #iam: linux kernel stuff
-            r'^-mindirect-branch=.+$': (0, ArgumentListFilter.compileUnaryCallback),                     #iam: linux kernel stuff
-            r'^-mregparm=.+$' : (0, ArgumentListFilter.compileUnaryCallback),                            #iam: linux kernel stuff
-            r'^-march=.+$' : (0, ArgumentListFilter.compileUnaryCallback),                               #iam: linux kernel stuff
-            r'^--param=.+$' : (0, ArgumentListFilter.compileUnaryCallback),                              #iam: linux kernel stuff
-
-
-            #iam: mac stuff...
-            r'-mmacosx-version-min=.+$' :  (0, ArgumentListFilter.compileUnaryCallback),
-
-            r'^--sysroot=.+$' :  (0, ArgumentListFilter.compileUnaryCallback),
-            r'^--gcc-toolchain=.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-print-prog-name=.*$' : (0, ArgumentListFilter.compileUnaryCallback),
-            r'^-print-file-name=.*$' : (0, ArgumentListFilter.compileUnaryCallback),
-            #iam: -xc from yices. why BD?
-            r'^-x.+$' : (0, ArgumentListFilter.compileUnaryCallback),
-
-        }
+    # If set, called as countMatch(kind, key) for every flag: kind is exact,
+    # group, pattern or unrecognized, and key the flag or the pattern it
+    # matched (see wparser.py).
+    countMatch = None
 
+    def __init__(self, inputList, exactMatches={}, patternMatches={}):
         #iam: try and keep track of the files, input object, and output
         self.inputList = inputList
         self.inputFiles = []
@@ -304,6 +47,8 @@ class ArgumentListFilter:
         self.linkArgs = []
         # currently only dead_strip belongs here; but I guess there could be more.
         self.forbiddenArgs = []
+        # positions in compileArgs of the -M family; see getCompileArgsWithoutDependencies
+        self._dependencyArgPositions = []
 
 
         self.isVerbose = False
@@ -315,12 +60,13 @@ class ArgumentListFilter:
         self.isEmitLLVM = False
         self.isStandardIn = False
 
-        argExactMatches = dict(defaultArgExactMatches)
-        argExactMatches.update(exactMatches)
-        argPatterns = dict(defaultArgPatterns)
-        argPatterns.update(patternMatches)
+        table = getArgumentTable(exactMatches, patternMatches)
+        argExactMatches = table.exactMatches
+        debugging = _logger.isEnabledFor(logging.DEBUG)
+        countMatch = self.countMatch
 
-        self._inputArgs = collections.deque(inputList)
+        # response files (@file) are expanded as we come to them
+        self._inputArgs = ArgumentStream(inputList)
 
         #iam: parse the cmd line, bailing if we discover that there will be no second phase.
         while (self._inputArgs   and
@@ -328,15 +74,20 @@ class ArgumentListFilter:
                     self.isPreprocessOnly)):
             # Get the next argument
             currentItem = self._inputArgs.popleft()
-            _logger.debug('Trying to match item %s', currentItem)
+            if debugging:
+                _logger.debug('Trying to match item %s', currentItem)
             # First, see if this exact flag has a handler in the table.
             # This is a cheap test.  Otherwise, see if the input matches
             # some pattern with a handler that we recognize
             if currentItem in argExactMatches:
                 (arity, handler) = argExactMatches[currentItem]
+                if countMatch is not None:
+                    countMatch('exact', currentItem)
                 flagArgs = self._shiftArgs(arity)
                 handler(self, currentItem, *flagArgs)
             elif currentItem == '-Wl,--start-group':
+                if countMatch is not None:
+                    countMatch('group', currentItem)
                 linkingGroup = [currentItem]
                 terminated = False
                 while self._inputArgs:
@@ -349,16 +100,18 @@ class ArgumentListFilter:
                     _logger.warning('Did not find a closing "-Wl,--end-group" to match "-Wl,--start-group"')
                 self.linkingGroupCallback(linkingGroup)
             else:
-                matched = False
-                for pattern, (arity, handler) in argPatterns.items():
-                    if re.match(pattern, currentItem):
-                        flagArgs = self._shiftArgs(arity)
-                        handler(self, currentItem, *flagArgs)
-                        matched = True
-                        break
+                match = table.matchPattern(currentItem)
+                if match is not None:
+                    (arity, handler) = match
+                    if countMatch is not None:
+                        countMatch('pattern', table.whichPattern(currentItem))
+                    flagArgs = self._shiftArgs(arity)
+                    handler(self, currentItem, *flagArgs)
                 # If no action has been specified, this is a zero-argument
                 # flag that we should just keep.
-                if not matched:
+                else:
+                    if countMatch is not None:
+                        countMatch('unrecognized', currentItem)
                     _logger.warning('Did not recognize the compiler flag "%s"', currentItem)
                     self.compileUnaryCallback(currentItem)
 
@@ -404,7 +157,7 @@ class ArgumentListFilter:
     def inputFileCallback(self, infile):
         _logger.debug('Input file: %s', infile)
         self.inputFiles.append(infile)
-        if re.search('\\.(s|S)$', infile):
+        if _assemblyPattern.search(infile):
             self.isAssembly = True
 
     def outputFileCallback(self, flag, filename):
@@ -422,6 +175,7 @@ class ArgumentListFilter:
     def dependencyOnlyCallback(self, flag):
         _logger.debug('dependencyOnlyCallback: %s', flag)
         self.isDependencyOnly = True
+        self._dependencyArgPositions.append(len(self.compileArgs))
         self.compileArgs.append(flag)
 
     def assembleOnlyCallback(self, flag):
@@ -465,6 +219,7 @@ class ArgumentListFilter:
     def dependencyBinaryCallback(self, flag, arg):
         _logger.debug('dependencyBinaryCallback: %s %s', flag, arg)
         self.isDependencyOnly = True
+        self._dependencyArgPositions.extend([len(self.compileArgs), len(self.compileArgs) + 1])
         self.compileArgs.append(flag)
         self.compileArgs.append(arg)
 
@@ -489,6 +244,18 @@ class ArgumentListFilter:
         _logger.debug('linkingGroupCallback: %s', args)
         self.linkArgs.extend(args)
 
+    # iam: the compileArgs minus the dependency file flags (-MD, -MF foo.d, -Wp,-MD,foo.d, ...).
+    # Used for any compile that runs alongside, or in addition to, the one that
+    # is responsible for the .d file, so that the .d file is only written once.
+    def getCompileArgsWithoutDependencies(self):
+        skip = set(self._dependencyArgPositions)
+        return [arg for (index, arg) in enumerate(self.compileArgs)
+                if index not in skip and not arg.startswith('-Wp,-M')]
+
+    # whether the compile writes a .d file, or any other dependency output.
+    def hasDependencyArgs(self):
+        return bool(self._dependencyArgPositions) or any(arg.startswith('-Wp,-M') for arg in self.compileArgs)
+
     def getOutputFilename(self):
         if self.outputFilename is not None:
             return self.outputFilename
@@ -535,3 +302,346 @@ class ArgumentListFilter:
         efn(f'isCompileOnly = {self.isCompileOnly}\n')
         efn(f'isEmitLLVM = {self.isEmitLLVM}\n')
         efn(f'isStandardIn = {self.isStandardIn}\n')
+
+
+# Same as an ArgumentListFilter, but DO NOT change the name of the output filename when
+# building the bitcode file so that we don't clobber the object file.
+class ClangBitcodeArgumentListFilter(ArgumentListFilter):
+    def __init__(self, arglist):
+        localCallbacks = {'-o' : (1, ClangBitcodeArgumentListFilter.outputFileCallback)}
+        #super(ClangBitcodeArgumentListFilter, self).__init__(arglist, exactMatches=localCallbacks)
+        super().__init__(arglist, exactMatches=localCallbacks)
+
+    def outputFileCallback(self, flag, filename):
+        self.outputFilename = filename
+
+
+# The flags, and the patterns, that ArgumentListFilter recognizes. They are
+# built once, here, rather than for every command line.
+defaultArgExactMatches = {
+
+    '-' : (0, ArgumentListFilter.standardInCallback),
+
+    '-o' : (1, ArgumentListFilter.outputFileCallback),
+    '-c' : (0, ArgumentListFilter.compileOnlyCallback),
+    '-E' : (0, ArgumentListFilter.preprocessOnlyCallback),
+    '-S' : (0, ArgumentListFilter.assembleOnlyCallback),
+
+    '-v' : (0, ArgumentListFilter.verboseFlagCallback),
+    '--verbose' : (0, ArgumentListFilter.verboseFlagCallback),
+    '--param' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-aux-info' : (1, ArgumentListFilter.defaultBinaryCallback),
+
+    #iam: presumably the len(inputFiles) == 0 in this case
+    '--version' : (0, ArgumentListFilter.compileOnlyCallback),
+
+    #warnings (apart from the regex below)
+    '-w' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-W' : (0, ArgumentListFilter.compileUnaryCallback),
+
+
+    #iam: if this happens, then we need to stop and think.
+    '-emit-llvm' : (0, ArgumentListFilter.emitLLVMCallback),
+
+    #iam: buildworld and buildkernel use these flags
+    '-pipe' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-undef' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-nostdinc' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-nostdinc++' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-Qunused-arguments' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-no-integrated-as' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-integrated-as' : (0, ArgumentListFilter.compileUnaryCallback),
+    #iam: gcc uses this in both compile and link, but clang only in compile
+    #iam: actually on linux it looks to be both
+    '-pthread' : (0, ArgumentListFilter.compileLinkUnaryCallback),
+    # I think this is a compiler search path flag.  It is
+    # clang only, so I don't think it counts as a separate CPP
+    # flag.  Android uses this flag with its clang builds.
+    '-nostdlibinc': (0, ArgumentListFilter.compileUnaryCallback),
+
+    #iam: arm stuff
+    '-mno-omit-leaf-frame-pointer' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-maes' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-aes' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mavx' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-avx' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mcmodel=kernel' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-red-zone' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mmmx' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-mmx' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-msse' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-sse2' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-msse2' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-sse3' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-msse3' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-sse' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-msoft-float' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-m3dnow' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-mno-3dnow' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-m16': (0, ArgumentListFilter.compileLinkUnaryCallback),
+    '-m32': (0, ArgumentListFilter.compileLinkUnaryCallback),
+    '-mx32': (0, ArgumentListFilter.compileLinkUnaryCallback),
+    '-m64': (0, ArgumentListFilter.compileLinkUnaryCallback),
+    '-miamcu': (0, ArgumentListFilter.compileUnaryCallback),
+    '-mstackrealign': (0, ArgumentListFilter.compileUnaryCallback),
+    '-mretpoline-external-thunk': (0, ArgumentListFilter.compileUnaryCallback),  #iam: linux kernel stuff
+    '-mno-fp-ret-in-387': (0, ArgumentListFilter.compileUnaryCallback),          #iam: linux kernel stuff
+    '-mskip-rax-setup': (0, ArgumentListFilter.compileUnaryCallback),            #iam: linux kernel stuff
+    '-mindirect-branch-register': (0, ArgumentListFilter.compileUnaryCallback),  #iam: linux kernel stuff
+    # Preprocessor assertion
+    '-A' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-D' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-U' : (1, ArgumentListFilter.compileBinaryCallback),
+
+    '-arch' : (1, ArgumentListFilter.compileBinaryCallback),  #iam: openssl
+
+    # Dependency generation
+    '-M'  : (0, ArgumentListFilter.dependencyOnlyCallback),
+    '-MM' : (0, ArgumentListFilter.dependencyOnlyCallback),
+    '-MF' : (1, ArgumentListFilter.dependencyBinaryCallback),
+    '-MG' : (0, ArgumentListFilter.dependencyOnlyCallback),
+    '-MP' : (0, ArgumentListFilter.dependencyOnlyCallback),
+    '-MT' : (1, ArgumentListFilter.dependencyBinaryCallback),
+    '-MQ' : (1, ArgumentListFilter.dependencyBinaryCallback),
+    '-MD' : (0, ArgumentListFilter.dependencyOnlyCallback),
+    '-MMD' : (0, ArgumentListFilter.dependencyOnlyCallback),
+
+    # Include
+    '-I' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-idirafter' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-include' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-imacros' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-iprefix' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-iwithprefix' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-iwithprefixbefore' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-isystem' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-isysroot' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-iquote' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-imultilib' : (1, ArgumentListFilter.compileBinaryCallback),
+
+    # Sysroot
+    # Driver expands this into include options when compiling and
+    # library options when linking
+    '--sysroot' : (1, ArgumentListFilter.compileLinkBinaryCallback),
+
+    # Architecture
+    '-target' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-marm' : (0, ArgumentListFilter.compileUnaryCallback),
+
+    # Language
+    '-ansi' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-pedantic' : (0, ArgumentListFilter.compileUnaryCallback),
+    #iam: i notice that yices configure passes -xc so
+    # we should have a fall back pattern that captures the case
+    # when there is no space between the x and the langauge.
+    # for what its worth: the manual says the language can be one of
+    # c  objective-c  c++ c-header  cpp-output  c++-cpp-output
+    # assembler  assembler-with-cpp
+    # BD: care to comment on your configure?
+
+    '-x' : (1, ArgumentListFilter.compileBinaryCallback),
+
+    # Debug
+    '-g' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-g0' : (0, ArgumentListFilter.compileUnaryCallback),     #iam: clang not gcc
+    '-ggdb' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-ggdb3' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-gdwarf-2' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-gdwarf-3' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-gdwarf-4' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-gline-tables-only' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-grecord-gcc-switches': (0, ArgumentListFilter.compileUnaryCallback),
+
+    '-p' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-pg' : (0, ArgumentListFilter.compileUnaryCallback),
+
+    # Optimization
+    '-O' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-O0' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-O1' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-O2' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-O3' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-Os' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-Ofast' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-Og' : (0, ArgumentListFilter.compileUnaryCallback),
+    # Component-specifiers
+    '-Xclang' : (1, ArgumentListFilter.compileBinaryCallback),
+    '-Xpreprocessor' : (1, ArgumentListFilter.defaultBinaryCallback),
+    '-Xassembler' : (1, ArgumentListFilter.defaultBinaryCallback),
+    '-Xlinker' : (1, ArgumentListFilter.defaultBinaryCallback),
+    # Linker
+    '-l' : (1, ArgumentListFilter.linkBinaryCallback),
+    '-L' : (1, ArgumentListFilter.linkBinaryCallback),
+    '-T' : (1, ArgumentListFilter.linkBinaryCallback),
+    '-u' : (1, ArgumentListFilter.linkBinaryCallback),
+    #iam: specify the entry point
+    '-e' : (1, ArgumentListFilter.linkBinaryCallback),
+    # runtime library search path
+    '-rpath' : (1, ArgumentListFilter.linkBinaryCallback),
+    # iam: showed up in buildkernel
+    '-shared' : (0, ArgumentListFilter.linkUnaryCallback),
+    '-static' : (0, ArgumentListFilter.linkUnaryCallback),
+    '-pie' : (0, ArgumentListFilter.linkUnaryCallback),
+    '-nostdlib' : (0, ArgumentListFilter.linkUnaryCallback),
+    '-nodefaultlibs' : (0, ArgumentListFilter.linkUnaryCallback),
+    '-rdynamic' : (0, ArgumentListFilter.linkUnaryCallback),
+    # darwin flags
+    '-dynamiclib' : (0, ArgumentListFilter.linkUnaryCallback),
+    '-current_version' : (1, ArgumentListFilter.linkBinaryCallback),
+    '-compatibility_version' : (1, ArgumentListFilter.linkBinaryCallback),
+    '-framework' : (1, ArgumentListFilter.linkBinaryCallback),
+
+    # dragonegg mystery argument
+    '--64' : (0, ArgumentListFilter.compileUnaryCallback),
+
+    # binutils nonsense
+    '-print-multi-directory' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-print-multi-lib' : (0, ArgumentListFilter.compileUnaryCallback),
+    '-print-libgcc-file-name' : (0, ArgumentListFilter.compileUnaryCallback),
+
+    # Code coverage instrumentation
+    '-fprofile-arcs' : (0, ArgumentListFilter.compileLinkUnaryCallback),
+    '-coverage' : (0, ArgumentListFilter.compileLinkUnaryCallback),
+    '--coverage' : (0, ArgumentListFilter.compileLinkUnaryCallback),
+
+    # ian's additions while building the linux kernel
+    '/dev/null' : (0, ArgumentListFilter.inputFileCallback),
+    '-mno-80387': (0, ArgumentListFilter.compileUnaryCallback), #gcc Don't generate output containing 80387 instructions for floating point.
+
+
+    #
+    # BD: need to warn the darwin user that these flags will rain on their parade
+    # (the Darwin ld is a bit single minded)
+    #
+    # 1) compilation with -fvisibility=hidden causes trouble when we try to
+    #    attach bitcode filenames to an object file. The global symbols in object
+    #    files get turned into local symbols when we invoke 'ld -r'
+    #
+    # 2) all stripping commands (e.g., -dead_strip) remove the __LLVM segment after
+    #    linking
+    #
+    # Update: found a fix for problem 1: add flag -keep_private_externs when
+    # calling ld -r.
+    #
+    '-Wl,-dead_strip' :  (0, ArgumentListFilter.warningLinkUnaryCallback),
+    '-dead_strip' :  (0, ArgumentListFilter.warningLinkUnaryCallback),
+    '-Oz' : (0, ArgumentListFilter.compileUnaryCallback),   #did not find this in the GCC options.
+    '-mno-global-merge' : (0, ArgumentListFilter.compileUnaryCallback),  #clang (do not merge globals)
+
+}
+
+#
+# Patterns for other command-line arguments:
+# - inputFiles
+# - objectFiles (suffix .o)
+# - libraries + linker options as in -lxxx -Lpath or -Wl,xxxx
+# - preprocessor options as in -DXXX -Ipath
+# - compiler warning options: -W....
+# - optimiziation and other flags: -f...
+#
+defaultArgPatterns = {
+    r'^-f.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^.+\.(c|cc|cpp|C|cxx|i|s|S|bc)$' : (0, ArgumentListFilter.inputFileCallback),
+    # FORTRAN file types
+    r'^.+\.([fF](|[0-9][0-9]|or|OR|pp|PP))$' : (0, ArgumentListFilter.inputFileCallback),
+    #iam: the object file recogition is not really very robust, object files
+    # should be determined by their existance and contents...
+    r'^.+\.(o|lo|So|so|po|a|dylib)$' : (0, ArgumentListFilter.objectFileCallback),
+    #iam: library.so.4.5.6 probably need a similar pattern for .dylib too.
+    r'^.+\.dylib(\.\d)+$' : (0, ArgumentListFilter.objectFileCallback),
+    r'^.+\.(So|so)(\.\d)+$' : (0, ArgumentListFilter.objectFileCallback),
+    r'^-(l|L).+$' : (0, ArgumentListFilter.linkUnaryCallback),
+    r'^-I.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-D.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-U.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-Wl,.+$' : (0, ArgumentListFilter.linkUnaryCallback),
+    r'^-W(?!l,).*$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-fsanitize=.+$' : (0, ArgumentListFilter.compileLinkUnaryCallback),
+    r'^-rtlib=.+$' : (0, ArgumentListFilter.linkUnaryCallback),
+    r'^-std=.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-stdlib=.+$' : (0, ArgumentListFilter.compileLinkUnaryCallback),
+    r'^-mtune=.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-mstack-alignment=.+$': (0, ArgumentListFilter.compileUnaryCallback),                     #iam: linux kernel stuff
+    r'^-mcmodel=.+$': (0, ArgumentListFilter.compileUnaryCallback),                              #iam: linux kernel stuff
+    r'^-mpreferred-stack-boundary=.+$': (0, ArgumentListFilter.compileUnaryCallback),            #iam: linux kernel stuff
+    r'^-mindirect-branch=.+$': (0, ArgumentListFilter.compileUnaryCallback),                     #iam: linux kernel stuff
+    r'^-mregparm=.+$' : (0, ArgumentListFilter.compileUnaryCallback),                            #iam: linux kernel stuff
+    r'^-march=.+$' : (0, ArgumentListFilter.compileUnaryCallback),                               #iam: linux kernel stuff
+    r'^--param=.+$' : (0, ArgumentListFilter.compileUnaryCallback),                              #iam: linux kernel stuff
+
+
+    #iam: mac stuff...
+    r'-mmacosx-version-min=.+$' :  (0, ArgumentListFilter.compileUnaryCallback),
+
+    r'^--sysroot=.+$' :  (0, ArgumentListFilter.compileUnaryCallback),
+    r'^--gcc-toolchain=.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-print-prog-name=.*$' : (0, ArgumentListFilter.compileUnaryCallback),
+    r'^-print-file-name=.*$' : (0, ArgumentListFilter.compileUnaryCallback),
+    #iam: -xc from yices. why BD?
+    r'^-x.+$' : (0, ArgumentListFilter.compileUnaryCallback),
+
+}
+
+_assemblyPattern = re.compile(r'\.(s|S)$')
+
+
+class ArgumentTable:
+    """ The exact matches and patterns of an ArgumentListFilter, ready for lookups.
+
+    The patterns are compiled into a single regular expression, one named
+    alternative per pattern, in the order of the table. The leftmost
+    alternative that matches wins, which is the pattern the old loop
+    over re.match would have found first, so a lookup costs one match.
+    """
+
+    def __init__(self, exactMatches, patternMatches):
+        self.exactMatches = exactMatches
+        self.handlers = {}
+        self.patterns = {}
+        alternatives = []
+        for (index, (pattern, entry)) in enumerate(patternMatches.items()):
+            name = f'p{index}'
+            self.handlers[name] = entry
+            self.patterns[name] = pattern
+            alternatives.append(f'(?P<{name}>{pattern})')
+        self.pattern = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def matchPattern(self, arg):
+        """ The (arity, handler) of the first pattern arg matches, or None.
+        """
+        if self.pattern is None:
+            return None
+        match = self.pattern.match(arg)
+        return self.handlers[match.lastgroup] if match else None
+
+    def whichPattern(self, arg):
+        """ The first pattern arg matches, or None.
+        """
+        match = self.pattern.match(arg) if self.pattern is not None else None
+        return self.patterns[match.lastgroup] if match else None
+
+
+_defaultTable = ArgumentTable(defaultArgExactMatches, defaultArgPatterns)
+
+# The tables of the subclasses, by their additions to the defaults.
+_tables = {}
+
+
+def getArgumentTable(exactMatches=None, patternMatches=None):
+    """ The table of the default flags and patterns, with exactMatches and patternMatches added.
+
+    As with dict.update, an added pattern that is already in the defaults
+    keeps its place in the order; new ones go after the defaults.
+    """
+    if not exactMatches and not patternMatches:
+        return _defaultTable
+    key = (tuple(exactMatches.items()) if exactMatches else (),
+           tuple(patternMatches.items()) if patternMatches else ())
+    table = _tables.get(key)
+    if table is None:
+        argExactMatches = dict(defaultArgExactMatches)
+        argExactMatches.update(exactMatches or {})
+        argPatterns = dict(defaultArgPatterns)
+        argPatterns.update(patternMatches or {})
+        table = _tables[key] = ArgumentTable(argExactMatches, argPatterns)
+    return table
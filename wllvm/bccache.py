@@ -0,0 +1,280 @@
+"""
+A content addressed cache for the bitcode compiles.
+
+If the environment variable WLLVM_BC_CACHE names a directory, the
+bitcode compile of a source file is looked up there before it is run.
+The key hashes together:
+
+  - the preprocessed source,
+  - the bitcode command line (getBitcodeCompiler plus compileArgs),
+  - a fingerprint of the compiler (its path, size and mtime),
+  - the working directory, when debug info is being generated.
+
+A hit is materialized as a reflink, or else a copy, never a recompile
+(nor a hard link, see fileutils.cloneFile).
+Entries are sharded into 256 subdirectories; each shard keeps itself
+under 1/256th of WLLVM_BC_CACHE_SIZE (default 5G) by evicting its least
+recently used entries. Everything is safe to share between many
+concurrent wllvm processes: entries appear atomically via rename, and
+the statistics counters are O_APPEND files that grow by one byte per event.
+
+The wllvm-bc-cache tool reports the statistics and empties the cache.
+"""
+
+import os
+import sys
+import argparse
+import hashlib
+import shutil
+import subprocess
+
+from .fileutils import appendToFile, cloneFile, installFile
+from .jobserver import jobSlot
+from .popenwrapper import Popen
+from .logconfig import logConfig, informUser
+
+# Internal logger
+_logger = logConfig(__name__)
+
+bcCacheEnv = 'WLLVM_BC_CACHE'
+bcCacheSizeEnv = 'WLLVM_BC_CACHE_SIZE'
+
+_defaultSize = '5G'
+_units = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# bump this to invalidate everything when the key changes meaning
+_keyVersion = b'wllvm-bc-cache-1'
+
+_counters = ('hits', 'misses', 'inserts', 'evictions')
+
+
+def parseSize(size):
+    """ Parses sizes like 500M or 5G into bytes.
+    """
+    size = size.strip().upper().rstrip('B')
+    unit = size[-1:] if size[-1:] in _units else ''
+    return int(float(size[:len(size) - len(unit)]) * _units[unit])
+
+
+class BitcodeCache:
+    """ The cache directory and the operations on it.
+    """
+
+    def __init__(self, directory, maxSize):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.statsDir = os.path.join(directory, 'stats')
+        self._fingerprints = {}
+
+    def shardPath(self, key):
+        return os.path.join(self.directory, key[:2])
+
+    def entryPath(self, key):
+        return os.path.join(self.shardPath(key), f'{key}.bc')
+
+    def count(self, counter):
+        """ Bumps a statistics counter by appending a byte to its file.
+        """
+        try:
+            os.makedirs(self.statsDir, exist_ok=True)
+            appendToFile(os.path.join(self.statsDir, counter), b'.')
+        except OSError as e:
+            _logger.debug('Could not count %s: %s', counter, str(e))
+
+    def compilerFingerprint(self, compiler):
+        """ Identifies the compiler binary by its path, size and mtime, without running it.
+        """
+        if compiler not in self._fingerprints:
+            path = shutil.which(compiler) or compiler
+            try:
+                st = os.stat(path)
+                fingerprint = f'{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}'
+            except OSError:
+                fingerprint = compiler
+            self._fingerprints[compiler] = fingerprint
+        return self._fingerprints[compiler]
+
+    def getKey(self, builder, bitcodeCommand, compileArgs, srcFile):
+        """ Returns the cache key for compiling srcFile with bitcodeCommand.
+
+        bitcodeCommand is the bitcode compiler and its arguments, without the
+        source or output file. Returns None if the source does not preprocess.
+        """
+        ppCmd = builder.getCompiler() + compileArgs + ['-E', srcFile]
+        with jobSlot(), Popen(ppCmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+            preprocessed = proc.communicate()[0]
+        if proc.returncode != 0:
+            _logger.debug('Could not preprocess %s for the bitcode cache', srcFile)
+            return None
+        return self.makeKey(bitcodeCommand, preprocessed)
+
+    def getPreprocessedKey(self, bitcodeCommand, ppFile, srcFile):
+        """ Returns the cache key for compiling ppFile, which holds srcFile already preprocessed.
+
+        Preprocessing ppFile again would not do: gcc -E has nothing to say
+        about a .i file, and clang names the temporary file in its line
+        markers. So the key is made of its contents, and the path of srcFile.
+        """
+        try:
+            with open(ppFile, 'rb') as f:
+                preprocessed = f.read()
+        except OSError as e:
+            _logger.debug('Could not read %s for the bitcode cache: %s', ppFile, str(e))
+            return None
+        return self.makeKey(bitcodeCommand, preprocessed, os.path.abspath(srcFile))
+
+    def makeKey(self, bitcodeCommand, preprocessed, srcPath=None):
+        """ The key of preprocessed source compiled with bitcodeCommand, and of srcPath, if it was preprocessed once.
+        """
+        h = hashlib.sha256(_keyVersion)
+        h.update(self.compilerFingerprint(bitcodeCommand[0]).encode())
+        h.update(b'\0'.join(arg.encode() for arg in bitcodeCommand))
+        if any(arg.startswith('-g') and arg != '-g0' for arg in bitcodeCommand):
+            # the debug info records where we were
+            h.update(os.getcwd().encode())
+        if srcPath is not None:
+            h.update(b'\0preprocessed once\0' + srcPath.encode())
+        h.update(b'\0')
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def fetch(self, key, bcFile):
+        """ Materializes the entry for key as bcFile, returning whether there was one.
+        """
+        entry = self.entryPath(key)
+        if not os.path.isfile(entry):
+            self.count('misses')
+            return False
+        try:
+            if os.path.exists(bcFile):
+                os.remove(bcFile)
+            how = cloneFile(entry, bcFile)
+        except OSError:
+            self.count('misses')
+            return False
+        # an mtime bump keeps the entry at the young end of the LRU order
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        self.count('hits')
+        _logger.debug('Bitcode cache hit for %s (%s)', bcFile, how)
+        return True
+
+    def insert(self, key, bcFile):
+        """ Adds bcFile to the cache under key, then trims the shard it went into.
+        """
+        try:
+            os.makedirs(self.shardPath(key), exist_ok=True)
+            installFile(bcFile, self.entryPath(key))
+        except OSError as e:
+            _logger.warning('Could not add %s to the bitcode cache: %s', bcFile, str(e))
+            return
+        self.count('inserts')
+        self.trim(self.shardPath(key), self.maxSize // 256)
+
+    def trim(self, shard, limit):
+        """ Evicts the least recently used entries of the shard until it fits in limit.
+        """
+        entries = []
+        try:
+            with os.scandir(shard) as it:
+                for entry in it:
+                    if entry.name.endswith('.bc') and entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for (_, size, _) in entries)
+        if total <= limit:
+            return
+        entries.sort()
+        # go a little below the limit so we are not trimming on every insert
+        target = limit * 9 // 10
+        for (_, size, path) in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.count('evictions')
+            except OSError:
+                pass
+            total -= size
+
+    def statistics(self):
+        """ Returns the counters, the number of entries and their total size.
+        """
+        stats = {}
+        for counter in _counters:
+            try:
+                stats[counter] = os.path.getsize(os.path.join(self.statsDir, counter))
+            except OSError:
+                stats[counter] = 0
+        entries = size = 0
+        for (root, _, files) in os.walk(self.directory):
+            if root == self.statsDir:
+                continue
+            for f in files:
+                if f.endswith('.bc'):
+                    try:
+                        size += os.path.getsize(os.path.join(root, f))
+                        entries += 1
+                    except OSError:
+                        pass
+        stats['entries'] = entries
+        stats['size'] = size
+        stats['maxSize'] = self.maxSize
+        return stats
+
+
+def getBitcodeCache(defaultDirectory=None):
+    """ Returns the cache named by WLLVM_BC_CACHE, else defaultDirectory, or None if caching is off.
+    """
+    directory = os.getenv(bcCacheEnv) or defaultDirectory
+    if not directory:
+        return None
+    try:
+        maxSize = parseSize(os.getenv(bcCacheSizeEnv) or _defaultSize)
+    except ValueError:
+        _logger.warning('Ignoring %s = "%s"', bcCacheSizeEnv, os.getenv(bcCacheSizeEnv))
+        maxSize = parseSize(_defaultSize)
+    return BitcodeCache(os.path.abspath(directory), maxSize)
+
+
+def main():
+    """ The entry point to wllvm-bc-cache.
+    """
+    parser = argparse.ArgumentParser(description='Reports on, or empties, the WLLVM_BC_CACHE bitcode cache.')
+    parser.add_argument('--stats', '-s', action='store_true', help='Print the cache statistics (the default).')
+    parser.add_argument('--zero-stats', '-z', dest='zeroStats', action='store_true', help='Zero the statistics counters.')
+    parser.add_argument('--clear', '-C', action='store_true', help='Remove every entry from the cache.')
+    args = parser.parse_args()
+
+    cache = getBitcodeCache()
+    if cache is None:
+        informUser(f'{bcCacheEnv} is not set.\n')
+        return 1
+
+    if args.clear:
+        for name in os.listdir(cache.directory) if os.path.isdir(cache.directory) else []:
+            if name != 'stats':
+                shutil.rmtree(os.path.join(cache.directory, name), ignore_errors=True)
+    if args.zeroStats:
+        shutil.rmtree(cache.statsDir, ignore_errors=True)
+    if args.stats or not (args.clear or args.zeroStats):
+        stats = cache.statistics()
+        lookups = stats['hits'] + stats['misses']
+        rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+        print(f'cache directory   {cache.directory}')
+        print(f'hits              {stats["hits"]}')
+        print(f'misses            {stats["misses"]}')
+        print(f'hit rate          {rate:.1f} %')
+        print(f'inserts           {stats["inserts"]}')
+        print(f'evictions         {stats["evictions"]}')
+        print(f'entries           {stats["entries"]}')
+        print(f'size              {stats["size"] / (1 << 20):.1f} MiB of {stats["maxSize"] / (1 << 20):.1f} MiB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
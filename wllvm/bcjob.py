@@ -0,0 +1,57 @@
+"""
+Building one job from the deferred bitcode queue.
+
+The queue (see bcqueue.py) runs every job in a fresh process, which
+reads the job from stdin and takes on its environment and working
+directory before doing the bitcode compile the job describes. That
+process is the only part of the queue that needs the compilers, which
+themselves need the queue to leave jobs in it.
+"""
+
+import json
+import os
+import sys
+
+from .bcqueue import jobSourceGone
+from .bcstore import bcStoreEnv, getContentHash, storeBitcode
+from .compilers import getBuilder, buildBitcodeFile
+from .fileutils import discardFile, temporaryName
+from .logconfig import logConfig, resetLogging
+
+# Internal logger
+_logger = logConfig(__name__)
+
+
+def runJob():
+    """ Runs in the process building one job, read from stdin: becomes the compile that queued it.
+    """
+    job = json.load(sys.stdin)
+    os.environ.clear()
+    os.environ.update(job['env'])
+    resetLogging()
+    try:
+        os.chdir(job['cwd'])
+    except OSError:
+        return jobSourceGone
+    if not os.path.exists(job['srcFile']):
+        return jobSourceGone
+    if job.get('srcHash') and getContentHash(job['srcFile']) != job['srcHash']:
+        _logger.error('"%s" has changed since it was compiled, so its bitcode would not match', job['srcFile'])
+        return 1
+
+    bcFile = job['bcFile']
+    builder = getBuilder(job['cmd'], job['mode'])
+    af = builder.getBitcodeArglistFilter()
+    # build under another name, so that nobody ever sees half a bitcode file
+    tmp = temporaryName(bcFile)
+    try:
+        # the dependency files are the real compile's business
+        buildBitcodeFile(builder, job['srcFile'], tmp, af.getCompileArgsWithoutDependencies())
+        os.replace(tmp, bcFile)
+    finally:
+        discardFile(tmp)
+
+    storeEnv = os.getenv(bcStoreEnv)
+    if storeEnv:
+        storeBitcode(storeEnv, bcFile)
+    return 0
@@ -0,0 +1,456 @@
+"""
+The deferred bitcode queue.
+
+With WLLVM_BITCODE_MODE=deferred a compile builds the object, attaches
+the path its bitcode will have, and leaves a job describing the bitcode
+compile in a queue directory rather than running it. The queue is
+WLLVM_BC_QUEUE, or else ~/.cache/wllvm/bc-queue, laid out as:
+
+    queue/<sha256 of the bitcode path>.json     waiting to be built
+    running/<name>.json, running/<name>.log     being built
+    failed/<name>.json, failed/<name>.log       the compile failed
+
+Jobs appear atomically (temporary name plus rename), so a half written
+job is never seen. Whoever builds a job first takes an flock on it and
+then renames it into running/, so exactly one process wins it, and a
+job in running/ that nobody holds a lock on belongs to a worker that
+died and goes back into queue/. Queueing the same bitcode file again
+replaces the old job, so the latest compile is the one that counts.
+
+A job records the compile command, working directory, the part of the
+environment the compiler and wllvm pay attention to, and the sha256 of
+the source file; the queue directories are made 0700, and the jobs
+0600. It is built by a fresh process that takes those on, checks the
+source has not changed since, and runs the usual bitcode compile (the
+bitcode cache applies) to a temporary name, which is then renamed over
+the bitcode path, and finally put in the WLLVM_BC_STORE if the compile
+asked for that. A job whose source has changed fails rather than attach
+bitcode that does not match the object; as with the lazy mode's
+recipes, changes to headers are not noticed.
+
+Three things build jobs:
+
+  - wllvm-bcd, a pool of workers, at a lower CPU and IO priority,
+  - wllvm-flush, which builds everything that is left and waits for
+    the jobs others are building, for the end of a CI build,
+  - extract-bc, which builds, or waits for, just the bitcode it needs.
+"""
+
+import os
+import sys
+import json
+import time
+
+from .logconfig import logConfig, informUser
+
+# Every deferred compile imports us to queue one job; what building the
+# jobs takes is imported by the workers that do it.
+# pylint: disable=import-outside-toplevel
+
+# Internal logger
+_logger = logConfig(__name__)
+
+bcQueueEnv = 'WLLVM_BC_QUEUE'
+
+# The queue state directories.
+_states = ('queue', 'running', 'failed')
+
+# The environment a job keeps: what the compiler, and wllvm, pay attention to.
+# The rest (tokens and passwords included) is no business of a file on disk.
+_jobEnv = ('PATH', 'HOME', 'TMPDIR', 'LANG', 'XDG_CACHE_HOME', 'LD_LIBRARY_PATH', 'BINUTILS_TARGET_PREFIX',
+           'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'OBJC_INCLUDE_PATH', 'LIBRARY_PATH',
+           'COMPILER_PATH', 'GCC_EXEC_PREFIX', 'SDKROOT', 'MACOSX_DEPLOYMENT_TARGET', 'SOURCE_DATE_EPOCH')
+_jobEnvPrefixes = ('LLVM_', 'WLLVM_', 'CLANG_', 'CCC_', 'LC_')
+
+# None of these mean anything to the job once the compile that queued it is gone.
+_transientEnv = ('MAKEFLAGS', 'MFLAGS', 'WLLVM_DAEMON_SOCKET')
+
+# The exit status of a job whose source file has gone; there is nothing to build.
+jobSourceGone = 3
+
+# How often, in seconds, we look at the queue when there is nothing else to do.
+_defaultPoll = 1.0
+
+_jobRunner = 'import sys; from wllvm.bcjob import runJob; sys.exit(runJob())'
+
+
+def _removeQuietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def getJobName(bcPath):
+    import hashlib
+    return hashlib.sha256(os.path.abspath(bcPath).encode('utf-8')).hexdigest() + '.json'
+
+
+def getJobEnvironment(environ):
+    """ The part of environ that a job needs to redo the compile.
+    """
+    return {k: v for (k, v) in environ.items()
+            if (k in _jobEnv or k.startswith(_jobEnvPrefixes)) and k not in _transientEnv}
+
+
+def getDefaultQueueDir():
+    cacheHome = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'wllvm', 'bc-queue')
+
+
+class ClaimedJob:
+    """ A job we hold the lock on, and so may build.
+    """
+
+    def __init__(self, name, fd, job):
+        self.name = name
+        self.fd = fd
+        self.job = job
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class BitcodeQueue:
+    """ The queue directory and the operations on it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, state, name):
+        return os.path.join(self.directory, state, name)
+
+    def makeDirectories(self):
+        # the jobs hold command lines and environments, which are ours alone
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        for state in _states:
+            os.makedirs(os.path.join(self.directory, state), mode=0o700, exist_ok=True)
+
+    def listJobs(self, state):
+        """ The names of the jobs in state, oldest first.
+        """
+        jobs = []
+        try:
+            with os.scandir(os.path.join(self.directory, state)) as it:
+                for entry in it:
+                    if entry.name.endswith('.json') and not entry.name.startswith('.'):
+                        try:
+                            jobs.append((entry.stat().st_mtime_ns, entry.name))
+                        except OSError:
+                            pass
+        except OSError:
+            return []
+        return [name for (_, name) in sorted(jobs)]
+
+    def push(self, builder, srcFile, bcFile):
+        """ Queues the bitcode compile of srcFile to bcFile, replacing any earlier one.
+        """
+        from .bcstore import getContentHash
+        from .fileutils import temporaryName
+        self.makeDirectories()
+        name = getJobName(bcFile)
+        job = {
+            'cwd': os.getcwd(),
+            'mode': builder.mode,
+            'cmd': builder.cmd,
+            'env': getJobEnvironment(os.environ),
+            'srcFile': srcFile,
+            'srcHash': getContentHash(srcFile),
+            'bcFile': os.path.abspath(bcFile),
+        }
+        path = self.path('queue', name)
+        tmp = temporaryName(path)
+        try:
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+                json.dump(job, f)
+            os.replace(tmp, path)
+        except OSError:
+            _removeQuietly(tmp)
+            raise
+        # an old failure no longer says anything about this bitcode file
+        _removeQuietly(self.path('failed', name))
+        _removeQuietly(self.logPath('failed', name))
+        _logger.debug('Queued the bitcode compile of %s to %s as %s', srcFile, bcFile, name)
+
+    def claim(self, name):
+        """ Takes the queued job name for ourselves, returning None if someone else has it.
+        """
+        import fcntl
+        path = self.path('queue', name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # the lock goes with the file, so it is still ours in running/
+            os.rename(path, self.path('running', name))
+        except OSError:
+            os.close(fd)
+            return None
+        try:
+            with os.fdopen(os.dup(fd), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            _logger.error('Could not read the bitcode job %s', name)
+            try:
+                os.replace(self.path('running', name), self.path('failed', name))
+            except OSError:
+                pass
+            os.close(fd)
+            return None
+        return ClaimedJob(name, fd, job)
+
+    def claimNext(self):
+        """ Claims the oldest job in the queue, if there is one we can have.
+        """
+        for name in self.listJobs('queue'):
+            claimed = self.claim(name)
+            if claimed is not None:
+                return claimed
+        return None
+
+    def isOurs(self, claimed, state):
+        """ Whether the job file at state is still the one we claimed, and not a later one.
+        """
+        try:
+            return os.path.samestat(os.stat(self.path(state, claimed.name)), os.fstat(claimed.fd))
+        except OSError:
+            return False
+
+    def logPath(self, state, name):
+        return self.path(state, name[:-len('.json')] + '.log')
+
+    def build(self, claimed):
+        """ Builds a claimed job in a process of its own, returning whether that worked.
+
+        Under make, the job takes a job slot: it does not see make's
+        jobserver itself, since MAKEFLAGS is not kept.
+        """
+        import subprocess
+        from .jobserver import jobSlot
+        log = self.logPath('running', claimed.name)
+        try:
+            with jobSlot(), os.fdopen(os.open(log, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as output:
+                rc = subprocess.run([sys.executable, '-c', _jobRunner], input=json.dumps(claimed.job).encode(),
+                                    stdout=output, stderr=subprocess.STDOUT, check=False).returncode
+        except OSError as e:
+            _logger.error('Could not run the bitcode job %s: %s', claimed.name, str(e))
+            rc = 1
+        if rc in (0, jobSourceGone):
+            if rc == jobSourceGone:
+                _logger.info('Dropped the bitcode job for %s, its source is gone', claimed.job.get('bcFile'))
+            _removeQuietly(log)
+            if self.isOurs(claimed, 'running'):
+                _removeQuietly(self.path('running', claimed.name))
+        else:
+            _logger.warning('Failed to build the deferred bitcode %s; see %s',
+                            claimed.job.get('bcFile'), self.logPath('failed', claimed.name))
+            try:
+                os.replace(log, self.logPath('failed', claimed.name))
+                if self.isOurs(claimed, 'running'):
+                    os.replace(self.path('running', claimed.name), self.path('failed', claimed.name))
+            except OSError:
+                pass
+        claimed.release()
+        return rc in (0, jobSourceGone)
+
+    def recover(self):
+        """ Puts the jobs of workers that died back in the queue.
+        """
+        import fcntl
+        for name in self.listJobs('running'):
+            path = self.path('running', name)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if os.path.samestat(os.stat(path), os.fstat(fd)):
+                    _logger.info('Requeueing the abandoned bitcode job %s', name)
+                    if os.path.exists(self.path('queue', name)):
+                        os.remove(path)
+                    else:
+                        os.rename(path, self.path('queue', name))
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+    def retryFailed(self):
+        """ Puts the failed jobs back in the queue.
+        """
+        for name in self.listJobs('failed'):
+            try:
+                os.rename(self.path('failed', name), self.path('queue', name))
+            except OSError:
+                pass
+            _removeQuietly(self.logPath('failed', name))
+
+    def isIdle(self):
+        return not self.listJobs('queue') and not self.listJobs('running')
+
+    def awaitBitcode(self, bcPath, poll=0.1):
+        """ Returns once the bitcode file bcPath is no longer queued or being built.
+
+        A job still in the queue we build ourselves; a job being built by
+        someone else we wait for. Returns False if the compile failed.
+        """
+        name = getJobName(bcPath)
+        while True:
+            claimed = self.claim(name)
+            if claimed is not None:
+                return self.build(claimed)
+            if not self.isPending(bcPath):
+                return not os.path.exists(self.path('failed', name))
+            self.recover()
+            time.sleep(poll)
+
+    def isPending(self, bcPath):
+        name = getJobName(bcPath)
+        return os.path.exists(self.path('queue', name)) or os.path.exists(self.path('running', name))
+
+
+def getBitcodeQueue():
+    """ Returns the queue named by WLLVM_BC_QUEUE, or the default one.
+    """
+    return BitcodeQueue(os.path.abspath(os.getenv(bcQueueEnv) or getDefaultQueueDir()))
+
+
+def drain(queue, jobs, untilEmpty=False, idleTimeout=None, poll=_defaultPoll):
+    """ Builds jobs, jobs at a time, until the queue is empty or we have been idle for idleTimeout seconds.
+
+    With untilEmpty we also wait for the jobs other processes are
+    building. Returns the number of jobs built and the number that failed.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    built = failed = 0
+    lastWork = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = set()
+        while True:
+            while len(running) < jobs:
+                claimed = queue.claimNext()
+                if claimed is None:
+                    break
+                running.add(pool.submit(queue.build, claimed))
+            if running:
+                (done, running) = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result():
+                        built += 1
+                    else:
+                        failed += 1
+                lastWork = time.monotonic()
+                continue
+            queue.recover()
+            if untilEmpty and queue.isIdle():
+                break
+            if idleTimeout is not None and time.monotonic() - lastWork > idleTimeout:
+                _logger.info('Idle for %s seconds, exiting', idleTimeout)
+                break
+            time.sleep(poll)
+    return (built, failed)
+
+
+def lowerPriority(niceness):
+    """ Gets out of the way of the builds: a lower CPU priority and, where we can, the idle IO class.
+    """
+    if niceness:
+        os.nice(niceness)
+    if sys.platform.startswith('linux'):
+        import shutil
+        import subprocess
+        ionice = shutil.which('ionice')
+        if ionice:
+            subprocess.call([ionice, '-c', '3', '-p', str(os.getpid())], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def awaitDeferredBitcode(bcPaths):
+    """ Makes sure none of the bitcode files in bcPaths is still to be built.
+
+    Returns those whose deferred compile failed.
+    """
+    queue = getBitcodeQueue()
+    if not os.path.isdir(queue.directory):
+        return []
+    pending = [p for p in bcPaths if p and queue.isPending(p)]
+    if not pending:
+        return []
+    _logger.info('Waiting for %d deferred bitcode compiles', len(pending))
+    from concurrent.futures import ThreadPoolExecutor
+    from .jobserver import getJobCount
+    with ThreadPoolExecutor(max_workers=min(len(pending), getJobCount())) as pool:
+        results = list(pool.map(queue.awaitBitcode, pending))
+    failures = [p for (p, ok) in zip(pending, results) if not ok]
+    for p in failures:
+        _logger.error('The deferred bitcode compile of "%s" failed; see %s', p,
+                      queue.logPath('failed', getJobName(p)))
+    return failures
+
+
+def _parser(description):
+    import argparse
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--queue', '-q', default=None,
+                        help=f'The queue directory (defaults to ${bcQueueEnv}, else {getDefaultQueueDir()}).')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='The number of bitcode compiles to run at once. Defaults to WLLVM_JOBS, '
+                        'or else the number of CPUs; under make, make\'s job slots are taken too.')
+    return parser
+
+
+def _getJobs(args):
+    from .jobserver import getJobCount
+    return max(1, args.jobs or getJobCount())
+
+
+def _getQueue(args):
+    queue = BitcodeQueue(os.path.abspath(args.queue)) if args.queue else getBitcodeQueue()
+    queue.makeDirectories()
+    return queue
+
+
+def main():
+    """ The entry point to wllvm-bcd.
+    """
+    parser = _parser('Builds the bitcode that deferred compiles left in the queue, in the background.')
+    parser.add_argument('--nice', '-n', type=int, default=10,
+                        help='How much to lower our CPU priority by. Default %(default)s')
+    parser.add_argument('--idle-timeout', '-t', dest='idleTimeout', type=float, default=None,
+                        help='Exit after this many seconds without a job.')
+    args = parser.parse_args()
+    queue = _getQueue(args)
+    lowerPriority(args.nice)
+    try:
+        drain(queue, _getJobs(args), idleTimeout=args.idleTimeout)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def flush():
+    """ The entry point to wllvm-flush.
+    """
+    parser = _parser('Builds all the deferred bitcode, and waits for what others are building.')
+    parser.add_argument('--retry-failed', '-r', dest='retryFailed', action='store_true',
+                        help='Have another go at the jobs that failed before.')
+    args = parser.parse_args()
+    queue = _getQueue(args)
+    if args.retryFailed:
+        queue.retryFailed()
+    (built, failed) = drain(queue, _getJobs(args), untilEmpty=True, poll=0.1)
+    informUser(f'Finished {built} deferred bitcode compiles, {failed} failed\n')
+    failures = queue.listJobs('failed')
+    for name in failures:
+        informUser(f'failed: {queue.logPath("failed", name)}\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+The WLLVM_BC_STORE bitcode store.
+
+If the environment variable WLLVM_BC_STORE names a directory, every
+bitcode file that gets attached to an object is also preserved there,
+so that extract-bc can still find it after the build tree is gone.
+
+The store is content addressed:
+
+    $WLLVM_BC_STORE/objects/ab/abcdef...    the bitcode, named by the sha256 of its contents
+    $WLLVM_BC_STORE/<sha256 of the path>    a relative symlink to the above
+
+so identical bitcode from different build trees is only stored once.
+Objects are reflinked in when possible, else copied; never hard linked,
+which would let a build rewriting its .bc file change the object. Both
+objects and pointers appear atomically (temporary name plus rename), so
+concurrent builds never see partial files. Stores written by older
+versions, where the path named entry is a full copy, still work.
+
+If WLLVM_BC_STORE_COMPRESSION names a codec (gzip, bz2 or lzma), new
+objects are written compressed, as objects/ab/abcdef....gz (.bz2, .xz);
+the name is still the hash of the bitcode itself. extract-bc
+decompresses what it needs into a scratch directory just before the
+link. A pointer whose object has since been compressed (wllvm-bc-store
+--compress) finds it next to where it was.
+
+What compressing and decompressing cost is logged, one JSON line at a
+time, in stats.jsonl at the top of the store; wllvm-bc-store reports it.
+"""
+
+import os
+import sys
+import time
+
+from .logconfig import logConfig, informUser
+
+# Every attach imports us, and most only want bcStoreEnv; the hashing,
+# codecs and file helpers are imported when they are used.
+# pylint: disable=import-outside-toplevel
+
+# Internal logger
+_logger = logConfig(__name__)
+
+bcStoreEnv = 'WLLVM_BC_STORE'
+
+bcStoreCompressionEnv = 'WLLVM_BC_STORE_COMPRESSION'
+
+objectsDirName = 'objects'
+
+statsFileName = 'stats.jsonl'
+
+# The codecs, and the suffixes of the objects they write.
+codecSuffixes = {'gzip': '.gz', 'bz2': '.bz2', 'lzma': '.xz'}
+
+_suffixCodecs = {suffix: codec for (codec, suffix) in codecSuffixes.items()}
+
+
+def getHashedPathName(path):
+    import hashlib
+    return hashlib.sha256(path.encode('utf-8')).hexdigest() if path else None
+
+
+def getContentHash(path):
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def getObjectPath(storeDir, contentHash):
+    return os.path.join(storeDir, objectsDirName, contentHash[:2], contentHash)
+
+
+def getCompression():
+    """ The codec WLLVM_BC_STORE_COMPRESSION asks for, or None to store objects as they are.
+    """
+    codec = os.getenv(bcStoreCompressionEnv)
+    if not codec or codec == 'none':
+        return None
+    if codec not in codecSuffixes:
+        _logger.warning('Ignoring %s = "%s"; it should be one of none, %s',
+                        bcStoreCompressionEnv, codec, ', '.join(codecSuffixes))
+        return None
+    return codec
+
+
+def getCodec(path):
+    """ The codec the object at path was written with, or None if it is not compressed.
+    """
+    return _suffixCodecs.get(os.path.splitext(path)[1])
+
+
+def openCodec(codec, path, mode):
+    if codec == 'gzip':
+        import gzip
+        return gzip.open(path, mode)
+    if codec == 'bz2':
+        import bz2
+        return bz2.open(path, mode)
+    import lzma
+    return lzma.open(path, mode)
+
+
+def findObject(objectPath):
+    """ The object at objectPath, compressed or not, if the store has it.
+    """
+    for suffix in ('',) + tuple(codecSuffixes.values()):
+        if os.path.isfile(objectPath + suffix):
+            return objectPath + suffix
+    return None
+
+
+def recordStatistic(storeDir, **entry):
+    """ Appends entry to the store statistics, with a single O_APPEND write.
+    """
+    import json
+    from .fileutils import appendToFile
+    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+    try:
+        appendToFile(os.path.join(storeDir, statsFileName), line)
+    except OSError as e:
+        _logger.debug('Could not record store statistics: %s', str(e))
+
+
+def compressFile(storeDir, src, dst, codec):
+    """ Atomically makes dst the compressed contents of src.
+    """
+    import shutil
+    from .fileutils import discardFile, temporaryName
+    tmp = temporaryName(dst)
+    start = time.perf_counter()
+    try:
+        with open(src, 'rb') as s, openCodec(codec, tmp, 'wb') as d:
+            shutil.copyfileobj(s, d, 1 << 20)
+        os.replace(tmp, dst)
+    except OSError:
+        discardFile(tmp)
+        raise
+    recordStatistic(storeDir, op='compress', codec=codec, size=os.path.getsize(src), stored=os.path.getsize(dst),
+                    seconds=time.perf_counter() - start)
+
+
+def decompressFile(storeDir, src, dst):
+    """ Atomically makes dst the decompressed contents of the object src.
+    """
+    import shutil
+    from .fileutils import discardFile, temporaryName
+    codec = getCodec(src)
+    tmp = temporaryName(dst)
+    start = time.perf_counter()
+    try:
+        with openCodec(codec, src, 'rb') as s, open(tmp, 'wb') as d:
+            shutil.copyfileobj(s, d, 1 << 20)
+        os.replace(tmp, dst)
+    except (OSError, EOFError):
+        discardFile(tmp)
+        raise
+    recordStatistic(storeDir, op='decompress', codec=codec, size=os.path.getsize(dst), stored=os.path.getsize(src),
+                    seconds=time.perf_counter() - start)
+
+
+def storeBitcode(storeDir, absBcPath):
+    """ Preserves the bitcode file absBcPath in the store, returning its object path.
+    """
+    from .fileutils import installFile, temporaryName
+    basePath = getObjectPath(storeDir, getContentHash(absBcPath))
+    objectPath = findObject(basePath)
+    if objectPath is None:
+        os.makedirs(os.path.dirname(basePath), exist_ok=True)
+        codec = getCompression()
+        if codec:
+            objectPath = basePath + codecSuffixes[codec]
+            compressFile(storeDir, absBcPath, objectPath, codec)
+        else:
+            objectPath = basePath
+            installFile(absBcPath, objectPath)
+
+    pointer = os.path.join(storeDir, getHashedPathName(absBcPath))
+    target = os.path.relpath(objectPath, storeDir)
+    if os.path.islink(pointer) and os.readlink(pointer) == target:
+        return objectPath
+    tmp = temporaryName(pointer)
+    os.symlink(target, tmp)
+    os.replace(tmp, pointer)
+    _logger.debug('Stored %s as %s', absBcPath, objectPath)
+    return objectPath
+
+
+def getStorePath(bcPath):
+    """ Returns where the store keeps the bitcode file that was at bcPath, if it does.
+    """
+    storeEnv = os.getenv(bcStoreEnv)
+    if storeEnv and bcPath:
+        hashName = getHashedPathName(bcPath)
+        hashPath = os.path.join(storeEnv, hashName)
+        if os.path.islink(hashPath):
+            # follow the pointer to the object, which may have been compressed since
+            target = os.path.realpath(hashPath)
+            if os.path.isfile(target):
+                return target
+            return findObject(target[:-len(os.path.splitext(target)[1])] if getCodec(target) else target)
+        if os.path.isfile(hashPath):
+            # an old style copy
+            return hashPath
+    return None
+
+
+def getStoredBitcode(bcPath, scratchDir):
+    """ Returns the path of a readable copy of the bitcode the store keeps for bcPath, if it does.
+
+    A compressed object is decompressed into scratchDir, once.
+    """
+    storePath = getStorePath(bcPath)
+    if storePath is None or getCodec(storePath) is None:
+        return storePath
+    (name, _) = os.path.splitext(os.path.basename(storePath))
+    bcFile = os.path.join(scratchDir, f'{name}.bc')
+    if not os.path.isfile(bcFile):
+        try:
+            decompressFile(os.getenv(bcStoreEnv), storePath, bcFile)
+        except (OSError, EOFError) as e:
+            _logger.error('Could not decompress "%s": %s', storePath, str(e))
+            return None
+    return bcFile
+
+
+def compressStore(storeDir, codec):
+    """ Compresses every object in the store that is not already, returning how many it did.
+
+    The pointers are left alone: getStorePath finds the object next to
+    where they point.
+    """
+    count = 0
+    for (root, _, files) in os.walk(os.path.join(storeDir, objectsDirName)):
+        for name in files:
+            path = os.path.join(root, name)
+            if getCodec(path) or name.endswith('.tmp'):
+                continue
+            compressFile(storeDir, path, path + codecSuffixes[codec], codec)
+            os.remove(path)
+            count += 1
+    return count
+
+
+def statistics(storeDir):
+    """ The objects in the store, by codec, and what compressing and decompressing cost.
+    """
+    import json
+    stats = {'objects': {}, 'compress': {}, 'decompress': {}}
+    for (root, _, files) in os.walk(os.path.join(storeDir, objectsDirName)):
+        for name in files:
+            if name.endswith('.tmp'):
+                continue
+            codec = getCodec(name) or 'none'
+            entry = stats['objects'].setdefault(codec, {'count': 0, 'stored': 0})
+            entry['count'] += 1
+            try:
+                entry['stored'] += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    try:
+        with open(os.path.join(storeDir, statsFileName), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                op = stats.get(record.get('op'))
+                if op is None:
+                    continue
+                entry = op.setdefault(record.get('codec'), {'count': 0, 'size': 0, 'stored': 0, 'seconds': 0.0})
+                entry['count'] += 1
+                for key in ('size', 'stored', 'seconds'):
+                    entry[key] += record.get(key, 0)
+    except OSError:
+        pass
+    return stats
+
+
+def main():
+    """ The entry point to wllvm-bc-store.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Reports on, or compresses, the WLLVM_BC_STORE bitcode store.')
+    parser.add_argument('--stats', '-s', action='store_true', help='Print the store statistics (the default).')
+    parser.add_argument('--zero-stats', '-z', dest='zeroStats', action='store_true',
+                        help='Forget what compressing and decompressing cost so far.')
+    parser.add_argument('--compress', '-c', choices=sorted(codecSuffixes), metavar='CODEC',
+                        help=f'Compress the objects that are not already, with one of {", ".join(codecSuffixes)}.')
+    args = parser.parse_args()
+
+    storeDir = os.getenv(bcStoreEnv)
+    if not storeDir or not os.path.isdir(storeDir):
+        informUser(f'{bcStoreEnv} is not set to a directory.\n')
+        return 1
+
+    if args.zeroStats:
+        try:
+            os.remove(os.path.join(storeDir, statsFileName))
+        except OSError:
+            pass
+    if args.compress:
+        informUser(f'Compressed {compressStore(storeDir, args.compress)} objects\n')
+    if args.stats or not (args.zeroStats or args.compress):
+        stats = statistics(storeDir)
+        print(f'store directory   {storeDir}')
+        for (codec, entry) in sorted(stats['objects'].items()):
+            print(f'objects           {entry["count"]} {codec}, {entry["stored"] / (1 << 20):.1f} MiB')
+        for (codec, entry) in sorted(stats['compress'].items()):
+            ratio = entry['size'] / entry['stored'] if entry['stored'] else 0.0
+            print(f'compressed        {entry["count"]} {codec}, {entry["size"] / (1 << 20):.1f} MiB to '
+                  f'{entry["stored"] / (1 << 20):.1f} MiB (ratio {ratio:.2f}) in {entry["seconds"]:.2f} s')
+        for (codec, entry) in sorted(stats['decompress'].items()):
+            rate = entry['size'] / (1 << 20) / entry['seconds'] if entry['seconds'] else 0.0
+            print(f'decompressed      {entry["count"]} {codec}, {entry["size"] / (1 << 20):.1f} MiB '
+                  f'in {entry["seconds"]:.2f} s ({rate:.1f} MiB/s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
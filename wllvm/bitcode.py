@@ -0,0 +1,107 @@
+"""
+Just enough of the LLVM bitstream format to tell bitcode modules apart.
+
+With WLLVM_BITCODE_MODE=embed every object carries its own module in a
+.llvmbc section, and the linker simply concatenates those sections,
+padding between them as it aligns each one. Pulling the modules back out
+only needs the size of each: a module is the magic number followed by a
+sequence of top level blocks, each of which records its length in 32 bit
+words, so there is no need to understand the contents.
+
+Bitcode may also come inside the wrapper header used on Darwin, which
+gives the offset and size of the module it wraps.
+"""
+
+import struct
+
+BITCODE_MAGIC = b'BC\xc0\xde'
+WRAPPER_MAGIC = b'\xde\xc0\x17\x0b'
+
+# magic, version, offset, size
+_wrapperHeader = struct.Struct('<IIII')
+
+# The abbreviation id width at the top level, and the id that starts a block.
+_topLevelAbbrevWidth = 2
+ENTER_SUBBLOCK = 1
+
+
+class BitReader:
+    """ Reads fields from a bitstream, least significant bit first.
+    """
+
+    def __init__(self, data, start):
+        self.data = data
+        self.start = start
+        self.bit = 0
+
+    def read(self, width):
+        value = 0
+        for i in range(width):
+            (index, shift) = divmod(self.bit, 8)
+            if self.start + index >= len(self.data):
+                raise ValueError('truncated bitcode')
+            value |= ((self.data[self.start + index] >> shift) & 1) << i
+            self.bit += 1
+        return value
+
+    def readVBR(self, width):
+        """ Reads a variable width integer made of width bit chunks.
+        """
+        hi = 1 << (width - 1)
+        value = shift = 0
+        while True:
+            chunk = self.read(width)
+            value |= (chunk & (hi - 1)) << shift
+            if not chunk & hi:
+                return value
+            shift += width - 1
+
+    def alignTo32(self):
+        self.bit += -self.bit % 32
+
+    def bytePosition(self):
+        return self.start + self.bit // 8
+
+
+def moduleEnd(data, start):
+    """ Returns the offset just past the bitcode module starting, magic and all, at start.
+    """
+    pos = start + len(BITCODE_MAGIC)
+    # blocks start, and end, on 32 bit boundaries
+    while pos + 4 <= len(data) and data[pos] & ((1 << _topLevelAbbrevWidth) - 1) == ENTER_SUBBLOCK:
+        reader = BitReader(data, pos)
+        reader.read(_topLevelAbbrevWidth)
+        reader.readVBR(8)     # the block id
+        reader.readVBR(4)     # the abbreviation width inside the block
+        reader.alignTo32()
+        words = reader.read(32)
+        pos = reader.bytePosition() + 4 * words
+        if pos > len(data):
+            raise ValueError(f'truncated bitcode block ending at {pos}')
+    return pos
+
+
+def splitBitcode(data):
+    """ Splits the contents of a .llvmbc section into the bitcode modules it holds.
+    """
+    modules = []
+    pos = 0
+    while pos < len(data):
+        if data[pos] == 0:
+            # padding between the sections of different objects
+            pos += 1
+        elif data.startswith(WRAPPER_MAGIC, pos):
+            if pos + _wrapperHeader.size > len(data):
+                raise ValueError(f'truncated bitcode wrapper at {pos}')
+            (_, _, offset, size) = _wrapperHeader.unpack_from(data, pos)
+            if pos + offset + size > len(data):
+                raise ValueError(f'truncated bitcode wrapper at {pos}')
+            modules.append(bytes(data[pos + offset:pos + offset + size]))
+            pos += offset + size
+        elif data.startswith(BITCODE_MAGIC, pos):
+            end = moduleEnd(data, pos)
+            modules.append(bytes(data[pos:end]))
+            pos = end
+        else:
+            raise ValueError(f'no bitcode at offset {pos}')
+    return modules
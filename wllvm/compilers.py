@@ -4,28 +4,37 @@ from __future__ import print_function
 
 import os
 import sys
-import tempfile
-import hashlib
-import subprocess
 
-from shutil import copyfile
-from .filetype import FileType
 from .popenwrapper import Popen
-from .arglistfilter import ArgumentListFilter
+from .jobserver import getJobCount, jobSlot
+from .responsefile import responseFileCommand
+from .metrics import metricsPhase, noteBitcodeFile, noteInvocation, recordExec, runWithMetrics, waitProcess
 
-from .logconfig import logConfig
+from .logconfig import logConfig, flushLogging
+
+# Everything else is imported where it is used: plenty of invocations
+# (configure tests, -E, -M, ...) never build any bitcode, and every one
+# of them pays for our imports. That includes the argument tables, which
+# execCompiler has no need of.
+# pylint: disable=import-outside-toplevel
 
 # Internal logger
 _logger = logConfig(__name__)
 
-def wcompile(mode):
+def wcompile(mode, parentPid=None):
     """ The workhorse, called from wllvm and wllvm++.
+
+    parentPid is who invoked us, when that is not our parent (see daemon.py).
+    With WLLVM_METRICS_DIR set, what each run cost is recorded (see metrics.py).
     """
+    return runWithMetrics(mode, _wcompile, mode, parentPid)
+
+
+def _wcompile(mode, parentPid):
 
     # Make sure we are not invoked from ccache
-    parentCmd = subprocess.check_output(
-            ['ps', '-o', 'comm=', '-p', str(os.getppid())], text=True)
-    if parentCmd.strip() == 'ccache':
+    parentCmd = getParentCommand(parentPid)
+    if parentCmd == 'ccache':
         # The following error message is invisible in terminal
         # when ccache is using its preprocessor mode
         _logger.error('Should not be invoked from ccache')
@@ -48,22 +57,57 @@ def wcompile(mode):
 
         af = builder.getBitcodeArglistFilter()
 
-        rc = buildObject(builder)
+        # no need to generate bitcode (e.g. configure only, assembly, ....)
+        (skipit, reason) = af.skipBitcodeGeneration()
+
+        bitcodeMode = getBitcodeMode()
+        noteInvocation(argvClass=classifyInvocation(af, skipit), skipReason=reason or None,
+                       tu=af.inputFiles[0] if len(af.inputFiles) == 1 else None, bitcodeMode=bitcodeMode,
+                       bitcodeProfile=getBitcodeProfile())
+
+        # clang can put the bitcode in the object for us
+        if not skipit and bitcodeMode == 'embed' and canEmbedBitcode(builder):
+            return buildEmbeddedBitcode(builder, af)
+
+        # a deferred or lazy bitcode compile happens later, so there is nothing to overlap or share
+        later = bitcodeMode in ('deferred', 'lazy')
+
+        # compiling and linking, each source is compiled once and the objects linked once;
+        # unless the compile writes dependency files, which only the command as given can name
+        if not skipit and not af.isCompileOnly and not af.hasDependencyArgs():
+            compileAndLink(builder, af, bitcodeMode, not later and os.getenv(concurrentBitcodeEnv))
+
+        # optionally run the preprocessor once for both compiles
+        ppSuffix = None
+        if not skipit and not later and os.getenv(preprocessOnceEnv):
+            from .preprocess import getPreprocessedSuffix
+            ppSuffix = getPreprocessedSuffix(builder, af)
+        if ppSuffix:
+            return buildFromPreprocessed(builder, af, ppSuffix)
+
+        # the real compile runs in the job slot make gave us, so grab it before
+        # any bitcode compile can.
+        with jobSlot():
+            # optionally get the bitcode compiles going while the real compiler runs
+            pending = None
+            if not skipit and not later and os.getenv(concurrentBitcodeEnv):
+                pending = startBitcodeFiles(builder, af)
+
+            rc = buildObject(builder)
 
         # phase one compile failed. no point continuing
         if rc != 0:
             _logger.error('Failed to compile using given arguments: [%s]', legible_argstring)
+            abandonBitcodeFiles(pending)
             return rc
 
-        # no need to generate bitcode (e.g. configure only, assembly, ....)
-        (skipit, reason) = af.skipBitcodeGeneration()
         if skipit:
             _logger.debug('No work to do: %s', reason)
             _logger.debug(af.__dict__)
             return rc
 
         # phase two
-        buildAndAttachBitcode(builder, af)
+        buildAndAttachBitcode(builder, af, pending, bitcodeMode)
 
     except Exception as e:
         _logger.warning('%s: exception case: %s', mode, str(e))
@@ -74,6 +118,66 @@ def wcompile(mode):
 
 
 
+def classifyInvocation(af, skipit):
+    """ What sort of invocation af is, for the metrics.
+    """
+    if skipit and af.inputFiles:
+        return 'no-bitcode'
+    if af.isCompileOnly:
+        return 'compile' if len(af.inputFiles) <= 1 else 'compile-many'
+    if af.inputFiles:
+        return 'compile-and-link'
+    return 'link' if af.objectFiles else 'other'
+
+
+def execCompiler(mode, cmd):
+    """ Becomes the real compiler, for invocations that build no bitcode.
+
+    Only returns if that cannot be done, in which case wcompile will
+    have to take care of things (and of reporting what went wrong).
+    """
+    if getParentCommand() == 'ccache':
+        return
+    _logger.info('Entering CC [%s]', ' '.join(cmd))
+    try:
+        compiler = getBuilder(cmd, mode).getCompiler()
+    except Exception:
+        return
+    _logger.debug('No bitcode to build, so handing over to %s', compiler)
+    recordExec(mode)
+    # exec skips logging's clean up, which would have written out any held records
+    flushLogging()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.execvp(compiler[0], compiler + cmd)
+    except OSError:
+        return
+
+
+def getParentCommand(ppid=None):
+    """ Returns the command name of our parent process, or of process ppid.
+
+    Where there is a /proc we just read it, since this happens on every
+    single invocation; spawning ps is the fallback for everywhere else.
+    A process that is gone, or that ps cannot tell us about, has the
+    empty name.
+    """
+    if ppid is None:
+        ppid = os.getppid()
+    try:
+        with open(f'/proc/{ppid}/comm', encoding='utf-8', errors='replace') as comm:
+            return comm.read().strip()
+    except OSError:
+        pass
+    import subprocess
+    try:
+        return subprocess.check_output(['ps', '-o', 'comm=', '-p', str(ppid)], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
 fullSelfPath = os.path.realpath(__file__)
 prefix = os.path.dirname(fullSelfPath)
 driverDir = prefix
@@ -86,9 +190,47 @@ llvmCompilerPathEnv = 'LLVM_COMPILER_PATH'
 # Environmental variable for cross-compilation target.
 binutilsTargetPrefixEnv = 'BINUTILS_TARGET_PREFIX'
 
+# Environmental variable that, when set, runs the bitcode compiles at the same
+# time as the real compile rather than after it.
+concurrentBitcodeEnv = 'WLLVM_CONCURRENT_BITCODE'
+
+# Environmental variable that, when set, has a compile of a single C or C++
+# file run the preprocessor once, and build the object and the bitcode from
+# its output.
+preprocessOnceEnv = 'WLLVM_PREPROCESS_ONCE'
+
+# Environmental variable choosing how the bitcode is made and found:
+#   attach   a separate bitcode compile, whose path goes in the object (the default)
+#   embed    clang's -fembed-bitcode puts the bitcode itself in the object
+#   deferred as attach, but the bitcode compile is queued for later (see bcqueue.py)
+#   lazy     no bitcode compile; the object says how extract-bc can do it (see recipe.py)
+bitcodeModeEnv = 'WLLVM_BITCODE_MODE'
+bitcodeModes = ('attach', 'embed', 'deferred', 'lazy')
+
+# Environmental variable choosing which of the compile flags carry over into
+# the bitcode compile:
+#   full     all of them (the default)
+#   nodebug  all but the debug info flags (-g...)
+#   fast     neither debug info, sanitizer nor profiling flags, and clang runs
+#            none of the LLVM passes, so the IR is as the front end left it
+bitcodeProfileEnv = 'WLLVM_BITCODE_PROFILE'
+bitcodeProfiles = ('full', 'nodebug', 'fast')
+
+# The flags the fast profile drops, besides the debug info flags.
+_sanitizerPrefixes = ('-fsanitize', '-fno-sanitize')
+_profilingPrefixes = ('-fprofile-', '-fno-profile-', '-fcoverage-', '-fno-coverage-', '-finstrument-function', '-fxray-')
+_profilingFlags = ('-pg', '--coverage', '-ftest-coverage')
+
+# The flags whose argument is handed on to someone else, and so is never one of ours.
+_passThroughFlags = ('-Xclang', '-mllvm', '-Xpreprocessor', '-Xassembler', '-Xlinker')
+
 # This is the ELF section name inserted into binaries
 elfSectionName = '.llvm_bc'
 
+# This is where clang's -fembed-bitcode puts the bitcode
+embeddedSectionName = '.llvmbc'
+embedBitcodeFlags = ['-fembed-bitcode=all']
+
 # (Fix: 2016/02/16: __LLVM is now used by MacOS's ld so we changed the segment name to __WLLVM).
 #
 # These are the MACH_O segment and section name
@@ -99,28 +241,15 @@ darwinSegmentName = '__WLLVM'
 darwinSectionName = '__llvm_bc'
 
 
-# Same as an ArgumentListFilter, but DO NOT change the name of the output filename when
-# building the bitcode file so that we don't clobber the object file.
-class ClangBitcodeArgumentListFilter(ArgumentListFilter):
-    def __init__(self, arglist):
-        localCallbacks = {'-o' : (1, ClangBitcodeArgumentListFilter.outputFileCallback)}
-        #super(ClangBitcodeArgumentListFilter, self).__init__(arglist, exactMatches=localCallbacks)
-        super().__init__(arglist, exactMatches=localCallbacks)
-
-    def outputFileCallback(self, flag, filename):
-        self.outputFilename = filename
-
-
-def getHashedPathName(path):
-    return hashlib.sha256(path.encode('utf-8')).hexdigest() if path else None
-
-
-def attachBitcodePathToObject(bcPath, outFileName):
+def attachBitcodePathToObject(bcPath, outFileName, store=True):
     # Don't try to attach a bitcode path to a binary.  Unfortunately
     # that won't work.
     (_, ext) = os.path.splitext(outFileName)
     _logger.debug('attachBitcodePathToObject: %s  ===> %s [ext = %s]', bcPath, outFileName, ext)
 
+    from .filetype import FileType
+    from .bcstore import bcStoreEnv, storeBitcode
+
     #iam: just object files, right?
     fileType = FileType.getFileType(outFileName)
     if fileType not in (FileType.MACH_OBJECT, FileType.ELF_OBJECT):
@@ -133,13 +262,61 @@ def attachBitcodePathToObject(bcPath, outFileName):
     #    _logger.warning('Cannot attach bitcode path to "%s of type %s"', outFileName, FileType.getReadableFileType(outFileName))
     #    return
 
-    # Now just build a temporary text file with the full path to the
-    # bitcode file that we'll write into the object file.
-    f = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
     absBcPath = os.path.abspath(bcPath)
-    f.write(absBcPath.encode())
+
+    # loicg: If the environment variable WLLVM_BC_STORE is set, preserve the bitcode
+    # file there, findable by a hash of the original bitcode path. (A deferred
+    # bitcode file does not exist yet; it is stored once it is built.)
+    storeEnv = os.getenv(bcStoreEnv)
+    if storeEnv and store:
+        storeBitcode(storeEnv, absBcPath)
+
+    attachLineToObject(absBcPath, outFileName)
+
+
+def attachRecipeToObject(recipe, outFileName):
+    """ Attaches the recipe for the bitcode of outFileName in place of a bitcode path (see recipe.py).
+    """
+    from .filetype import FileType
+    from .recipe import formatRecipe
+
+    fileType = FileType.getFileType(outFileName)
+    if fileType not in (FileType.MACH_OBJECT, FileType.ELF_OBJECT):
+        _logger.warning('Cannot attach a bitcode recipe to "%s of type %s"', outFileName, FileType.getFileTypeString(fileType))
+        return
+    attachLineToObject(formatRecipe(recipe), outFileName)
+
+
+def attachLineToObject(line, outFileName):
+    """ Adds line to the bitcode section of the object outFileName.
+    """
+    from .elf import appendToSection
+
+    # On ELF we can usually append the section ourselves, sparing us the
+    # temporary file and the objcopy, which rewrites the whole object.
+    if not sys.platform.startswith('darwin'):
+        try:
+            if os.path.getsize(outFileName) == 0:
+                return
+        except FileNotFoundError:
+            # configure loves to immediately delete things, causing issues for
+            # us here.  Just ignore it
+            sys.exit(0)
+        try:
+            if appendToSection(outFileName, elfSectionName, f'{line}\n'.encode()):
+                _logger.debug('Appended "%s" to the %s section of "%s"', line, elfSectionName, outFileName)
+                return
+        except OSError as e:
+            _logger.warning('Could not append to the %s section of "%s": %s', elfSectionName, outFileName, str(e))
+        _logger.debug('Falling back on objcopy for "%s"', outFileName)
+
+    # Now just build a temporary text file with the line (usually the full
+    # path to the bitcode file) that we'll write into the object file.
+    import tempfile
+    f = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
+    f.write(line.encode())
     f.write('\n'.encode())
-    _logger.debug('Wrote "%s" to file "%s"', absBcPath, f.name)
+    _logger.debug('Wrote "%s" to file "%s"', line, f.name)
 
     # Ensure buffers are flushed so that objcopy doesn't read an empty
     # file
@@ -158,17 +335,11 @@ def attachBitcodePathToObject(bcPath, outFileName):
         objcopyCmd = [objcopyBin, '--add-section', f'{elfSectionName}={f.name}', outFileName]
     orc = 0
 
-    # loicg: If the environment variable WLLVM_BC_STORE is set, copy the bitcode
-    # file to that location, using a hash of the original bitcode path as a name
-    storeEnv = os.getenv('WLLVM_BC_STORE')
-    if storeEnv:
-        hashName = getHashedPathName(absBcPath)
-        copyfile(absBcPath, os.path.join(storeEnv, hashName))
-
     try:
         if os.path.getsize(outFileName) > 0:
-            objProc = Popen(objcopyCmd)
-            orc = objProc.wait()
+            with jobSlot():
+                objProc = Popen(objcopyCmd)
+                orc = waitProcess(objProc)
     except OSError:
         # configure loves to immediately delete things, causing issues for
         # us here.  Just ignore it
@@ -208,9 +379,16 @@ class BuilderBase:
             forbidden = self.af.forbiddenArgs
             if forbidden:
                 for baddy in forbidden:
-                    self.cmd.remove(baddy)
+                    # unless it came out of a response file
+                    if baddy in self.cmd:
+                        self.cmd.remove(baddy)
         return self.cmd
 
+    def getBitcodeArgs(self, compileArgs):
+        """ The compileArgs that carry over into the bitcode compile, under the WLLVM_BITCODE_PROFILE.
+        """
+        return filterBitcodeArgs(compileArgs, getBitcodeProfile())
+
 
 class ClangBuilder(BuilderBase):
 
@@ -222,9 +400,15 @@ class ClangBuilder(BuilderBase):
             return bitcodeFLAGS.split()
         return []
 
+    def getBitcodeProfileFlags(self):
+        # flang does not take -Xclang
+        if self.mode != 'wfortran' and getBitcodeProfile() == 'fast':
+            return ['-Xclang', '-disable-llvm-passes']
+        return []
+
     def getBitcodeCompiler(self):
         cc = self.getCompiler()
-        return cc + ['-emit-llvm'] + self.getBitcodeGenerationFlags()
+        return cc + ['-emit-llvm'] + self.getBitcodeProfileFlags() + self.getBitcodeGenerationFlags()
 
     def getCompiler(self):
         if self.mode == "wllvm++":
@@ -239,6 +423,7 @@ class ClangBuilder(BuilderBase):
 
     def getBitcodeArglistFilter(self):
         if self.af is None:
+            from .arglistfilter import ClangBitcodeArgumentListFilter
             self.af = ClangBitcodeArgumentListFilter(self.cmd)
         return self.af
 
@@ -270,6 +455,7 @@ class DragoneggBuilder(BuilderBase):
 
     def getBitcodeArglistFilter(self):
         if self.af is None:
+            from .arglistfilter import ArgumentListFilter
             self.af = ArgumentListFilter(self.cmd)
         return self.af
 
@@ -297,22 +483,22 @@ def getBuilder(cmd, mode):
 def buildObject(builder):
     objCompiler = builder.getCompiler()
     objCompiler.extend(builder.getCommand())
-    proc = Popen(objCompiler)
-    rc = proc.wait()
+    with metricsPhase('compile'):
+        proc = Popen(objCompiler)
+        rc = waitProcess(proc)
     _logger.debug('buildObject rc = %d', rc)
     return rc
 
 
-# This command does not have the executable with it
-def buildAndAttachBitcode(builder, af):
-
-    #iam: when we have multiple input files we'll have to keep track of their object files.
-    newObjectFiles = []
+# iam: returns the list of (srcFile, objFile, bcFile, attachSource) tuples that
+# phase two will have to deal with; the names depend on whether we are in the
+# compile only case or not. attachSource is set when the srcFile is itself bitcode
+# and gets attached as is, rather than compiled.
+def getBitcodeTargets(af):
 
     hidden = not af.isCompileOnly
 
     if  len(af.inputFiles) == 1 and af.isCompileOnly:
-        _logger.debug('Compile only case: %s', af.inputFiles[0])
         # iam:
         # we could have
         # "... -c -o foo.o" or even "... -c -o foo.So" which is OK, but we could also have
@@ -324,32 +510,287 @@ def buildAndAttachBitcode(builder, af):
         if af.outputFilename is not None:
             objFile = af.outputFilename
             bcFile = af.getBitcodeFileName()
-        buildBitcodeFile(builder, srcFile, bcFile)
-        attachBitcodePathToObject(bcFile, objFile)
+        return [(srcFile, objFile, bcFile, False)]
 
-    else:
+    targets = []
+    for srcFile in af.inputFiles:
+        (objFile, bcFile) = af.getArtifactNames(srcFile, hidden)
+        targets.append((srcFile, objFile, bcFile, srcFile.endswith('.bc')))
+    return targets
+
+
+def startBitcodeFiles(builder, af):
+    """ Starts the bitcode compiles in the background, one per source file.
+
+    Returns a map from the source file to the future of its bitcode compile,
+    which buildAndAttachBitcode waits on instead of compiling it itself.
+    The dependency file flags are dropped, since the real compile is writing
+    the very same .d file at the same time.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    targets = [(srcFile, bcFile) for (srcFile, _, bcFile, attachSource) in getBitcodeTargets(af) if not attachSource]
+    if not targets:
+        return None
+
+    compileArgs = af.getCompileArgsWithoutDependencies()
+    executor = ThreadPoolExecutor(max_workers=min(len(targets), getJobCount()))
+    pending = {}
+    for (srcFile, bcFile) in targets:
+        _logger.debug('starting bitcode compile of %s to %s', srcFile, bcFile)
+        pending[srcFile] = executor.submit(buildBitcodeFile, builder, srcFile, bcFile, compileArgs)
+    executor.shutdown(wait=False)
+    return pending
+
+
+def abandonBitcodeFiles(pending):
+    """ Waits for the bitcode compiles we no longer care about, ignoring their outcome.
+    """
+    if not pending:
+        return
+    for future in pending.values():
+        try:
+            future.result()
+        except BaseException:
+            pass
+
+
+def runInParallel(task, argList):
+    """ Applies task to each tuple in argList on a bounded pool of threads.
+
+    The results are returned in the order of argList. The first failure
+    cancels everything that has not started yet; once the running tasks have
+    finished, the failure (an exception or the SystemExit of a failed
+    compile) is re-raised, the earliest one in argList order if there are several.
+    """
+    jobs = min(getJobCount(), len(argList))
+    if jobs <= 1:
+        return [task(*args) for args in argList]
+
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(task, *args) for args in argList]
+        wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            future.cancel()
+
+    for future in futures:
+        if not future.cancelled() and future.exception() is not None:
+            raise future.exception()
+    return [future.result() for future in futures]
+
+
+# This command does not have the executable with it
+def buildAndAttachBitcode(builder, af, pending=None, bitcodeMode='attach'):
 
-        for srcFile in af.inputFiles:
+    hidden = not af.isCompileOnly
+
+    if pending is None:
+        pending = {}
+
+    queue = None
+    if bitcodeMode == 'deferred':
+        from .bcqueue import getBitcodeQueue
+        queue = getBitcodeQueue()
+
+    # the object, bitcode and attach steps for one source file
+    def pipeline(srcFile, objFile, bcFile, attachSource):
+        if  len(af.inputFiles) == 1 and af.isCompileOnly:
+            _logger.debug('Compile only case: %s', srcFile)
+        else:
             _logger.debug('Not compile only case: %s', srcFile)
-            (objFile, bcFile) = af.getArtifactNames(srcFile, hidden)
             if hidden:
                 buildObjectFile(builder, srcFile, objFile)
-                newObjectFiles.append(objFile)
 
-            if srcFile.endswith('.bc'):
-                _logger.debug('attaching %s to %s', srcFile, objFile)
+        if attachSource:
+            _logger.debug('attaching %s to %s', srcFile, objFile)
+            with metricsPhase('attach'):
                 attachBitcodePathToObject(srcFile, objFile)
+        else:
+            _logger.debug('building and attaching %s to %s', bcFile, objFile)
+            if bitcodeMode == 'lazy':
+                with metricsPhase('attach'):
+                    attachRecipeToObject(getBitcodeRecipe(builder, af, srcFile), objFile)
+                return
+            if queue is not None:
+                with metricsPhase('queue'):
+                    queued = queueBitcodeFile(queue, builder, srcFile, bcFile)
+                if queued:
+                    with metricsPhase('attach'):
+                        attachBitcodePathToObject(bcFile, objFile, store=False)
+                    return
+            if srcFile in pending:
+                # re-raises the SystemExit of a failed bitcode compile; the compile
+                # itself is already timed as bitcode, this is what it held us up
+                with metricsPhase('bitcode-wait'):
+                    pending[srcFile].result()
             else:
-                _logger.debug('building and attaching %s to %s', bcFile, objFile)
                 buildBitcodeFile(builder, srcFile, bcFile)
+            with metricsPhase('attach'):
                 attachBitcodePathToObject(bcFile, objFile)
 
+    targets = getBitcodeTargets(af)
+    runInParallel(pipeline, targets)
 
     if not af.isCompileOnly:
+        #iam: when we have multiple input files we'll have to keep track of their object files.
+        newObjectFiles = [objFile for (_, objFile, _, _) in targets]
         linkFiles(builder, newObjectFiles)
 
     sys.exit(0)
 
+def compileAndLink(builder, af, bitcodeMode='attach', concurrent=False):
+    """ Builds a program, or library, from sources: the compile and link case.
+
+    Each source is compiled to a hidden object, which gets its bitcode,
+    and the objects are linked, once. The command as given is never run,
+    since the link would only overwrite what it built. So this is not for
+    commands that write dependency files: the compiler names those after
+    the output of the command as given, which the hidden compiles would
+    not reproduce. Like buildAndAttachBitcode, this exits with the status
+    of the build.
+    """
+    pending = startBitcodeFiles(builder, af) if concurrent else None
+    buildAndAttachBitcode(builder, af, pending, bitcodeMode)
+
+
+def getBitcodeRecipe(builder, af, srcFile):
+    """ How to build the bitcode for srcFile, as the lazy mode records it.
+    """
+    from .recipe import makeRecipe
+    bcc = builder.getBitcodeCompiler()
+    bcc.extend(builder.getBitcodeArgs(af.getCompileArgsWithoutDependencies()))
+    return makeRecipe(bcc, srcFile)
+
+
+def queueBitcodeFile(queue, builder, srcFile, bcFile):
+    """ Leaves the bitcode compile in the deferred queue, returning whether that worked.
+    """
+    try:
+        queue.push(builder, srcFile, bcFile)
+        return True
+    except OSError as e:
+        _logger.warning('Could not queue the bitcode compile of %s, so building it now: %s', srcFile, str(e))
+        return False
+
+
+def getBitcodeMode():
+    """ The WLLVM_BITCODE_MODE in force, attach unless told otherwise.
+    """
+    mode = os.getenv(bitcodeModeEnv) or 'attach'
+    if mode not in bitcodeModes:
+        _logger.warning('Ignoring %s = "%s"; it should be one of %s', bitcodeModeEnv, mode, ', '.join(bitcodeModes))
+        return 'attach'
+    return mode
+
+
+def getBitcodeProfile():
+    """ The WLLVM_BITCODE_PROFILE in force, full unless told otherwise.
+    """
+    profile = os.getenv(bitcodeProfileEnv) or 'full'
+    if profile not in bitcodeProfiles:
+        _logger.warning('Ignoring %s = "%s"; it should be one of %s', bitcodeProfileEnv, profile, ', '.join(bitcodeProfiles))
+        return 'full'
+    return profile
+
+
+def isDebugInfoArg(arg):
+    return arg.startswith('-g') and arg != '-gcc-toolchain'
+
+
+def isInstrumentationArg(arg):
+    return arg.startswith(_sanitizerPrefixes) or arg.startswith(_profilingPrefixes) or arg in _profilingFlags
+
+
+def filterBitcodeArgs(compileArgs, profile):
+    """ The compileArgs that the bitcode compile gets under profile.
+
+    The optimisation level always carries over: it changes what the
+    preprocessor defines (__OPTIMIZE__), so the fast profile has clang
+    skip the passes instead (see ClangBuilder.getBitcodeProfileFlags).
+    """
+    if profile == 'full':
+        return compileArgs
+    args = []
+    handOn = False
+    for arg in compileArgs:
+        if handOn:
+            handOn = False
+        elif arg in _passThroughFlags:
+            handOn = True
+        elif isDebugInfoArg(arg) or (profile == 'fast' and isInstrumentationArg(arg)):
+            continue
+        args.append(arg)
+    return args
+
+
+def canEmbedBitcode(builder):
+    """ Whether the embed mode works for builder, warning when it does not.
+    """
+    if not isinstance(builder, ClangBuilder) or sys.platform.startswith('darwin'):
+        _logger.warning('%s=embed needs clang on ELF; attaching the bitcode instead', bitcodeModeEnv)
+        return False
+    return True
+
+
+def markEmbeddedBitcode(objFile):
+    """ Lets the embedded bitcode of objFile through the link.
+
+    clang marks the section SHF_EXCLUDE, which has the linker drop it; we
+    want the linker to concatenate them, as it does our own section.
+    """
+    from .elf import clearSectionFlags, SHF_EXCLUDE
+    try:
+        if clearSectionFlags(objFile, embeddedSectionName, SHF_EXCLUDE):
+            return
+    except OSError:
+        pass
+    _logger.warning('No %s section in "%s" to keep', embeddedSectionName, objFile)
+
+
+def buildEmbeddedBitcode(builder, af):
+    """ Builds the objects with their bitcode in them, so there is no bitcode compile at all.
+
+    Just as when attaching, the compile and link case builds hidden
+    objects, and links them, in place of the command as given (after
+    it, if the command writes dependency files; see compileAndLink).
+    """
+    targets = getBitcodeTargets(af)
+
+    def buildAndLink():
+        def pipeline(srcFile, objFile, _bcFile, _attachSource):
+            buildObjectFile(builder, srcFile, objFile, embedBitcodeFlags)
+            with metricsPhase('attach'):
+                markEmbeddedBitcode(objFile)
+
+        runInParallel(pipeline, targets)
+        linkFiles(builder, [objFile for (_, objFile, _, _) in targets])
+        return 0
+
+    if not af.isCompileOnly and not af.hasDependencyArgs():
+        return buildAndLink()
+
+    legible_argstring = ' '.join(builder.cmd)
+    cc = builder.getCompiler()
+    if af.isCompileOnly:
+        cc.extend(embedBitcodeFlags)
+    cc.extend(builder.getCommand())
+    with jobSlot(), metricsPhase('compile'):
+        proc = Popen(cc)
+        rc = waitProcess(proc)
+    if rc != 0:
+        _logger.error('Failed to compile using given arguments: [%s]', legible_argstring)
+        return rc
+    if not af.isCompileOnly:
+        return buildAndLink()
+
+    with metricsPhase('attach'):
+        for (_, objFile, _, _) in targets:
+            markEmbeddedBitcode(objFile)
+    return 0
+
+
 def linkFiles(builder, objectFiles):
     af = builder.getBitcodeArglistFilter()
     outputFile = af.getOutputFilename()
@@ -358,35 +799,135 @@ def linkFiles(builder, objectFiles):
     cc.extend(af.objectFiles)
     cc.extend(af.linkArgs)
     cc.extend(['-o', outputFile])
-    proc = Popen(cc)
-    rc = proc.wait()
+    with jobSlot(), metricsPhase('link'), responseFileCommand(cc) as cmd:
+        proc = Popen(cmd)
+        rc = waitProcess(proc)
     if rc != 0:
         _logger.warning('Failed to link "%s"', str(cc))
         sys.exit(rc)
 
 
-def buildBitcodeFile(builder, srcFile, bcFile):
+def buildBitcodeFile(builder, srcFile, bcFile, compileArgs=None, preprocessedFrom=None):
+    """ Compiles srcFile to bcFile; preprocessedFrom is the source srcFile is the preprocessed output of, if it is.
+    """
+    with metricsPhase('bitcode'):
+        _buildBitcodeFile(builder, srcFile, bcFile, compileArgs, preprocessedFrom)
+
+
+def _buildBitcodeFile(builder, srcFile, bcFile, compileArgs, preprocessedFrom):
     af = builder.getBitcodeArglistFilter()
+    if compileArgs is None:
+        compileArgs = af.compileArgs
     bcc = builder.getBitcodeCompiler()
-    bcc.extend(af.compileArgs)
+    bcc.extend(builder.getBitcodeArgs(compileArgs))
+
+    # with WLLVM_BC_CACHE set we may not need to compile at all
+    from .bccache import getBitcodeCache
+    cache = getBitcodeCache()
+    if cache is None:
+        key = None
+    elif preprocessedFrom is not None:
+        key = cache.getPreprocessedKey(bcc, srcFile, preprocessedFrom)
+    else:
+        key = cache.getKey(builder, bcc, af.getCompileArgsWithoutDependencies(), srcFile)
+    if key and cache.fetch(key, bcFile):
+        noteBitcodeFile(bcFile)
+        return
+
     bcc.extend(['-c', srcFile])
     bcc.extend(['-o', bcFile])
     _logger.debug('buildBitcodeFile: %s', bcc)
-    proc = Popen(bcc)
-    rc = proc.wait()
+    with jobSlot(), responseFileCommand(bcc) as cmd:
+        proc = Popen(cmd)
+        rc = waitProcess(proc)
     if rc != 0:
         _logger.warning('Failed to generate bitcode "%s" for "%s"', bcFile, srcFile)
         sys.exit(rc)
+    noteBitcodeFile(bcFile)
+
+    if key:
+        cache.insert(key, bcFile)
+
+def buildFromPreprocessed(builder, af, ppSuffix):
+    """ Preprocesses the source once, then compiles the object and the bitcode from that (see preprocess.py).
+
+    If the object does not build from the preprocessed source, we do the
+    plain compile after all.
+    """
+    import tempfile
+    from .preprocess import compilePreprocessed, getPreprocessCommands, preprocess, withoutPreprocessorArgs
+
+    (srcFile, objFile, bcFile, _) = getBitcodeTargets(af)[0]
+    (fd, ppFile) = tempfile.mkstemp(suffix=ppSuffix, prefix='.wllvm-')
+    os.close(fd)
+    (ppCmd, objCmd) = getPreprocessCommands(builder, af, objFile, ppFile)
+    bcArgs = withoutPreprocessorArgs(af.getCompileArgsWithoutDependencies())
+
+    try:
+        pending = None
+        built = False
+        with jobSlot():
+            rc = preprocess(ppCmd)
+            if rc == 0:
+                if os.getenv(concurrentBitcodeEnv):
+                    pending = startPreprocessedBitcodeFile(builder, srcFile, ppFile, bcFile, bcArgs)
+                built = compilePreprocessed(objCmd) == 0
+
+        if rc != 0:
+            _logger.error('Failed to compile using given arguments: [%s]', ' '.join(builder.cmd))
+            return rc
+
+        if not built:
+            abandonBitcodeFiles(pending)
+            _logger.info('Falling back on the plain compile of %s', srcFile)
+            return wcompileWithoutPreprocessing(builder, af)
+
+        if pending:
+            # re-raises the SystemExit of a failed bitcode compile
+            pending[srcFile].result()
+        else:
+            buildBitcodeFile(builder, ppFile, bcFile, bcArgs, srcFile)
+        attachBitcodePathToObject(bcFile, objFile)
+        return 0
+    finally:
+        os.remove(ppFile)
+
+
+def startPreprocessedBitcodeFile(builder, srcFile, ppFile, bcFile, bcArgs):
+    """ Starts the bitcode compile of the preprocessed source in the background, as startBitcodeFiles does.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = {srcFile: executor.submit(buildBitcodeFile, builder, ppFile, bcFile, bcArgs, srcFile)}
+    executor.shutdown(wait=False)
+    return pending
+
+
+def wcompileWithoutPreprocessing(builder, af):
+    """ The plain compile, and bitcode, for when compiling preprocessed source did not work out.
+    """
+    with jobSlot():
+        rc = buildObject(builder)
+    if rc != 0:
+        _logger.error('Failed to compile using given arguments: [%s]', ' '.join(builder.cmd))
+        return rc
+    buildAndAttachBitcode(builder, af)
+    return 0
+
 
-def buildObjectFile(builder, srcFile, objFile):
+def buildObjectFile(builder, srcFile, objFile, flags=None):
     af = builder.getBitcodeArglistFilter()
     cc = builder.getCompiler()
-    cc.extend(af.compileArgs)
+    cc.extend(flags or [])
+    # any dependency file is the business of the command as given
+    cc.extend(af.getCompileArgsWithoutDependencies())
     cc.append(srcFile)
     cc.extend(['-c', '-o', objFile])
     _logger.debug('buildObjectFile: %s', cc)
-    proc = Popen(cc)
-    rc = proc.wait()
+    with jobSlot(), metricsPhase('object'), responseFileCommand(cc) as cmd:
+        proc = Popen(cmd)
+        rc = waitProcess(proc)
     if rc != 0:
         _logger.warning('Failed to generate object "%s" for "%s"', objFile, srcFile)
         sys.exit(rc)
@@ -408,8 +949,9 @@ def buildObjectFile(builder, srcFile, objFile):
 # case 2 (compile and link)
 #
 #  af.inputFiles is not empty, and compileOnly is false.
-#  in this case the .o's may not exist, we must regenerate
-#  them in any case.
+#  in this case the .o's do not exist, so rather than run the
+#  command as given we compile each input to a hidden .o, attach
+#  its bitcode, and link those (see compileAndLink).
 #
 #
 # case 3 (link only)
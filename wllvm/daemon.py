@@ -0,0 +1,334 @@
+"""
+An optional compile server for wllvm, wllvm++ and wfortran.
+
+Every wllvm invocation pays for starting Python, importing the wllvm
+modules and compiling the argument tables' regular expressions. Over a
+build of tens of thousands of translation units that adds up. The
+wllvm-daemon keeps all of that warm behind a Unix socket:
+
+    wllvm-daemon --socket /tmp/wllvm.sock &
+    export WLLVM_DAEMON_SOCKET=/tmp/wllvm.sock
+
+With WLLVM_DAEMON_SOCKET set, the wrappers become thin clients: they
+hand their argv, cwd, environment, umask and file descriptors (stdin,
+stdout, stderr and the make jobserver pipe) to the daemon, and wait for
+the exit status. The daemon forks a child per request, which takes on
+the client's identity and runs the usual wcompile, so requests cannot
+interfere with each other or with the daemon. If the daemon cannot be
+reached the client just compiles in process, as if it were not there.
+
+Every invocation imports this module, so it keeps its own imports down
+to the bare minimum; even the socket module waits for the clients that
+have a daemon to talk to.
+"""
+
+import os
+import sys
+import struct
+# a forked child leaves by _exit, so it does not run the daemon's clean up
+from os import _exit
+
+# The rest waits for the daemon, its clients, or its children, to need it.
+# pylint: disable=import-outside-toplevel
+
+daemonSocketEnv = 'WLLVM_DAEMON_SOCKET'
+
+# requests are a length prefixed json object, the reply is the exit status.
+_header = struct.Struct('!I')
+_status = struct.Struct('!i')
+
+# stdin, stdout, stderr, and both ends of a jobserver pipe.
+_maxFds = 5
+
+# What compilers leaves until it is needed, which the children always will.
+_warmModules = ('concurrent.futures', 'pprint', 'subprocess', 'tempfile', '.arglistfilter', '.bccache',
+                '.bcstore', '.compilers', '.elf', '.filetype', '.preprocess')
+
+
+def getJobServerFds(makeflags):
+    """ Returns the jobserver pipe descriptors that MAKEFLAGS names, if any.
+
+    A named fifo needs no passing on: the daemon's child opens it by name.
+    """
+    if '--jobserver-' not in (makeflags or ''):
+        return []
+    from .jobserver import getJobServerAuth
+    auth = getJobServerAuth(makeflags)
+    if auth is None or auth.startswith('fifo:'):
+        return []
+    try:
+        fds = [int(fd) for fd in auth.split(',')]
+    except ValueError:
+        return []
+    return [fd for fd in fds if fd > 2]
+
+
+def _isOpen(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def _recvExactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def forwardToDaemon(mode):
+    """ Has the daemon do this invocation, if there is one.
+
+    Returns the exit status, or None if we should compile in process.
+    """
+    path = os.getenv(daemonSocketEnv)
+    if not path:
+        return None
+    import json
+    import array
+    import socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+
+    with conn:
+        fds = [fd for fd in [0, 1, 2] + getJobServerFds(os.getenv('MAKEFLAGS')) if _isOpen(fd)]
+        umask = os.umask(0)
+        os.umask(umask)
+        request = json.dumps({
+            'mode': mode,
+            'argv': sys.argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'umask': umask,
+            'ppid': os.getppid(),
+            'fds': fds,
+        }).encode()
+        message = _header.pack(len(request)) + request
+        try:
+            sent = conn.sendmsg([message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+            conn.sendall(message[sent:])
+        except OSError:
+            # the daemon went away before it saw anything
+            return None
+        sys.stdout.flush()
+        reply = _recvExactly(conn, _status.size)
+
+    if reply is None:
+        sys.stderr.write(f'{mode}: lost the connection to the daemon at {path}\n')
+        return 1
+    return _status.unpack(reply)[0]
+
+
+def _exitStatus(e):
+    """ The exit status that SystemExit e would have given the process.
+    """
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    sys.stderr.write(f'{e.code}\n')
+    return 1
+
+
+def _placeFds(received, numbers):
+    """ Puts the client's descriptors at the numbers they had in the client.
+    """
+    import fcntl
+    # out of the way first, so a dup2 never clobbers one we still need
+    high = [fcntl.fcntl(fd, fcntl.F_DUPFD, 64) for fd in received]
+    for fd in received:
+        os.close(fd)
+    for (fd, number) in zip(high, numbers):
+        os.dup2(fd, number)
+        os.close(fd)
+
+
+def _hangUpWatcher(conn, replied):
+    """ Takes down the compile if the client goes away, e.g. on ^C, before it has its reply.
+    """
+    import signal
+    try:
+        conn.recv(1)
+    except OSError:
+        pass
+    if not replied.is_set():
+        os.killpg(0, signal.SIGTERM)
+
+
+def _receiveRequest(conn):
+    """ The client's request, and the descriptors that came with it.
+    """
+    import json
+    import array
+    import socket
+
+    (header, ancdata, _, _) = conn.recvmsg(_header.size, socket.CMSG_SPACE(_maxFds * array.array('i').itemsize))
+    received = array.array('i')
+    for (level, kind, data) in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            received.frombytes(data[:len(data) - (len(data) % received.itemsize)])
+    if len(header) < _header.size:
+        header += _recvExactly(conn, _header.size - len(header)) or b''
+    return (json.loads(_recvExactly(conn, _header.unpack(header)[0])), list(received))
+
+
+def _handleRequest(conn):
+    """ Runs in the forked child: becomes the client and compiles.
+    """
+    import fcntl
+    import signal
+    import socket
+    import threading
+    import traceback
+
+    # subprocess needs to reap its own children
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.setpgid(0, 0)
+
+    (request, received) = _receiveRequest(conn)
+    # keep the connection clear of the descriptors we are about to place
+    fd = conn.detach()
+    conn = socket.socket(fileno=fcntl.fcntl(fd, fcntl.F_DUPFD, 64))
+    os.close(fd)
+    _placeFds(received, request['fds'])
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    os.umask(request['umask'])
+    sys.argv = request['argv']
+
+    from .logconfig import flushLogging, resetLogging
+    from .compilers import wcompile
+    resetLogging()
+
+    replied = threading.Event()
+    threading.Thread(target=_hangUpWatcher, args=(conn, replied), daemon=True).start()
+    try:
+        rc = wcompile(request['mode'], request['ppid'])
+    except SystemExit as e:
+        rc = _exitStatus(e)
+    except BaseException:
+        traceback.print_exc()
+        rc = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    flushLogging()
+    # the client hangs up as soon as it has the reply, which is no reason to kill us
+    replied.set()
+    conn.sendall(_status.pack(rc or 0))
+
+
+def _warmUp():
+    """ Does the work every invocation would otherwise repeat.
+
+    That is importing _warmModules, which builds the default argument
+    table, and building the one the clang builder adds its -o to, which
+    is otherwise built on first use.
+    """
+    import importlib
+    for name in _warmModules:
+        importlib.import_module(name, __package__)
+    from .arglistfilter import ClangBitcodeArgumentListFilter
+    ClangBitcodeArgumentListFilter(['-c', 'warmup.c', '-o', 'warmup.o'])
+
+
+def serve(path, idleTimeout=None):
+    """ Accepts requests on the socket at path until killed, or idle for idleTimeout seconds.
+    """
+    import signal
+    import socket
+    from .logconfig import logConfig
+    logger = logConfig(__name__)
+
+    _warmUp()
+
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            logger.error('There is already a daemon listening on %s', path)
+            return 1
+        except OSError:
+            os.remove(path)
+        finally:
+            probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only our own user gets to run compiles as us
+    umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(socket.SOMAXCONN)
+    listener.settimeout(idleTimeout)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    # children are never waited for, so let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, terminate)
+    logger.info('Listening on %s', path)
+    try:
+        while True:
+            try:
+                (conn, _) = listener.accept()
+            except socket.timeout:
+                logger.info('Idle for %s seconds, exiting', idleTimeout)
+                return 0
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                rc = 1
+                try:
+                    listener.close()
+                    _handleRequest(conn)
+                    rc = 0
+                finally:
+                    # _exit leaves the log records the child is holding unwritten
+                    from .logconfig import flushLogging
+                    flushLogging()
+                    _exit(rc)
+            conn.close()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        listener.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def main():
+    """ The entry point to wllvm-daemon.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Serves wllvm, wllvm++ and wfortran invocations from a warm process.')
+    parser.add_argument('--socket', '-s', default=os.getenv(daemonSocketEnv),
+                        help=f'The Unix socket to listen on (defaults to ${daemonSocketEnv}).')
+    parser.add_argument('--idle-timeout', '-t', dest='idleTimeout', type=float, default=None,
+                        help='Exit after this many seconds without a request.')
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error(f'either pass --socket or set {daemonSocketEnv}')
+    # the children log wherever their clients ask; a log file opened here
+    # could sit on a descriptor number that a client needs.
+    os.environ.pop('WLLVM_OUTPUT_FILE', None)
+    return serve(os.path.abspath(args.socket), args.idleTimeout)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+Just enough ELF to add our section to a relocatable object without binutils.
+
+objcopy --add-section rewrites the whole object, needs a temporary file
+with the new contents, and, when cross-compiling, an objcopy that knows
+about the target. Adding a section only needs a few appends: the contents,
+a grown copy of the section name table, and a grown copy of the section
+header table, followed by patching the ELF header to point at the latter.
+The stale copies left behind in the middle of the file are harmless.
+
+Anything out of the ordinary (not relocatable, extended section numbering,
+...) is left to objcopy.
+
+The embedded bitcode mode also needs to flip a section flag in place,
+which comes down to rewriting one section header.
+
+extract-bc, for its part, only needs to find our sections in an object,
+library or executable, of any class and byte order: getSections reads the
+section header table straight out of the file, mapped into memory.
+"""
+
+import contextlib
+import mmap
+import struct
+
+from .logconfig import logConfig
+
+# Internal logger
+_logger = logConfig(__name__)
+
+ELFMAG = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+
+PT_DYNAMIC = 2
+
+DT_NULL = 0
+DT_FLAGS_1 = 0x6ffffffb
+DF_1_PIE = 0x08000000
+
+SHT_PROGBITS = 1
+SHT_NOBITS = 8
+
+SHF_EXCLUDE = 0x80000000
+
+SHN_LORESERVE = 0xff00
+SHN_XINDEX = 0xffff
+
+# Offsets into e_ident.
+EI_CLASS = 4
+EI_DATA = 5
+EI_NIDENT = 16
+
+
+class ElfLayout:
+    """ The struct formats of the ELF header and section headers for one class and byte order.
+    """
+    # e_type ... e_shstrndx, after e_ident
+    _ehdr = {ELFCLASS32: 'HHIIIIIHHHHHH', ELFCLASS64: 'HHIQQQIHHHHHH'}
+    # sh_name ... sh_entsize
+    _shdr = {ELFCLASS32: 'IIIIIIIIII', ELFCLASS64: 'IIQQQQIIQQ'}
+    # p_type, p_offset, p_filesz and a few we do not care about; the fields
+    # are in a different order in the two classes.
+    _phdr = {ELFCLASS32: ('IIIIIIII', 1, 4), ELFCLASS64: ('IIQQQQQQ', 2, 5)}
+    # d_tag, d_val
+    _dyn = {ELFCLASS32: 'iI', ELFCLASS64: 'qQ'}
+
+    def __init__(self, elfClass, elfData):
+        order = '<' if elfData == ELFDATA2LSB else '>'
+        self.ehdr = struct.Struct(order + self._ehdr[elfClass])
+        self.shdr = struct.Struct(order + self._shdr[elfClass])
+        (phdr, self.pOffset, self.pFilesz) = self._phdr[elfClass]
+        self.phdr = struct.Struct(order + phdr)
+        self.dyn = struct.Struct(order + self._dyn[elfClass])
+        self.alignment = 8 if elfClass == ELFCLASS64 else 4
+
+    @classmethod
+    def fromIdent(cls, ident):
+        """ Returns the layout for the given e_ident, or None if it is not ELF we understand.
+        """
+        if len(ident) < EI_NIDENT or ident[:4] != ELFMAG:
+            return None
+        if ident[EI_CLASS] not in (ELFCLASS32, ELFCLASS64) or ident[EI_DATA] not in (ELFDATA2LSB, ELFDATA2MSB):
+            return None
+        return cls(ident[EI_CLASS], ident[EI_DATA])
+
+
+# Indices into the unpacked ELF header (after e_ident) and section headers.
+E_TYPE, E_PHOFF, E_SHOFF, E_PHENTSIZE, E_PHNUM, E_SHENTSIZE, E_SHNUM, E_SHSTRNDX = 0, 4, 5, 8, 9, 10, 11, 12
+SH_NAME, SH_TYPE, SH_FLAGS, SH_OFFSET, SH_SIZE, SH_LINK = 0, 1, 2, 4, 5, 6
+
+
+def sectionName(strtab, offset):
+    """ Returns the NUL terminated name at offset in the string table.
+    """
+    end = strtab.find(b'\0', offset)
+    return bytes(strtab[offset:end if end >= 0 else len(strtab)]).decode('utf-8', 'replace')
+
+
+@contextlib.contextmanager
+def mappedFile(path):
+    """ The contents of the file at path, mapped read only into memory, or read if it cannot be mapped.
+    """
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # empty files, and the odd file system, cannot be mapped
+            data = None
+        if data is None:
+            yield f.read()
+            return
+        try:
+            yield data
+        finally:
+            data.close()
+
+
+def getSections(data):
+    """ Returns a map from the section names of the ELF file in data to their sizes and offsets, both in bytes.
+
+    data is the whole file, as bytes, an mmap, or a memoryview of an
+    archive member, say. Returns None if it is not ELF we can read. Where
+    names repeat, the first section wins, as it does in extract-bc's
+    reading of objdump -h.
+    """
+    layout = ElfLayout.fromIdent(bytes(data[:EI_NIDENT]))
+    if layout is None or len(data) < EI_NIDENT + layout.ehdr.size:
+        return None
+    ehdr = layout.ehdr.unpack_from(data, EI_NIDENT)
+    (shoff, shnum, shstrndx) = (ehdr[E_SHOFF], ehdr[E_SHNUM], ehdr[E_SHSTRNDX])
+    if shoff == 0:
+        return {}
+    size = layout.shdr.size
+    if ehdr[E_SHENTSIZE] != size or shoff + size > len(data):
+        return None
+    # with more sections than the ELF header has room for, the first section header holds the counts
+    first = layout.shdr.unpack_from(data, shoff)
+    if shnum == 0:
+        shnum = first[SH_SIZE]
+    if shstrndx == SHN_XINDEX:
+        shstrndx = first[SH_LINK]
+    if shoff + shnum * size > len(data) or shstrndx >= shnum:
+        return None
+    strhdr = layout.shdr.unpack_from(data, shoff + shstrndx * size)
+    if strhdr[SH_OFFSET] + strhdr[SH_SIZE] > len(data):
+        return None
+    strtab = bytes(data[strhdr[SH_OFFSET]:strhdr[SH_OFFSET] + strhdr[SH_SIZE]])
+
+    sections = {}
+    for index in range(1, shnum):
+        hdr = layout.shdr.unpack_from(data, shoff + index * size)
+        name = sectionName(strtab, hdr[SH_NAME])
+        if name and name not in sections:
+            sections[name] = (hdr[SH_SIZE], hdr[SH_OFFSET])
+    return sections
+
+
+def getElfType(f):
+    """ Returns the e_type of the ELF file open (in binary mode) as f, or None if it is not ELF.
+
+    Position independent executables are ET_DYN, like shared objects, but
+    report as ET_EXEC, going by the DF_1_PIE flag just as file(1) does.
+    """
+    f.seek(0)
+    layout = ElfLayout.fromIdent(f.read(EI_NIDENT))
+    header = f.read(layout.ehdr.size) if layout else b''
+    if layout is None or len(header) != layout.ehdr.size:
+        return None
+    ehdr = layout.ehdr.unpack(header)
+    if ehdr[E_TYPE] != ET_DYN or ehdr[E_PHENTSIZE] != layout.phdr.size:
+        return ehdr[E_TYPE]
+
+    f.seek(ehdr[E_PHOFF])
+    table = f.read(ehdr[E_PHNUM] * layout.phdr.size)
+    for phdr in layout.phdr.iter_unpack(table[:len(table) - len(table) % layout.phdr.size]):
+        if phdr[0] != PT_DYNAMIC:
+            continue
+        f.seek(phdr[layout.pOffset])
+        dynamic = f.read(phdr[layout.pFilesz])
+        for (tag, value) in layout.dyn.iter_unpack(dynamic[:len(dynamic) - len(dynamic) % layout.dyn.size]):
+            if tag == DT_NULL:
+                break
+            if tag == DT_FLAGS_1 and value & DF_1_PIE:
+                return ET_EXEC
+    return ET_DYN
+
+
+def readSectionTable(f, fileName):
+    """ Reads the headers of the relocatable ELF object open (for reading) as f.
+
+    Returns the layout, the ELF header, the section headers and the section
+    name table, or None if the file is not an object we know how to edit.
+    """
+    f.seek(0)
+    ident = f.read(EI_NIDENT)
+    layout = ElfLayout.fromIdent(ident)
+    if layout is None:
+        return None
+    header = f.read(layout.ehdr.size)
+    if len(header) != layout.ehdr.size:
+        return None
+    ehdr = list(layout.ehdr.unpack(header))
+    shoff, shnum, shstrndx = ehdr[E_SHOFF], ehdr[E_SHNUM], ehdr[E_SHSTRNDX]
+    if (ehdr[E_TYPE] != ET_REL or ehdr[E_SHENTSIZE] != layout.shdr.size or
+            shoff == 0 or shnum == 0 or shnum >= SHN_LORESERVE - 1 or shstrndx >= shnum):
+        _logger.debug('%s is not an ELF object we can edit in place', fileName)
+        return None
+
+    f.seek(shoff)
+    table = f.read(shnum * layout.shdr.size)
+    if len(table) != shnum * layout.shdr.size:
+        return None
+    shdrs = [list(hdr) for hdr in layout.shdr.iter_unpack(table)]
+    strhdr = shdrs[shstrndx]
+    f.seek(strhdr[SH_OFFSET])
+    strtab = f.read(strhdr[SH_SIZE])
+    if strhdr[SH_TYPE] == SHT_NOBITS or len(strtab) != strhdr[SH_SIZE]:
+        return None
+    return (layout, ehdr, shdrs, strtab)
+
+
+def clearSectionFlags(fileName, name, flags):
+    """ Clears flags on the named section of a relocatable ELF object.
+
+    Returns whether there was such a section to clear them on.
+    """
+    with open(fileName, 'r+b') as f:
+        table = readSectionTable(f, fileName)
+        if table is None:
+            return False
+        (layout, ehdr, shdrs, strtab) = table
+        for (index, hdr) in enumerate(shdrs):
+            if sectionName(strtab, hdr[SH_NAME]) != name:
+                continue
+            if hdr[SH_FLAGS] & flags:
+                hdr[SH_FLAGS] &= ~flags
+                f.seek(ehdr[E_SHOFF] + index * layout.shdr.size)
+                f.write(layout.shdr.pack(*hdr))
+            return True
+    return False
+
+
+def appendToSection(fileName, name, data):
+    """ Appends data to the named section of a relocatable ELF object, adding it if need be.
+
+    Returns False, leaving the file untouched, if the file is not an
+    object we know how to edit, so that the caller can fall back on objcopy.
+    """
+    with open(fileName, 'r+b') as f:
+        table = readSectionTable(f, fileName)
+        if table is None:
+            return False
+        (layout, ehdr, shdrs, strtab) = table
+        shoff = ehdr[E_SHOFF]
+        strhdr = shdrs[ehdr[E_SHSTRNDX]]
+
+        existing = [index for (index, hdr) in enumerate(shdrs) if sectionName(strtab, hdr[SH_NAME]) == name]
+        end = f.seek(0, 2)
+
+        if existing:
+            # Move the section to the end of the file with the data tacked on.
+            index = existing[0]
+            hdr = shdrs[index]
+            if hdr[SH_TYPE] == SHT_NOBITS:
+                return False
+            f.seek(hdr[SH_OFFSET])
+            contents = f.read(hdr[SH_SIZE]) + data
+            f.seek(end)
+            f.write(contents)
+            hdr[SH_OFFSET] = end
+            hdr[SH_SIZE] = len(contents)
+            f.seek(shoff + index * layout.shdr.size)
+            f.write(layout.shdr.pack(*hdr))
+            return True
+
+        # The contents, then the name table grown by our name, then the
+        # section header table grown by our header.
+        f.write(data)
+        strtabOffset = end + len(data)
+        newStrtab = strtab + name.encode('utf-8') + b'\0'
+        f.write(newStrtab)
+        newShoff = strtabOffset + len(newStrtab)
+        padding = -newShoff % layout.alignment
+        f.write(b'\0' * padding)
+        newShoff += padding
+
+        strhdr[SH_OFFSET] = strtabOffset
+        strhdr[SH_SIZE] = len(newStrtab)
+        # name, type, flags, addr, offset, size, link, info, addralign, entsize
+        shdrs.append([len(strtab), SHT_PROGBITS, 0, 0, end, len(data), 0, 0, 1, 0])
+        f.write(b''.join(layout.shdr.pack(*hdr) for hdr in shdrs))
+
+        # Only now point the ELF header at the new table.
+        ehdr[E_SHOFF] = newShoff
+        ehdr[E_SHNUM] = len(shdrs)
+        f.seek(EI_NIDENT)
+        f.write(layout.ehdr.pack(*ehdr))
+    return True
@@ -1,28 +1,38 @@
 from __future__ import print_function
 
+import logging
 import os
 import sys
 import subprocess as sp
 import re
-import pprint
-import tempfile
-import shutil
 import argparse
+import threading
 import codecs
 
 from .popenwrapper import Popen
 
 from .compilers import llvmCompilerPathEnv
 from .compilers import elfSectionName
+from .compilers import embeddedSectionName
 from .compilers import darwinSegmentName
 from .compilers import darwinSectionName
-from .compilers import getHashedPathName
+from .compilers import runInParallel
+from .jobserver import getJobCount
+
+from .bcstore import getStorePath, getStoredBitcode
+from .bcqueue import awaitDeferredBitcode
+from .recipe import buildRecipes, isRecipe
+from .bitcode import splitBitcode
+from .elf import getSections, mappedFile
+from .archive import readArchive
+from .metrics import metricsPhase, noteInvocation, waitProcess
 
 from .filetype import FileType
 
 from .logconfig import logConfig, informUser
 
-
+# What only some extractions need (pprint, tempfile, ...) is imported when they do.
+# pylint: disable=import-outside-toplevel
 
 _logger = logConfig(__name__)
 
@@ -37,6 +47,10 @@ def extraction():
     if not success:
         return 1
 
+    # the manifest would otherwise list bitcode that is gone once we exit
+    if pArgs.manifestFlag:
+        _scratch.keep(getKeptBitcodeDir(pArgs.inputFile))
+
     if sys.platform.startswith('freebsd') or  sys.platform.startswith('linux'):
         return process_file_unix(pArgs)
     if sys.platform.startswith('darwin'):
@@ -54,12 +68,22 @@ moduleExtension = 'bc'
 # Environmental variable for cross-compilation target.
 binutilsTargetPrefixEnv = 'BINUTILS_TARGET_PREFIX'
 
-def getSectionSizeAndOffset(sectionName, filename):
-    """Returns the size and offset of the section, both in bytes.
+def getSectionSizesAndOffsets(filename):
+    """Returns a map from section names to their sizes and offsets, both in bytes.
+
+    ELF files are read directly; objdump is left with anything else.
+    """
+    with mappedFile(filename) as data:
+        sections = getSections(data)
+    if sections is None:
+        sections = getObjdumpSectionSizesAndOffsets(filename)
+    return sections
+
+def getObjdumpSectionSizesAndOffsets(filename):
+    """Returns a map from section names to their sizes and offsets, both in bytes.
 
     Use objdump on the provided binary; parse out the fields
-    to find the given section.  Parses the output,and
-    extracts thesize and offset of that section (in bytes).
+    of each section.
     """
 
     binUtilsTargetPrefix = os.getenv(binutilsTargetPrefixEnv)
@@ -72,39 +96,46 @@ def getSectionSizeAndOffset(sectionName, filename):
         _logger.error('Could not dump %s', filename)
         sys.exit(-1)
 
+    sections = {}
     for line in [l.decode('utf-8') for l in objdumpOutput.splitlines()]:
         fields = line.split()
-        if len(fields) <= 7:
-            continue
-        if fields[1] != sectionName:
+        if len(fields) <= 7 or fields[1] in sections:
             continue
         try:
             size = int(fields[2], 16)
             offset = int(fields[5], 16)
-            return (size, offset)
+            sections[fields[1]] = (size, offset)
         except ValueError:
             continue
+    return sections
 
-    # The needed section could not be found
-    _logger.warning('Could not find "%s" ELF section in "%s", so skipping this entry.', sectionName, filename)
-    return None
+def getSectionSizeAndOffset(sectionName, filename):
+    """Returns the size and offset of the section, both in bytes."""
+    val = getSectionSizesAndOffsets(filename).get(sectionName)
+    if val is None:
+        # The needed section could not be found
+        _logger.warning('Could not find "%s" ELF section in "%s", so skipping this entry.', sectionName, filename)
+    return val
 
 def getSectionContent(size, offset, filename):
     """Reads the entire content of an ELF section into a string."""
     with open(filename, mode='rb') as f:
         f.seek(offset)
-        d = ''
-        try:
-            c = f.read(size)
-            d = c.decode('utf-8')
-        except UnicodeDecodeError:
-            _logger.error('Failed to read section containing:')
-            print(c)
-            raise
-        # The linker pads sections with null bytes; our real data
-        # cannot have null bytes because it is just text.  Discard
-        # nulls.
-        return d.replace('\0', '')
+        return decodeSectionContent(f.read(size))
+
+def decodeSectionContent(c):
+    """Decodes the bitcode paths held in the bytes of an ELF section."""
+    d = ''
+    try:
+        d = c.decode('utf-8')
+    except UnicodeDecodeError:
+        _logger.error('Failed to read section containing:')
+        print(c)
+        raise
+    # The linker pads sections with null bytes; our real data
+    # cannot have null bytes because it is just text.  Discard
+    # nulls.
+    return d.replace('\0', '')
 
 
 # otool hexdata pattern.
@@ -187,26 +218,120 @@ def extract_section_darwin(inputFile):
     return retval
 
 def extract_section_linux(inputFile):
-    """Extracts the section as a string, the *nix version."""
-    val = getSectionSizeAndOffset(elfSectionName, inputFile)
-    if val is None:
+    """Extracts the section as a string, the *nix version.
+
+    Bitcode embedded by WLLVM_BITCODE_MODE=embed is written out to
+    scratch files, whose names are returned along with the others.
+    """
+    with mappedFile(inputFile) as data:
+        sections = getSections(data)
+        if sections is None:
+            sections = getObjdumpSectionSizesAndOffsets(inputFile)
+        return extract_sections(inputFile, data, sections)
+
+def extract_sections(inputFile, data, sections):
+    """Extracts the bitcode paths from the sections of inputFile, whose contents are data."""
+    if elfSectionName not in sections and embeddedSectionName not in sections:
+        _logger.warning('Could not find "%s" ELF section in "%s", so skipping this entry.', elfSectionName, inputFile)
         return []
-    (sectionSize, sectionOffset) = val
-    content = getSectionContent(sectionSize, sectionOffset, inputFile)
-    contents = content.split('\n')
-    if not contents:
-        _logger.error('%s contained no %s. section is empty', inputFile, elfSectionName)
+    contents = []
+    if elfSectionName in sections:
+        (sectionSize, sectionOffset) = sections[elfSectionName]
+        content = decodeSectionContent(bytes(data[sectionOffset:sectionOffset + sectionSize]))
+        contents = content.split('\n')
+        if not contents:
+            _logger.error('%s contained no %s. section is empty', inputFile, elfSectionName)
+    if embeddedSectionName in sections:
+        (sectionSize, sectionOffset) = sections[embeddedSectionName]
+        contents.extend(extract_embedded_bitcode(inputFile, bytes(data[sectionOffset:sectionOffset + sectionSize])))
     return contents
 
 
-def getStorePath(bcPath):
-    storeEnv = os.getenv('WLLVM_BC_STORE')
-    if storeEnv:
-        hashName = getHashedPathName(bcPath)
-        hashPath = os.path.join(storeEnv, hashName)
-        if os.path.isfile(hashPath):
-            return hashPath
-    return None
+class ScratchDir:
+    """ Where the embedded, built or decompressed bitcode goes, made on demand.
+
+    Normally a temporary directory, removed when we exit. The bitcode a
+    manifest lists has to outlive us, so with -m it goes in a directory
+    next to the manifest instead, which is left alone (see keep). Either
+    is only made once something is to be written into it.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.made = False
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def keep(self, directory):
+        """ Has the scratch files go in directory, and stay there.
+        """
+        with self.lock:
+            self.directory = directory
+            self.made = False
+
+    def path(self):
+        with self.lock:
+            if self.directory is None:
+                import atexit
+                import shutil
+                import tempfile
+                self.directory = tempfile.mkdtemp(prefix='wllvm-embedded-')
+                atexit.register(shutil.rmtree, self.directory, True)
+            elif not self.made:
+                os.makedirs(self.directory, exist_ok=True)
+            self.made = True
+        return self.directory
+
+    def newFileName(self, name):
+        """ A scratch file name, of name and a number no other has.
+        """
+        with self.lock:
+            self.count += 1
+            count = self.count
+        return os.path.join(self.path(), f'{name}.{count}.bc')
+
+_scratch = ScratchDir()
+
+def getScratchDir():
+    return _scratch.path()
+
+def getKeptBitcodeDir(inputFile):
+    """ Where the bitcode we make goes when a manifest is written: next to it, and named after the input.
+    """
+    return f'{inputFile}.llvm.bitcode'
+
+def extract_embedded_bitcode(inputFile, data):
+    """Writes each module in data, the .llvmbc section of inputFile, to a scratch file, returning their names."""
+    try:
+        modules = splitBitcode(data)
+    except ValueError as e:
+        _logger.error('Could not make sense of the %s section of "%s": %s', embeddedSectionName, inputFile, str(e))
+        return []
+    fileNames = []
+    for module in modules:
+        fileName = _scratch.newFileName(os.path.basename(inputFile))
+        with open(fileName, 'wb') as f:
+            f.write(module)
+        fileNames.append(fileName)
+    _logger.debug('Found %d embedded modules in "%s"', len(fileNames), inputFile)
+    return fileNames
+
+
+def resolveBitcodeFiles(fileNames):
+    """Makes sure the bitcode named in the sections we extracted exists.
+
+    Bitcode from WLLVM_BITCODE_MODE=deferred may still be queued, and
+    WLLVM_BITCODE_MODE=lazy leaves recipes rather than paths, which we
+    build now, in parallel. Returns the bitcode file names, and whether
+    all of them could be had.
+    """
+    ok = True
+    if any(isRecipe(f) for f in fileNames):
+        (fileNames, ok) = buildRecipes(fileNames, getScratchDir(), getJobCount())
+    with metricsPhase('bitcode'):
+        if awaitDeferredBitcode(fileNames):
+            ok = False
+    return (fileNames, ok)
 
 
 def getBitcodePath(bcPath):
@@ -214,13 +339,13 @@ def getBitcodePath(bcPath):
 
     First, checks if the given path points to an existing bitcode file.
     If it does not, it tries to look for the bitcode file in the store directory given
-    by the environment variable WLLVM_BC_STORE.
+    by the environment variable WLLVM_BC_STORE, decompressing it if need be.
     """
 
     if not bcPath or os.path.isfile(bcPath):
         return bcPath
 
-    storePath = getStorePath(bcPath)
+    storePath = getStoredBitcode(bcPath, getScratchDir())
     if storePath:
         return storePath
     return bcPath
@@ -229,7 +354,10 @@ def executeLinker(linkCmd):
     try:
         # Use blocking call here since the output file needs to be generated
         # before we can continue linking.
-        exitCode = sp.check_call(linkCmd)
+        with metricsPhase('link'):
+            exitCode = waitProcess(Popen(linkCmd))
+        if exitCode != 0:
+            raise sp.CalledProcessError(exitCode, linkCmd)
     except OSError as e:
         if e.errno == 2:
             errorMsg = 'Your llvm-link does not seem to be easy to find.\nEither install it or use the -l llvmLinker option.'
@@ -272,7 +400,8 @@ def linkFiles(pArgs, fileNames):
 
     linkCmd.append(f'-o={pArgs.outputFile}')
 
-    fileNames = map(getBitcodePath, fileNames)
+    # finding them may mean decompressing them, which we may as well do in parallel
+    fileNames = runInParallel(getBitcodePath, [(f,) for f in fileNames])
     fileNames = [x for x in fileNames if x != '']
 
     # Check the size of the argument string first: If it is larger than the
@@ -306,14 +435,17 @@ def archiveFiles(pArgs, fileNames):
         else:
             dirToBCMap[dirName] = [basename]
 
-    _logger.debug('Built up directory to bitcode file list map:\n%s', pprint.pformat(dirToBCMap))
+    import pprint
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Built up directory to bitcode file list map:\n%s', pprint.pformat(dirToBCMap))
 
     for (dirname, bcList) in dirToBCMap.items():
         _logger.debug('Changing directory to "%s"', dirname)
         os.chdir(dirname)
         larCmd = [pArgs.llvmArchiver, 'rs', pArgs.outputFile] + bcList
-        larProc = Popen(larCmd)
-        retCode = larProc.wait()
+        with metricsPhase('link'):
+            larProc = Popen(larCmd)
+            retCode = waitProcess(larProc)
         if retCode != 0:
             _logger.error('Failed to execute:\n%s', pprint.pformat(larCmd))
             break
@@ -328,28 +460,40 @@ def archiveFiles(pArgs, fileNames):
 def extract_from_thin_archive(inputFile):
     """Extracts the paths from the thin archive.
 
+    The members of a thin archive are named relative to the archive.
     """
     retval = None
-
-    arCmd = ['ar', '-t', inputFile]         #iam: check if this might be os dependent
-    arProc = Popen(arCmd, stdout=sp.PIPE)
-
-    arOutput = arProc.communicate()[0]
-    if arProc.returncode != 0:
-        _logger.error('ar failed on %s', inputFile)
+    try:
+        with mappedFile(inputFile) as data:
+            names = [name for (name, _, _) in readArchive(data)]
+    except (OSError, ValueError) as e:
+        _logger.error('Could not read the archive "%s": %s', inputFile, str(e))
     else:
-        retval = arOutput.splitlines()
+        retval = [os.path.join(os.path.dirname(inputFile), name) for name in names]
     return retval
 
+def extract_member_linux(archive, name, data):
+    """Extracts the section as a string from the member name of archive, whose contents are data."""
+    sections = getSections(data)
+    if sections is None:
+        _logger.warning('"%s" in "%s" is not an ELF object, so skipping this entry.', name, archive)
+        return []
+    return extract_sections(f'{archive}({name})', data, sections)
+
 
 
 def handleExecutable(pArgs):
 
-    fileNames = pArgs.extractor(pArgs.inputFile)
+    with metricsPhase('extract'):
+        fileNames = pArgs.extractor(pArgs.inputFile)
 
     if not fileNames:
         return 1
 
+    (fileNames, ok) = resolveBitcodeFiles(fileNames)
+    if not ok:
+        return 1
+
     if  pArgs.sortBitcodeFilesFlag:
         fileNames = sorted(fileNames)
 
@@ -373,7 +517,8 @@ def handleThinArchive(pArgs):
     bcFiles = []
     for p in objectPaths:
         _logger.debug('handleThinArchive: processing %s', p)
-        contents = pArgs.extractor(p)
+        with metricsPhase('extract'):
+            contents = pArgs.extractor(p)
         for c in contents:
             if c:
                 _logger.debug('\t including %s', c)
@@ -383,49 +528,11 @@ def handleThinArchive(pArgs):
 
     return  buildArchive(pArgs, bcFiles)
 
-#iam: do we want to preserve the order in the archive? if so we need to return both the list and the dict.
-def fetchTOC(inputFile):
-    toc = {}
-
-    arCmd = ['ar', '-t', inputFile]         #iam: check if this might be os dependent
-    arProc = Popen(arCmd, stdout=sp.PIPE)
-
-    arOutput = arProc.communicate()[0]
-    if arProc.returncode != 0:
-        _logger.error('ar failed on %s', inputFile)
-        return toc
-
-    lines = arOutput.splitlines()
-
-    for line in lines:
-        if line in toc:
-            toc[line] += 1
-        else:
-            toc[line] = 1
-
-    return toc
-
-
-def extractFile(archive, filename, instance):
-    arCmd = ['ar', 'xN', str(instance), archive, filename]         #iam: check if this might be os dependent
-    try:
-        arP = Popen(arCmd)
-    except Exception as e:
-        _logger.error(e)
-        return False
-
-    arPE = arP.wait()
-
-    if arPE != 0:
-        errorMsg = f'Failed to execute archiver with command {arCmd}'
-        _logger.error(errorMsg)
-        return False
-
-    return True
-
-
-
 def handleArchiveDarwin(pArgs):
+    import pprint
+    import shutil
+    import tempfile
+
     originalDir = os.getcwd() # This will be the destination
 
     pArgs.arCmd.append(pArgs.inputFile)
@@ -468,8 +575,10 @@ def handleArchiveDarwin(pArgs):
                 if FileType.getFileType(fPath) == pArgs.fileType:
 
                     # Extract bitcode locations from object
-                    contents = pArgs.extractor(fPath)
+                    with metricsPhase('extract'):
+                        contents = pArgs.extractor(fPath)
 
+                    (contents, _) = resolveBitcodeFiles(contents)
                     for bcFile in contents:
                         if bcFile != '':
                             if not os.path.exists(bcFile):
@@ -479,7 +588,9 @@ def handleArchiveDarwin(pArgs):
                 else:
                     _logger.info('Ignoring file "%s" in archive', f)
 
-        _logger.info('Found the following bitcode file names to build bitcode archive:\n%s', pprint.pformat(bitCodeFiles))
+        if _logger.isEnabledFor(logging.INFO):
+            _logger.info('Found the following bitcode file names to build bitcode archive:\n%s',
+                         pprint.pformat(bitCodeFiles))
 
     finally:
         # Delete the temporary folder
@@ -503,10 +614,10 @@ def handleArchiveLinux(pArgs):
 
     Archives on Linux are strange beasts. handleArchive processes the archive by:
 
-      1. first creating a table of contents of the archive, which maps file names (in the archive) to the number of
-    times a file with that name is stored in the archive.
+      1. first reading the member headers of the archive, mapped into memory, noting where each member lies.
+    Several members may share a name.
 
-      2. for each OCCURENCE of a file (name and count) it extracts the section from the object file, and adds the
+      2. for each member it extracts the section straight from the member's contents, and adds the
     bitcode paths to the bitcode list.
 
       3. it then either links all these bitcode files together using llvm-link,  or else is creates a bitcode
@@ -516,53 +627,39 @@ def handleArchiveLinux(pArgs):
 
     inputFile = pArgs.inputFile
 
-    originalDir = os.getcwd() # We want to end up back where we started.
-
-    toc = fetchTOC(inputFile)
-
-    if not toc:
-        _logger.warning('No files found, so nothing to be done.')
-        return 0
-
     bitCodeFiles = []
 
     try:
-        tempDir = tempfile.mkdtemp(suffix='wllvm')
-        os.chdir(tempDir)
-
-        for filename in toc:
-            count = toc[filename]
-            for i in range(1, count + 1):
-
-                # extact out the ith instance of filename
-                if extractFile(inputFile, filename, i):
-                    # Extract bitcode locations from object
-                    contents = pArgs.extractor(filename)
-                    _logger.debug('From instance %s of %s in %s we extracted\n\t%s\n', i, filename, inputFile, contents)
+        with mappedFile(inputFile) as data:
+            members = list(readArchive(data))
+            if not members:
+                _logger.warning('No files found, so nothing to be done.')
+                return 0
+
+            with memoryview(data) as view:
+                for (index, (name, offset, size)) in enumerate(members, 1):
+                    with view[offset:offset + size] as member, metricsPhase('extract'):
+                        contents = extract_member_linux(inputFile, name, member)
                     if contents:
+                        # Extract bitcode locations from object
+                        _logger.debug('From member %s, %s, of %s we extracted\n\t%s\n', index, name, inputFile, contents)
                         for path in contents:
                             if path:
                                 bitCodeFiles.append(path)
                     else:
-                        _logger.debug('From instance %s of %s in %s we extracted NOTHING\n', i, filename, inputFile)
-
-    finally:
-        # Delete the temporary folder
-        _logger.debug('Deleting temporary folder "%s"', tempDir)
-        shutil.rmtree(tempDir)
+                        _logger.debug('From member %s, %s, of %s we extracted NOTHING\n', index, name, inputFile)
+    except (OSError, ValueError) as e:
+        _logger.error('Could not read the archive "%s": %s', inputFile, str(e))
+        return 1
 
     _logger.debug('From instance %s we extracted\n\t%s\n', inputFile, bitCodeFiles)
 
     # Build bitcode archive
-    os.chdir(originalDir)
-
     return buildArchive(pArgs, bitCodeFiles)
 
 
 
 
-
-
 def buildArchive(pArgs, bitCodeFiles):
 
     if pArgs.bitcodeModuleFlag:
@@ -570,6 +667,10 @@ def buildArchive(pArgs, bitCodeFiles):
     else:
         _logger.info('Generating LLVM Bitcode archive from an archive')
 
+    (bitCodeFiles, ok) = resolveBitcodeFiles(bitCodeFiles)
+    if not ok:
+        return 1
+
     if  pArgs.sortBitcodeFilesFlag:
         bitCodeFiles = sorted(bitCodeFiles)
 
@@ -708,6 +809,7 @@ def process_file_unix(pArgs):
     retval = 1
     ft = FileType.getFileType(pArgs.inputFile)
     _logger.debug('Detected file type is %s', FileType.revMap[ft])
+    noteInvocation(argvClass=FileType.revMap[ft], tu=pArgs.inputFile)
 
     pArgs.arCmd = ['ar', 'xv'] if pArgs.verboseFlag else ['ar', 'x']
     pArgs.extractor = extract_section_linux
@@ -730,6 +832,7 @@ def process_file_darwin(pArgs):
     retval = 1
     ft = FileType.getFileType(pArgs.inputFile)
     _logger.debug('Detected file type is %s', FileType.revMap[ft])
+    noteInvocation(argvClass=FileType.revMap[ft], tu=pArgs.inputFile)
 
     pArgs.arCmd = ['ar', '-x', '-v'] if pArgs.verboseFlag else ['ar', '-x']
     pArgs.extractor = extract_section_darwin
@@ -25,12 +25,13 @@ from __future__ import absolute_import
 import sys
 
 from .extraction import extraction
+from .metrics import runWithMetrics
 
 def main():
     """ The entry point to extract-bc.
     """
     try:
-        extraction()
+        runWithMetrics('extract-bc', extraction)
     except Exception:
         pass
     return 0
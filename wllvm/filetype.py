@@ -1,10 +1,25 @@
 """ A static class that allows the type of a file to be checked.
 """
+import functools
 import os
+import struct
 
-from subprocess import PIPE
+from .elf import getElfType, ET_REL, ET_EXEC, ET_DYN
 
-from .popenwrapper import Popen
+# Mach-O magic numbers, as they appear on disk, and the byte order they imply.
+_machMagic = {b'\xfe\xed\xfa\xce': '>', b'\xfe\xed\xfa\xcf': '>',
+              b'\xce\xfa\xed\xfe': '<', b'\xcf\xfa\xed\xfe': '<'}
+# Universal binaries are always big endian; 0xcafebabe is a Java class file too.
+_fatMagic = (b'\xca\xfe\xba\xbe', b'\xca\xfe\xba\xbf')
+
+# Mach-O filetypes
+MH_OBJECT = 1
+MH_EXECUTE = 2
+MH_PRELOAD = 5
+MH_DYLIB = 6
+
+# How many answers getFileType remembers; extract-bc can walk through far more files than that.
+_fileTypeCacheSize = 1024
 
 class FileType:
     """ A hack to grok the type of input files.
@@ -29,36 +44,59 @@ class FileType:
     def getFileType(cls, fileName):
         """ Returns the type of a file.
 
-        This is a hacky way of determining
-        the type of file we are looking at.
-        Maybe we should use python-magic instead?
+        Reads the magic numbers at the start of the file, rather than
+        running file(1), and remembers the answer for as long as the file
+        does not change (for the most recently asked about files).
+        """
+        realPath = os.path.realpath(fileName)
+        try:
+            st = os.stat(realPath)
+        except OSError:
+            return cls.UNKNOWN
+        try:
+            return cls._getCachedFileType((realPath, st.st_ino, st.st_mtime_ns))
+        except OSError:
+            return cls.UNKNOWN
+
+    @staticmethod
+    @functools.lru_cache(maxsize=_fileTypeCacheSize)
+    def _getCachedFileType(key):
+        """ Memoizes getFileType, keyed by (path, inode, mtime); a file we cannot read is not remembered.
+        """
+        with open(key[0], 'rb') as f:
+            return FileType._readFileType(f)
+
+    @classmethod
+    def _readFileType(cls, f):
+        """ Returns the type of the file open (in binary mode) as f.
         """
-        retval = None
-        fileP = Popen(['file', os.path.realpath(fileName)], stdout=PIPE)
-        output = fileP.communicate()[0]
-        foutput = output.decode()
-        foutput = foutput.split(' ', 1)[1] # Strip file path
-
-        if 'ELF' in foutput and 'executable' in foutput:
-            retval = cls.ELF_EXECUTABLE
-        elif 'Mach-O' in foutput and 'executable' in foutput:
-            retval = cls.MACH_EXECUTABLE
-        elif 'ELF' in foutput and 'shared' in foutput:
-            retval = cls.ELF_SHARED
-        elif 'Mach-O' in foutput and 'dynamically linked shared' in foutput:
-            retval = cls.MACH_SHARED
-        elif 'current ar archive' in foutput:
-            retval = cls.ARCHIVE
-        elif 'thin archive' in foutput:
-            retval = cls.THIN_ARCHIVE
-        elif 'ELF' in foutput and 'relocatable' in foutput:
-            retval = cls.ELF_OBJECT
-        elif 'Mach-O' in foutput and 'object' in foutput:
-            retval = cls.MACH_OBJECT
-        else:
-            retval = cls.UNKNOWN
-
-        return retval
+        header = f.read(32)
+        if header.startswith(b'!<arch>\n'):
+            return cls.ARCHIVE
+        if header.startswith(b'!<thin>\n'):
+            return cls.THIN_ARCHIVE
+
+        elfType = getElfType(f)
+        if elfType is not None:
+            return {ET_REL: cls.ELF_OBJECT, ET_EXEC: cls.ELF_EXECUTABLE, ET_DYN: cls.ELF_SHARED}.get(elfType, cls.UNKNOWN)
+
+        magic = header[:4]
+        if magic in _fatMagic and len(header) >= 24:
+            # Java class files have their (>= 45) version where the
+            # architecture count is; we go by the first architecture.
+            fatArch = '>I8xQ' if magic == _fatMagic[1] else '>I8xI'
+            (nfat, offset) = struct.unpack(fatArch, header[4:4 + struct.calcsize(fatArch)])
+            if not 0 < nfat < 45:
+                return cls.UNKNOWN
+            f.seek(offset)
+            header = f.read(16)
+            magic = header[:4]
+        if magic in _machMagic and len(header) >= 16:
+            (filetype,) = struct.unpack(_machMagic[magic] + 'I', header[12:16])
+            return {MH_OBJECT: cls.MACH_OBJECT, MH_EXECUTE: cls.MACH_EXECUTABLE,
+                    MH_PRELOAD: cls.MACH_EXECUTABLE, MH_DYLIB: cls.MACH_SHARED}.get(filetype, cls.UNKNOWN)
+
+        return cls.UNKNOWN
 
 
     @classmethod
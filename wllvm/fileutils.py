@@ -0,0 +1,93 @@
+"""
+Cheap and concurrency safe ways of copying files around.
+
+Used by the bitcode cache and the bitcode store, both of which can be
+shared by many wllvm processes at once: readers must never see a
+partially written file, so everything is written under a temporary name
+and renamed into place. The files they, and the metrics, keep adding to
+are appended to in single O_APPEND writes, by appendToFile.
+"""
+
+import fcntl
+import os
+import shutil
+import sys
+import threading
+
+from .logconfig import logConfig
+
+# Internal logger
+_logger = logConfig(__name__)
+
+# FICLONE from linux/fs.h: share the extents of one file with another.
+_FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """ Makes dst a copy on write clone of src, if the platform and file system allow it.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        return True
+    except OSError:
+        discardFile(dst)
+        return False
+
+
+def cloneFile(src, dst):
+    """ Makes dst, which must not exist, a copy of src as cheaply as we can.
+
+    A reflink, else a real copy. Never a hard link, which would share its
+    contents with src: the .bc files in a build tree can be rewritten in
+    place, and a cache or store entry must not change along with them.
+    """
+    if reflink(src, dst):
+        return 'reflink'
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def discardFile(path):
+    """ Removes path, if it is there; for cleaning up after a failure, where nothing more can be done.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def appendToFile(path, data):
+    """ Adds data to the end of path, which is created if need be, in a single O_APPEND write.
+
+    So what each of many processes appends lands in one piece, after
+    whatever the others have appended.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def temporaryName(path):
+    """ A name next to path, unique to this process and thread, to build path under.
+    """
+    (dirName, baseName) = os.path.split(path)
+    return os.path.join(dirName, f'.{baseName}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def installFile(src, dst):
+    """ Atomically makes dst a copy of src, replacing whatever was there.
+    """
+    tmp = temporaryName(dst)
+    try:
+        how = cloneFile(src, tmp)
+        os.replace(tmp, dst)
+    except OSError:
+        discardFile(tmp)
+        raise
+    _logger.debug('Installed %s as %s by %s', src, dst, how)
+    return how
@@ -0,0 +1,179 @@
+"""
+Support for the GNU make jobserver.
+
+When make runs with -jN it hands out N job slots: one implicit slot for
+every process it starts, and N-1 tokens that sit in a pipe (or, since
+make 4.4, a named fifo) advertised in MAKEFLAGS via --jobserver-auth.
+Every extra process we run alongside the real compile has to hold a
+token, otherwise wllvm doubles the load that make thinks it is running.
+
+The object compile uses the implicit slot; the bitcode compiles and
+anything else we run in parallel take tokens from make.
+"""
+
+import os
+import re
+import select
+import stat
+import threading
+import contextlib
+
+from .logconfig import logConfig
+
+# Internal logger
+_logger = logConfig(__name__)
+
+# --jobserver-fds is what make 4.1 and earlier used.
+_authPattern = re.compile(r'--jobserver-(?:auth|fds)=(\S+)')
+
+# Environmental variable bounding the number of source files we work on at
+# once when a single invocation has several of them. Defaults to the CPU count.
+jobsEnv = 'WLLVM_JOBS'
+
+# How often, in seconds, a thread waiting on make checks for the implicit slot.
+_pollInterval = 0.05
+
+
+def getJobServerAuth(makeflags):
+    """ The value of the --jobserver-auth (or --jobserver-fds) in makeflags, or None.
+    """
+    # make puts the single letter flags first; the last --jobserver-auth wins.
+    auths = _authPattern.findall(makeflags or '')
+    return auths[-1] if auths else None
+
+
+def openJobServerAuth(auth):
+    """ The read and write descriptors of the jobserver auth describes.
+
+    That is a named fifo, which we open, or a pipe make passed down to us.
+    Raises OSError or ValueError if we cannot use it.
+    """
+    if auth.startswith('fifo:'):
+        fd = os.open(auth[len('fifo:'):], os.O_RDWR)
+        return (fd, fd)
+    fds = tuple(int(fd) for fd in auth.split(','))
+    if len(fds) != 2 or not all(fd >= 0 and stat.S_ISFIFO(os.fstat(fd).st_mode) for fd in fds):
+        # make passes negative descriptors to the commands it does not trust with the pipe
+        raise ValueError('not a pipe make passed to us')
+    return fds
+
+
+class JobServer:
+    """ A client of the make jobserver; shared by all the threads of a process.
+    """
+
+    def __init__(self, readFd, writeFd):
+        self.readFd = readFd
+        self.writeFd = writeFd
+        self._lock = threading.Lock()
+        self._implicitFree = True
+
+    @classmethod
+    def fromMakeflags(cls, makeflags):
+        """ Returns the jobserver described by MAKEFLAGS.
+
+        Returns None if there is no jobserver, and False if make advertises
+        one we cannot use (make only passes the pipe to recursive makes).
+        """
+        auth = getJobServerAuth(makeflags)
+        if auth is None:
+            return None
+        try:
+            return cls(*openJobServerAuth(auth))
+        except (OSError, ValueError) as e:
+            _logger.debug('Cannot use the jobserver "%s": %s', auth, str(e))
+            return False
+
+    def acquire(self):
+        """ Blocks until we have a job slot, and returns it.
+
+        The implicit slot (None) is handed out whenever it is free; otherwise
+        we read a token from make.
+        """
+        while True:
+            with self._lock:
+                if self._implicitFree:
+                    self._implicitFree = False
+                    return None
+            # poll, so that we notice when our own implicit slot frees up.
+            (readable, _, _) = select.select([self.readFd], [], [], _pollInterval)
+            if not readable:
+                continue
+            try:
+                token = os.read(self.readFd, 1)
+            except BlockingIOError:
+                # make leaves the pipe non-blocking, and another process beat us to it.
+                continue
+            if not token:
+                _logger.warning('The jobserver went away; carrying on without a token')
+            return token
+
+    def release(self, token):
+        """ Hands a job slot obtained from acquire back.
+        """
+        if token is None:
+            with self._lock:
+                self._implicitFree = True
+        elif token:
+            os.write(self.writeFd, token)
+
+
+class _JobServerCache:
+    """ The jobserver of a process, and the MAKEFLAGS it came from.
+    """
+
+    def __init__(self):
+        self.makeflags = None
+        self.server = None
+        self.lock = threading.Lock()
+
+    def get(self, makeflags):
+        with self.lock:
+            if self.makeflags != makeflags:
+                self.makeflags = makeflags
+                self.server = JobServer.fromMakeflags(makeflags)
+            return self.server
+
+
+_cache = _JobServerCache()
+
+def getJobServer():
+    """ Returns the jobserver of the make we are running under, if there is one.
+
+    As in fromMakeflags, the result is None if there is no jobserver, and
+    False if there is one we cannot use.
+    """
+    return _cache.get(os.getenv('MAKEFLAGS'))
+
+
+def getJobCount():
+    """ The size of our worker pool, from WLLVM_JOBS or else the CPU count.
+
+    Under a make jobserver the pool is further throttled by the tokens make
+    hands out; under a parallel make whose jobserver we cannot use, we stick
+    to one job at a time.
+    """
+    jobs = os.getenv(jobsEnv)
+    if jobs:
+        try:
+            return max(1, int(jobs))
+        except ValueError:
+            _logger.warning('Ignoring %s = "%s" since it is not a number', jobsEnv, jobs)
+    if getJobServer() is False:
+        return 1
+    return os.cpu_count() or 1
+
+
+@contextlib.contextmanager
+def jobSlot():
+    """ Holds a make job slot for the duration of the with statement.
+    """
+    server = getJobServer()
+    if not server:
+        yield
+        return
+    token = server.acquire()
+    try:
+        yield
+    finally:
+        server.release(token)
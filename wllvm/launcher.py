@@ -0,0 +1,108 @@
+"""
+What wllvm, wllvm++ and wfortran do before anything else.
+
+Most of the cost of a wllvm invocation that builds no bitcode (configure
+tests, -E, -M, --version, ...) used to be Python start-up and imports.
+So the entry points first take a quick look at the arguments, without
+importing the argument tables, and simply become the real compiler when
+there is obviously no bitcode to build. Everything else goes to the
+daemon, if there is one, or to wcompile.
+
+Anything the quick look is unsure about takes the long way round, which
+is always right. In particular, a flag that says no bitcode is only
+believed when what comes before it cannot be a flag taking it as its
+value: the start of the command, a file, or a flag we know stands alone.
+"""
+
+import os
+import sys
+
+from .daemon import forwardToDaemon
+
+# compilers only gets imported by the invocations that need it.
+# pylint: disable=import-outside-toplevel
+
+# Each of these makes ArgumentListFilter.skipBitcodeGeneration say yes.
+_noBitcodeFlags = frozenset(['-E', '-S', '-emit-llvm', '-'])
+
+# -M and -MM only mean no bitcode when we are not also compiling.
+_dependencyOnlyFlags = frozenset(['-M', '-MM'])
+
+# Asking the compiler about itself: no input files, so no bitcode.
+_queryFlags = frozenset(['--version', '-v', '-dumpversion', '-dumpmachine', '-print-search-dirs',
+                         '-print-libgcc-file-name', '-print-multi-directory', '-print-multi-lib'])
+_queryPrefixes = ('-print-prog-name=', '-print-file-name=')
+
+# Flags whose value is the next argument, which could look like any of the above.
+_binaryFlags = frozenset(['-o', '-x', '-MF', '-MT', '-MQ', '-MJ', '-Xclang', '-Xpreprocessor',
+                          '-Xassembler', '-Xlinker', '-Xanalyzer', '-mllvm', '-include', '-imacros',
+                          '-I', '-D', '-U', '-A', '-L', '-l', '-T', '-u', '-e', '-z', '-isystem', '-iquote',
+                          '-idirafter', '-isysroot', '-iprefix', '-iwithprefix', '-iwithprefixbefore',
+                          '-imultilib', '--sysroot', '-target', '-arch', '--param', '-aux-info', '-rpath',
+                          '-framework', '-current_version', '-compatibility_version'])
+
+# Flags known to stand alone, so the argument after them is not their value.
+_unaryFlags = frozenset(['-c', '-w', '-v', '-P', '-C', '-H', '-pipe', '-pthread', '-ansi', '-pedantic',
+                         '-pedantic-errors', '-undef', '-nostdinc', '-nostdinc++', '-nostdlib', '-shared',
+                         '-static', '-MD', '-MMD', '-MP', '-MG', '-dM', '-dD'])
+_unaryPrefixes = ('-O', '-W', '-f', '-g', '-m', '-std=', '--std=')
+
+# Flags that may carry their value with them, as in -DFOO or -I/usr/include.
+_joinedFlags = ('-I', '-D', '-U', '-L', '-l')
+
+# ArgumentListFilter strips these out of the real compile, so leave them to it.
+_rewrittenFlags = frozenset(['-dead_strip', '-Wl,-dead_strip'])
+
+
+def _standsAlone(arg):
+    """ True when arg is a file, or a flag we know takes no value from the next argument.
+    """
+    if arg in _binaryFlags:
+        return False
+    if not arg.startswith('-') or arg in _noBitcodeFlags or arg in _dependencyOnlyFlags or arg in _unaryFlags:
+        return True
+    return (arg.startswith(_unaryPrefixes) or '=' in arg or ',' in arg
+            or (arg.startswith(_joinedFlags) and len(arg) > 2))
+
+
+def isNoBitcodeInvocation(args):
+    """ True when args certainly build no bitcode; False when we cannot tell cheaply.
+    """
+    if os.environ.get('WLLVM_CONFIGURE_ONLY', False) or not args:
+        return True
+    flags = set()
+    skipNext = False
+    unsure = False
+    for arg in args:
+        if skipNext:
+            skipNext = False
+            unsure = False
+            continue
+        # a flag saying no bitcode, after one we do not know, could be the value of that one
+        if (arg in _rewrittenFlags or arg.startswith('@')
+                or unsure and (arg in _noBitcodeFlags or arg in _dependencyOnlyFlags)):
+            return False
+        skipNext = arg in _binaryFlags
+        unsure = not _standsAlone(arg)
+        flags.add(arg)
+    if flags & _noBitcodeFlags:
+        return True
+    if flags & _dependencyOnlyFlags and '-c' not in flags:
+        return True
+    return all(arg in _queryFlags or arg.startswith(_queryPrefixes) for arg in args)
+
+
+def launch(mode):
+    """ Runs one wllvm, wllvm++ or wfortran invocation, the cheapest way we can.
+    """
+    cmd = sys.argv[1:]
+    if isNoBitcodeInvocation(cmd):
+        from .compilers import execCompiler
+        execCompiler(mode, cmd)
+
+    # None, unless there is a daemon that did the work
+    rc = forwardToDaemon(mode)
+    if rc is not None:
+        return rc
+    from .compilers import wcompile
+    return wcompile(mode)
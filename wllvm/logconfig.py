@@ -2,6 +2,14 @@
   This module is intended to be imported by command line tools so they can
   configure the root logger so that other loggers used in other modules can
   inherit the configuration.
+
+  The configuration is done once, by the first logConfig: the level from
+  WLLVM_OUTPUT_LEVEL goes on the wllvm logger, which every module's logger
+  inherits from, so a message below it costs no more than a level check.
+
+  With WLLVM_OUTPUT_FILE the records go to an AppendHandler, which many
+  wllvm processes can share: it holds the records back, and adds them to
+  the file whole, in as few writes as it can.
 """
 import logging
 import os
@@ -15,37 +23,158 @@ _loggingDestination = 'WLLVM_OUTPUT_FILE'
 
 _validLogLevels = ['ERROR', 'WARNING', 'INFO', 'DEBUG']
 
-def logConfig(name):
+# the logger every module's logger inherits its level from
+_packageLogger = 'wllvm'
 
-    destination = os.getenv(_loggingDestination)
+# How many bytes of records an AppendHandler holds before writing them.
+logBufferSize = 64 * 1024
 
-    if destination:
-        logging.basicConfig(filename=destination, level=logging.WARNING, format='%(levelname)s:%(message)s')
-    else:
-        logging.basicConfig(level=logging.WARNING, format='%(levelname)s:%(message)s')
+class _Configuration:
+    """ Whether logging is configured: every module calls logConfig, but it only needs doing once.
+    """
 
-    retval = logging.getLogger(name)
+    def __init__(self):
+        self.done = False
 
-    # ignore old setting
-    level = os.getenv(_loggingEnvLevel_new)
 
+_configuration = _Configuration()
+
+
+class AppendHandler(logging.Handler):
+    """ Adds records to a file that other processes may be adding to at the same time.
+
+    The file is opened O_APPEND, and the records are written in whole
+    lines, a buffer full at a time, so that each write lands in one piece
+    after whatever the other processes have written. Warnings and errors
+    are written at once, along with anything held before them.
+    """
+
+    def __init__(self, path, capacity=None, flushLevel=logging.WARNING):
+        super().__init__()
+        self.path = path
+        self.capacity = logBufferSize if capacity is None else capacity
+        self.flushLevel = flushLevel
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o666)
+        self.buffer = []
+        self.size = 0
+        self.pid = os.getpid()
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode('utf-8', 'backslashreplace')
+            if self.pid != os.getpid():
+                # a forked child: what we hold is its parent's to write
+                self.buffer = []
+                self.size = 0
+                self.pid = os.getpid()
+            if self.size + len(data) > self.capacity:
+                self._write()
+            self.buffer.append(data)
+            self.size += len(data)
+            if record.levelno >= self.flushLevel or self.size >= self.capacity:
+                self._write()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def _write(self):
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer and self.pid == os.getpid():
+                self._write()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.fd is not None:
+                try:
+                    self.flush()
+                finally:
+                    os.close(self.fd)
+                    self.fd = None
+        finally:
+            self.release()
+            super().close()
+
+
+def _configure():
+    level = os.getenv(_loggingEnvLevel_new)
     if level:
         level = level.upper()
         if not level in _validLogLevels:
+            logging.basicConfig(level=logging.WARNING, format='%(levelname)s:%(message)s')
             logging.error('"%s" is not a valid value for %s or %s. Valid values are %s',
                           level, _loggingEnvLevel_old, _loggingEnvLevel_new, _validLogLevels)
             sys.exit(1)
+
+    if level == 'DEBUG':
+        fmt = '%(levelname)s::%(module)s.%(funcName)s() at %(filename)s:%(lineno)d ::%(message)s'
+    else:
+        fmt = '%(levelname)s:%(message)s'
+
+    # like basicConfig, leave alone a root logger that is already set up
+    root = logging.getLogger()
+    if not root.handlers:
+        destination = os.getenv(_loggingDestination)
+        if destination:
+            # the records of many processes meet in the file, so say whose each is
+            handler = AppendHandler(destination)
+            fmt = fmt.replace(':', ':%(process)d:', 1)
         else:
-            retval.setLevel(getattr(logging, level))
+            handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(fmt))
+        root.addHandler(handler)
+        root.setLevel(logging.WARNING)
+
+    if level:
+        logging.getLogger(_packageLogger).setLevel(getattr(logging, level))
+
 
-    # Adjust the format if debugging
-    if retval.getEffectiveLevel() == logging.DEBUG:
-        formatter = logging.Formatter('%(levelname)s::%(module)s.%(funcName)s() at %(filename)s:%(lineno)d ::%(message)s')
-        for h in logging.getLogger().handlers:
-            h.setFormatter(formatter)
+def logConfig(name):
+    if not _configuration.done:
+        _configure()
+        _configuration.done = True
+
+    retval = logging.getLogger(name)
+
+    # the level is set on the wllvm logger, which a script run as __main__ is not below
+    if name != _packageLogger and not name.startswith(_packageLogger + '.'):
+        retval.setLevel(logging.getLogger(_packageLogger).level)
 
     return retval
 
+def flushLogging():
+    """ Writes out the records the handlers are holding.
+
+    For processes that leave by os._exit, which skips logging's own clean up.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+def resetLogging():
+    """ Configures logging afresh from the environment.
+
+    The children of wllvm-daemon need this, since they take on the
+    environment of their client after our loggers were set up.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    _configuration.done = False
+    for (name, logger) in list(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and (name == _packageLogger or name.startswith(_packageLogger + '.')):
+            logger.setLevel(logging.NOTSET)
+    logConfig(_packageLogger)
+
 def loggingConfiguration():
     destination = os.getenv(_loggingDestination)
     level = os.getenv(_loggingEnvLevel_new)
@@ -0,0 +1,423 @@
+"""
+Per invocation timing and resource metrics.
+
+If the environment variable WLLVM_METRICS_DIR names a directory, every
+wllvm, wllvm++, wfortran and extract-bc run appends one JSON line to
+metrics.jsonl there, with:
+
+  - the tool, its arguments, working directory and exit status,
+  - the class of invocation (compile, compile-many, compile-and-link,
+    link, no-bitcode) and the skipBitcodeGeneration reason, if any,
+  - the bitcode mode and profile, and the number and total size of the
+    bitcode files built,
+  - the wall time of the whole run,
+  - for each phase (compile, the compiler as invoked; object and link,
+    the hidden object compiles and their link; bitcode, and bitcode-wait
+    for the time spent waiting on bitcode compiles run alongside the
+    object's; attach, preprocess, queue; and extract and link for
+    extract-bc) the
+    number of times it ran, its wall time, and the user and system CPU
+    time and peak RSS of the processes it ran, from wait4.
+
+Lines are written with a single O_APPEND write, so any number of
+concurrent builds can share the directory. Invocations that the
+wrappers hand straight to the compiler (-E, --version, ...) become the
+compiler, so they get a line of what is known before they do (see
+recordExec): the time and exit status of the compiler are not ours to see.
+
+wllvm-metrics reads the file back and reports the totals, percentiles
+and worst translation units.
+"""
+
+import os
+import sys
+import time
+import threading
+
+from .logconfig import logConfig, informUser
+
+# Every invocation imports us, recording or not, so json and friends are
+# only imported by what writes, or reports on, the metrics.
+# pylint: disable=import-outside-toplevel
+
+# Internal logger
+_logger = logConfig(__name__)
+
+metricsDirEnv = 'WLLVM_METRICS_DIR'
+
+metricsFileName = 'metrics.jsonl'
+
+
+class _Recording:
+    """ The recorder of the invocation in progress, if we are recording one.
+    """
+
+    def __init__(self):
+        self.recorder = None
+
+
+_recording = _Recording()
+
+
+class Recorder:
+    """ Adds up the phases of one invocation.
+    """
+
+    def __init__(self, tool):
+        self.tool = tool
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        self.phases = {}
+        self.info = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def currentPhase(self):
+        stack = getattr(self.local, 'stack', None)
+        return stack[-1] if stack else 'other'
+
+    def push(self, name):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        self.local.stack.append(name)
+
+    def pop(self):
+        self.local.stack.pop()
+
+    def phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = {'count': 0, 'wall': 0.0, 'user': 0.0, 'sys': 0.0, 'maxrss': 0}
+        return self.phases[name]
+
+    def addWall(self, name, wall):
+        with self.lock:
+            phase = self.phase(name)
+            phase['count'] += 1
+            phase['wall'] += wall
+
+    def addUsage(self, rusage):
+        # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+        maxrss = rusage.ru_maxrss // 1024 if sys.platform.startswith('darwin') else rusage.ru_maxrss
+        with self.lock:
+            phase = self.phase(self.currentPhase())
+            phase['user'] += rusage.ru_utime
+            phase['sys'] += rusage.ru_stime
+            phase['maxrss'] = max(phase['maxrss'], maxrss)
+
+    def addBitcodeFile(self, size):
+        with self.lock:
+            self.info['bitcodeFiles'] = self.info.get('bitcodeFiles', 0) + 1
+            self.info['bitcodeBytes'] = self.info.get('bitcodeBytes', 0) + size
+
+    def entry(self, rc):
+        entry = {
+            'tool': self.tool,
+            'argv': sys.argv[1:],
+            'cwd': os.getcwd(),
+            'pid': os.getpid(),
+            'start': self.start,
+            'wall': time.perf_counter() - self.clock,
+            'rc': rc,
+            'phases': self.phases,
+        }
+        entry.update(self.info)
+        return entry
+
+
+class _NoPhase:
+    """ What metricsPhase hands out when we are not recording.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_noPhase = _NoPhase()
+
+
+class _Phase:
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.clock = 0.0
+
+    def __enter__(self):
+        self.recorder.push(self.name)
+        self.clock = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.addWall(self.name, time.perf_counter() - self.clock)
+        self.recorder.pop()
+        return False
+
+
+def metricsPhase(name):
+    """ A context manager timing what it encloses as the phase name; free when we are not recording.
+    """
+    recorder = _recording.recorder
+    if recorder is None:
+        return _noPhase
+    return _Phase(recorder, name)
+
+
+def waitProcess(proc):
+    """ Waits for the Popen proc, as proc.wait() does, charging its resource usage to the current phase.
+    """
+    recorder = _recording.recorder
+    if recorder is None or proc.returncode is not None:
+        return proc.wait()
+    try:
+        (_, status, rusage) = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait()
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    recorder.addUsage(rusage)
+    return proc.returncode
+
+
+def noteInvocation(**info):
+    """ Adds info, such as the class of invocation, to the entry being recorded.
+    """
+    recorder = _recording.recorder
+    if recorder is not None:
+        recorder.info.update(info)
+
+
+def noteBitcodeFile(path):
+    """ Adds the bitcode file path, just built, to the entry being recorded.
+    """
+    recorder = _recording.recorder
+    if recorder is None:
+        return
+    try:
+        recorder.addBitcodeFile(os.path.getsize(path))
+    except OSError:
+        pass
+
+
+def _exitStatus(code):
+    if code is None:
+        return 0
+    return code if isinstance(code, int) else 1
+
+
+def runWithMetrics(tool, func, *args):
+    """ Runs func(*args), recording what it cost if WLLVM_METRICS_DIR is set.
+    """
+    directory = os.getenv(metricsDirEnv)
+    if not directory:
+        return func(*args)
+    _recording.recorder = recorder = Recorder(tool)
+    rc = 1
+    try:
+        rc = func(*args)
+        return rc
+    except SystemExit as e:
+        rc = _exitStatus(e.code)
+        raise
+    finally:
+        _recording.recorder = None
+        writeEntry(directory, recorder.entry(rc))
+
+
+def recordExec(tool):
+    """ Records an invocation that is about to become the compiler, if WLLVM_METRICS_DIR is set.
+
+    The line has exec set, and no exit status: what the compiler does from
+    then on is not ours to see.
+    """
+    directory = os.getenv(metricsDirEnv)
+    if not directory:
+        return
+    entry = Recorder(tool).entry(None)
+    entry.update(argvClass='no-bitcode', exec=True)
+    writeEntry(directory, entry)
+
+
+def writeEntry(directory, entry):
+    import json
+    from .fileutils import appendToFile
+    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        appendToFile(os.path.join(directory, metricsFileName), line)
+    except OSError as e:
+        _logger.warning('Could not record metrics in %s: %s', directory, str(e))
+
+
+def readEntries(directory):
+    """ The entries recorded in directory, skipping any line that is not whole.
+    """
+    import json
+    entries = []
+    try:
+        with open(os.path.join(directory, metricsFileName), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return entries
+
+
+def percentile(values, p):
+    """ The nearest rank p-th percentile of the sorted list values.
+    """
+    if not values:
+        return 0.0
+    import math
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+
+def requestedTime(entry):
+    """ The wall time of an entry spent in the compile it was asked to do.
+
+    A compile and link is usually done as object compiles and a link in
+    place of the command as given (see compilers.compileAndLink).
+    """
+    phases = entry.get('phases', {})
+    names = ('compile',)
+    if entry.get('argvClass') == 'compile-and-link' and 'compile' not in phases:
+        names = ('object', 'link')
+    return sum(phases.get(name, {}).get('wall', 0.0) for name in names)
+
+
+def addedTime(entry):
+    """ The wall time of an entry not spent in the compile it was asked to do.
+    """
+    return max(0.0, entry.get('wall', 0.0) - requestedTime(entry))
+
+
+def summarize(entries, top=10):
+    """ Aggregates the entries into totals, per phase statistics and the worst translation units.
+    """
+    summary = {'invocations': len(entries), 'tools': {}, 'classes': {}, 'skipReasons': {}, 'failures': 0}
+    wall = compile_ = 0.0
+    perPhase = {}
+    profiles = {}
+    for entry in entries:
+        if entry.get('bitcodeFiles'):
+            bitcode = entry.get('phases', {}).get('bitcode', {})
+            profile = profiles.setdefault(entry.get('bitcodeProfile') or 'full',
+                                          {'invocations': 0, 'files': 0, 'bytes': 0, 'wall': 0.0, 'cpu': 0.0})
+            profile['invocations'] += 1
+            profile['files'] += entry['bitcodeFiles']
+            profile['bytes'] += entry.get('bitcodeBytes', 0)
+            profile['wall'] += bitcode.get('wall', 0.0)
+            profile['cpu'] += bitcode.get('user', 0.0) + bitcode.get('sys', 0.0)
+        for (key, value) in (('tools', entry.get('tool')), ('classes', entry.get('argvClass')),
+                             ('skipReasons', entry.get('skipReason'))):
+            if value:
+                summary[key][value] = summary[key].get(value, 0) + 1
+        if entry.get('rc'):
+            summary['failures'] += 1
+        wall += entry.get('wall', 0.0)
+        compile_ += requestedTime(entry)
+        for (name, phase) in entry.get('phases', {}).items():
+            perPhase.setdefault(name, []).append(phase)
+    summary['wall'] = wall
+    summary['compileWall'] = compile_
+    summary['addedWall'] = wall - compile_
+
+    phases = {}
+    for (name, records) in perPhase.items():
+        walls = sorted(r['wall'] for r in records)
+        phases[name] = {
+            'invocations': len(records),
+            'count': sum(r['count'] for r in records),
+            'wall': sum(walls),
+            'cpu': sum(r['user'] + r['sys'] for r in records),
+            'p50': percentile(walls, 50),
+            'p90': percentile(walls, 90),
+            'p99': percentile(walls, 99),
+            'max': walls[-1],
+            'maxrss': max(r['maxrss'] for r in records),
+        }
+    summary['phases'] = phases
+    summary['profiles'] = profiles
+
+    worst = sorted((e for e in entries if e.get('tool') != 'extract-bc'), key=addedTime, reverse=True)[:top]
+    summary['worst'] = [{'tu': e.get('tu') or ' '.join(e.get('argv', [])), 'cwd': e.get('cwd'),
+                         'argvClass': e.get('argvClass'), 'added': addedTime(e), 'wall': e.get('wall', 0.0)}
+                        for e in worst]
+    return summary
+
+
+def _counts(counts):
+    return ', '.join(f'{name} {count}' for (name, count) in sorted(counts.items(), key=lambda kv: -kv[1])) or 'none'
+
+
+def printSummary(summary):
+    wall = summary['wall']
+    share = 100.0 * summary['addedWall'] / wall if wall else 0.0
+    print(f'invocations      {summary["invocations"]} ({_counts(summary["tools"])}), {summary["failures"]} failed')
+    print(f'classes          {_counts(summary["classes"])}')
+    print(f'skip reasons     {_counts(summary["skipReasons"])}')
+    print(f'wall time        {wall:.2f} s, {summary["compileWall"]:.2f} s in the compiles as invoked, '
+          f'{summary["addedWall"]:.2f} s added by wllvm ({share:.1f} %)')
+    print()
+    print(f'{"phase":12} {"runs":>8} {"wall s":>10} {"cpu s":>10} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} '
+          f'{"max ms":>9} {"max rss MiB":>12}')
+    for (name, phase) in sorted(summary['phases'].items(), key=lambda kv: -kv[1]['wall']):
+        print(f'{name:12} {phase["count"]:8} {phase["wall"]:10.2f} {phase["cpu"]:10.2f} {phase["p50"] * 1e3:9.1f} '
+              f'{phase["p90"] * 1e3:9.1f} {phase["p99"] * 1e3:9.1f} {phase["max"] * 1e3:9.1f} '
+              f'{phase["maxrss"] / 1024:12.1f}')
+    if summary['profiles']:
+        print()
+        print(f'{"profile":12} {"bitcode files":>14} {"MiB":>10} {"KiB / file":>11} {"wall s":>10} {"cpu s":>10} '
+              f'{"ms / file":>10}')
+        for (name, profile) in sorted(summary['profiles'].items()):
+            files = profile['files']
+            print(f'{name:12} {files:14} {profile["bytes"] / 2 ** 20:10.2f} {profile["bytes"] / 1024 / files:11.1f} '
+                  f'{profile["wall"]:10.2f} {profile["cpu"]:10.2f} {profile["wall"] * 1e3 / files:10.1f}')
+    if summary['worst']:
+        print()
+        print('most time added by wllvm:')
+        for worst in summary['worst']:
+            print(f'{worst["added"] * 1e3:10.1f} ms of {worst["wall"] * 1e3:10.1f} ms  {worst["tu"]}  ({worst["cwd"]})')
+
+
+def main():
+    """ The entry point to wllvm-metrics.
+    """
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Reports on the metrics recorded in WLLVM_METRICS_DIR.')
+    parser.add_argument('--dir', '-d', default=os.getenv(metricsDirEnv),
+                        help=f'The metrics directory (defaults to ${metricsDirEnv}).')
+    parser.add_argument('--top', '-n', type=int, default=10,
+                        help='How many of the worst translation units to list. Default %(default)s')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    parser.add_argument('--clear', '-C', action='store_true', help='Throw away the recorded metrics.')
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error(f'either pass --dir or set {metricsDirEnv}')
+
+    if args.clear:
+        try:
+            os.remove(os.path.join(args.dir, metricsFileName))
+        except OSError:
+            pass
+        return 0
+
+    entries = readEntries(args.dir)
+    if not entries:
+        informUser(f'No metrics in {args.dir}\n')
+        return 1
+    summary = summarize(entries, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        printSummary(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,4 @@
 import os
-import subprocess
-import pprint
 import logging
 
 # This module provides a wrapper for subprocess.POpen
@@ -10,9 +8,16 @@ import logging
 _logger = logging.getLogger(__name__)
 
 def Popen(*pargs, **kwargs):
-    _logger.debug("WLLVM Executing:\n" + pprint.pformat(pargs[0]) + "\nin: " +  os.getcwd())
+    # imported here so that merely importing us stays cheap; pprint is
+    # only worth importing when there is something to print.
+    # pylint: disable=import-outside-toplevel
+    import subprocess
+    if _logger.isEnabledFor(logging.DEBUG):
+        import pprint
+        _logger.debug("WLLVM Executing:\n" + pprint.pformat(pargs[0]) + "\nin: " +  os.getcwd())
     try:
         return subprocess.Popen(*pargs, **kwargs)
     except OSError:
+        import pprint
         _logger.error("WLLVM Failed to execute: %s", pprint.pformat(pargs[0]))
         raise
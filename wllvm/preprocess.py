@@ -0,0 +1,150 @@
+"""
+Preprocessing once, for WLLVM_PREPROCESS_ONCE.
+
+Normally the real compile and the bitcode compile each run the
+preprocessor over the source and all of its headers. For a compile of a
+single C or C++ file, getPreprocessedSuffix says whether we can do
+better, and getPreprocessCommands splits the command into two: one that
+preprocesses the source to a hidden .i or .ii file, and writes the
+dependency file as the plain compile would have, and one that compiles
+that file to the object. The bitcode compile is given the preprocessed
+file too, with the flags that only mean something to the preprocessor
+taken out by withoutPreprocessorArgs.
+
+Compiling preprocessed source can warn about things the plain compile
+does not (macro expansions look like code written by hand), so
+compilePreprocessed holds on to what the compiler says until it knows
+the object built; if it did not, the caller does the plain compile
+after all and lets that have its say.
+"""
+
+import os
+import subprocess
+import sys
+
+from .popenwrapper import Popen
+from .metrics import metricsPhase, waitProcess
+from .logconfig import logConfig
+
+# Internal logger
+_logger = logConfig(__name__)
+
+# The preprocessed sources that the compiler will take as they are.
+_preprocessedSuffixes = {'.c': '.i', '.cc': '.ii', '.cp': '.ii', '.cxx': '.ii', '.cpp': '.ii',
+                         '.CPP': '.ii', '.c++': '.ii', '.C': '.ii'}
+
+# The dependency file flags the preprocessor gets to deal with.
+_dependencyUnaryFlags = ('-MD', '-MMD', '-MP', '-MG')
+_dependencyBinaryFlags = ('-MF', '-MT', '-MQ')
+
+# The flags that only mean something to the preprocessor.
+_preprocessorBinaryFlags = ('-D', '-U', '-I', '-include', '-imacros', '-isystem', '-iquote',
+                            '-idirafter', '-iprefix', '-iwithprefix', '-iwithprefixbefore')
+_preprocessorJoinedFlags = ('-D', '-U', '-I')
+
+
+def getPreprocessedSuffix(builder, af):
+    """ The suffix of the preprocessed source, if this compile can preprocess once; else None.
+
+    That is a compile only of a single C or C++ file, whose arguments hold
+    no surprises for us: no -x, no -M or -MM, nothing we would have to
+    parse further (-Wp,-M..., response files) and no -save-temps.
+    """
+    if builder.mode not in ('wllvm', 'wllvm++') or not af.isCompileOnly or len(af.inputFiles) != 1:
+        return None
+    srcFile = af.inputFiles[0]
+    cmd = builder.cmd
+    if cmd.count(srcFile) != 1 or '-x' in af.compileArgs:
+        return None
+    if af.outputFilename is not None and '-o' not in cmd:
+        return None
+    for arg in cmd:
+        if arg.startswith('-M') and arg not in _dependencyUnaryFlags + _dependencyBinaryFlags:
+            return None
+        if arg.startswith(('-Wp,-M', '-save-temps', '@')):
+            return None
+    suffix = _preprocessedSuffixes.get(os.path.splitext(srcFile)[1])
+    # clang++ and g++ take .c files for C++
+    if suffix and builder.mode == 'wllvm++':
+        suffix = '.ii'
+    return suffix
+
+
+def withoutPreprocessorArgs(args):
+    """ args, less the flags that are no use once the source is preprocessed.
+    """
+    retval = []
+    args = iter(args)
+    for arg in args:
+        if arg in _preprocessorBinaryFlags:
+            next(args, None)
+        elif not (arg.startswith(_preprocessorJoinedFlags) and len(arg) > 2):
+            retval.append(arg)
+    return retval
+
+
+def getPreprocessCommands(builder, af, objFile, ppFile):
+    """ The command preprocessing the source to ppFile, and the command compiling that to objFile.
+
+    The dependency file flags go to the preprocessor, which is told the
+    target and the file name the plain compile would have used, unless
+    the command already says.
+    """
+    srcFile = af.inputFiles[0]
+    ppCmd = builder.getCompiler() + ['-E']
+    objCmd = builder.getCompiler()
+    makesDependencies = hasTarget = hasDepFile = False
+    args = iter(builder.getCommand())
+    for arg in args:
+        if arg in _dependencyBinaryFlags:
+            ppCmd.extend([arg, next(args, '')])
+            hasTarget = hasTarget or arg in ('-MT', '-MQ')
+            hasDepFile = hasDepFile or arg == '-MF'
+        elif arg in _dependencyUnaryFlags:
+            ppCmd.append(arg)
+            makesDependencies = makesDependencies or arg in ('-MD', '-MMD')
+        elif arg == '-o':
+            objCmd.extend([arg, next(args, '')])
+        elif arg == '-c':
+            objCmd.append(arg)
+        elif arg == srcFile:
+            ppCmd.append(arg)
+            objCmd.append(ppFile)
+        else:
+            ppCmd.append(arg)
+            objCmd.append(arg)
+    if makesDependencies and not hasTarget:
+        ppCmd.extend(['-MQ', objFile])
+    if makesDependencies and not hasDepFile:
+        ppCmd.extend(['-MF', f'{os.path.splitext(objFile)[0]}.d'])
+    ppCmd.extend(['-o', ppFile])
+    if af.outputFilename is None:
+        # the object would otherwise be named after the preprocessed file
+        objCmd.extend(['-o', objFile])
+    return (ppCmd, withoutPreprocessorArgs(objCmd))
+
+
+def preprocess(ppCmd):
+    """ Runs the preprocessor, returning its exit code.
+    """
+    _logger.debug('preprocess: %s', ppCmd)
+    with metricsPhase('preprocess'):
+        return waitProcess(Popen(ppCmd))
+
+
+def compilePreprocessed(objCmd):
+    """ Compiles the preprocessed source to the object, returning the compiler's exit code.
+
+    What the compiler has to say is only passed on if the object built.
+    """
+    _logger.debug('compilePreprocessed: %s', objCmd)
+    with metricsPhase('compile'):
+        proc = Popen(objCmd, stderr=subprocess.PIPE)
+        diagnostics = proc.stderr.read()
+        proc.stderr.close()
+        rc = waitProcess(proc)
+    if rc == 0:
+        sys.stderr.flush()
+        sys.stderr.buffer.write(diagnostics)
+        sys.stderr.flush()
+    return rc
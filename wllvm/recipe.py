@@ -0,0 +1,128 @@
+"""
+Bitcode recipes, for WLLVM_BITCODE_MODE=lazy.
+
+In the lazy mode no bitcode is built at compile time. Instead of the
+path of a bitcode file, each object gets a line saying how to build it:
+
+    @wllvm-recipe {"cwd": ..., "cmd": [...], "src": ..., "srcHash": ...}
+
+where cmd is the bitcode compiler and its arguments (getBitcodeCompiler
+plus the compile arguments, less the dependency file flags), src is the
+source file, relative to cwd as it was given, and srcHash the sha256 of
+its contents at compile time.
+
+extract-bc turns the recipes of the objects that actually went into its
+input into bitcode, in parallel, so a translation unit that never makes
+it into a binary we look at never costs a bitcode compile. The results
+are kept in WLLVM_BC_CACHE, or else in ~/.cache/wllvm/recipes, keyed on
+a hash of the recipe, so extracting again, or from another binary made
+of the same objects, costs nothing. Since the source hash is checked,
+but the headers are not, a source that changed since it was compiled is
+an error, while a changed header is not noticed.
+"""
+
+import os
+import json
+import hashlib
+
+from .bccache import getBitcodeCache
+from .bcstore import getContentHash
+from .popenwrapper import Popen
+from .metrics import metricsPhase, waitProcess
+from .responsefile import responseFileCommand
+from .logconfig import logConfig
+
+# Internal logger
+_logger = logConfig(__name__)
+
+recipePrefix = '@wllvm-recipe '
+
+# bump this to invalidate every result when the key changes meaning
+_keyVersion = 'wllvm-recipe-1'
+
+
+def makeRecipe(bitcodeCommand, srcFile):
+    """ The recipe for compiling srcFile with bitcodeCommand, which lacks the source and output files.
+    """
+    return {'cwd': os.getcwd(), 'cmd': bitcodeCommand, 'src': srcFile, 'srcHash': getContentHash(srcFile)}
+
+
+def formatRecipe(recipe):
+    """ The recipe as a single line of text, for the .llvm_bc section.
+    """
+    return recipePrefix + json.dumps(recipe, sort_keys=True, separators=(',', ':'))
+
+
+def isRecipe(line):
+    return line.startswith(recipePrefix)
+
+
+def parseRecipe(line):
+    return json.loads(line[len(recipePrefix):])
+
+
+def getRecipeKey(recipe):
+    return hashlib.sha256(f'{_keyVersion}\0{json.dumps(recipe, sort_keys=True)}'.encode()).hexdigest()
+
+
+def getRecipeCache():
+    """ Where built recipes are kept: the bitcode cache, if there is one, or else our own.
+    """
+    cacheHome = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return getBitcodeCache(os.path.join(cacheHome, 'wllvm', 'recipes'))
+
+
+def buildRecipe(recipe, bcFile, cache):
+    """ Makes bcFile the bitcode the recipe describes, returning whether that worked.
+    """
+    key = getRecipeKey(recipe)
+    if cache.fetch(key, bcFile):
+        return True
+
+    srcPath = os.path.join(recipe['cwd'], recipe['src'])
+    try:
+        if getContentHash(srcPath) != recipe['srcHash']:
+            _logger.error('"%s" has changed since it was compiled, so its bitcode would not match', srcPath)
+            return False
+    except OSError as e:
+        _logger.error('Cannot build the bitcode for "%s": %s', srcPath, str(e))
+        return False
+
+    cmd = recipe['cmd'] + ['-c', recipe['src'], '-o', bcFile]
+    try:
+        with metricsPhase('bitcode'), responseFileCommand(cmd) as shortCmd:
+            rc = waitProcess(Popen(shortCmd, cwd=recipe['cwd']))
+    except OSError:
+        rc = -1
+    if rc != 0:
+        _logger.error('Failed to build the bitcode for "%s"', srcPath)
+        return False
+    cache.insert(key, bcFile)
+    return True
+
+
+def buildRecipes(lines, outputDir, jobs):
+    """ Replaces the recipes among lines with the bitcode files they make, built in outputDir.
+
+    Returns the new lines, and whether every recipe could be built.
+    """
+    recipes = [(index, parseRecipe(line)) for (index, line) in enumerate(lines) if isRecipe(line)]
+    if not recipes:
+        return (lines, True)
+    _logger.info('Building the bitcode for %d recipes', len(recipes))
+
+    cache = getRecipeCache()
+    lines = list(lines)
+    # the same object can turn up more than once, but gets built once
+    targets = {}
+    for (index, recipe) in recipes:
+        (stem, _) = os.path.splitext(os.path.basename(recipe['src']))
+        bcFile = os.path.join(outputDir, f'{stem}.{getRecipeKey(recipe)[:16]}.bc')
+        lines[index] = bcFile
+        targets[bcFile] = recipe
+
+    # only extract-bc gets here, so every lazy mode compile need not import it
+    from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(targets)))) as pool:
+        results = list(pool.map(lambda bcFile: buildRecipe(targets[bcFile], bcFile, cache), targets))
+    return (lines, all(results))
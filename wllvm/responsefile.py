@@ -0,0 +1,183 @@
+"""
+Response files: @file arguments that stand for the arguments in file.
+
+Reading them: ArgumentListFilter expands each @file as the parse
+reaches it (see ArgumentStream), including @files named in @files.
+The contents are split as GCC and clang do on Unix: on whitespace,
+with single and double quotes, and backslash escapes. An @file that
+cannot be read is an argument like any other, as it is to GCC; one
+that names itself, directly or not, is a warning.
+
+Writing them: the bitcode, object and link commands we build ourselves
+hold every argument of the original command line, response files
+expanded, so responseFileCommand hands long ones to the compiler in a
+response file of their own.
+"""
+
+import contextlib
+import logging
+import os
+import sys
+
+# Internal logger
+_logger = logging.getLogger(__name__)
+
+# How deep response files may name other response files.
+maxResponseFileDepth = 32
+
+# Commands whose arguments add up to more bytes than this get a response file.
+responseFileThreshold = 64 * 1024
+
+_specialCharacters = ('\'', '"', '\\')
+
+
+def splitResponseFile(text):
+    """ Yields the arguments in text, split as libiberty's buildargv does.
+    """
+    if not any(c in text for c in _specialCharacters):
+        yield from text.split()
+        return
+    arg = []
+    inArg = False
+    quote = None
+    escaped = False
+    for c in text:
+        if escaped:
+            arg.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = inArg = True
+        elif quote:
+            if c == quote:
+                quote = None
+            else:
+                arg.append(c)
+        elif c.isspace():
+            if inArg:
+                yield ''.join(arg)
+                arg = []
+                inArg = False
+        elif c in ('\'', '"'):
+            quote = c
+            inArg = True
+        else:
+            arg.append(c)
+            inArg = True
+    if inArg:
+        yield ''.join(arg)
+
+
+def readResponseFile(path):
+    """ Yields the arguments in the response file path.
+    """
+    with open(path, 'rb') as f:
+        text = f.read().decode(sys.getfilesystemencoding(), 'surrogateescape')
+    yield from splitResponseFile(text)
+
+
+def quoteResponseArg(arg):
+    """ arg, escaped so that splitResponseFile gives it back.
+    """
+    if not arg:
+        return "''"
+    return ''.join(f'\\{c}' if c.isspace() or c in _specialCharacters else c for c in arg)
+
+
+class ArgumentStream:
+    """ The arguments of a command line, with its response files expanded as they are reached.
+
+    Behaves like the deque ArgumentListFilter used to take its arguments
+    from: popleft, and true while there is anything left.
+    """
+
+    def __init__(self, args):
+        # (the real path of the response file, or None, its directory, the rest of its arguments)
+        self.stack = [(None, None, iter(args))]
+        self.head = None
+
+    def __bool__(self):
+        return self.fill()
+
+    def popleft(self):
+        if not self.fill():
+            raise IndexError('pop from an empty argument list')
+        arg = self.head
+        self.head = None
+        return arg
+
+    def fill(self):
+        """ Gets the next argument ready, returning whether there is one.
+        """
+        while self.head is None and self.stack:
+            (_, _, args) = self.stack[-1]
+            arg = next(args, None)
+            if arg is None:
+                self.stack.pop()
+            elif not (arg.startswith('@') and len(arg) > 1 and self.push(arg[1:])):
+                self.head = arg
+        return self.head is not None
+
+    def push(self, name):
+        """ Starts on the response file name, returning False if it is to be taken as it is.
+        """
+        path = self.find(name)
+        if path is None:
+            return False
+        realPath = os.path.realpath(path)
+        if any(realPath == active for (active, _, _) in self.stack):
+            _logger.warning('Ignoring the response file "%s", which includes itself', name)
+            return True
+        if len(self.stack) > maxResponseFileDepth:
+            _logger.warning('Ignoring the response file "%s", nested more than %d deep', name, maxResponseFileDepth)
+            return True
+        try:
+            args = readResponseFile(path)
+            # read it now, so that a file we cannot read is taken as it is
+            first = next(args, None)
+        except OSError:
+            return False
+        if first is not None:
+            self.stack.append((realPath, os.path.dirname(path), _prepend(first, args)))
+        return True
+
+    def find(self, name):
+        """ The response file name, relative to the directory, else to the response file naming it.
+        """
+        if os.path.isfile(name):
+            return name
+        directory = self.stack[-1][1]
+        if directory and not os.path.isabs(name) and os.path.isfile(os.path.join(directory, name)):
+            return os.path.join(directory, name)
+        return None
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+@contextlib.contextmanager
+def responseFileCommand(cmd, threshold=None):
+    """ cmd, or, when its arguments are long, the program and a response file holding them.
+
+    The response file is removed when the with statement is done.
+    """
+    if threshold is None:
+        threshold = responseFileThreshold
+    if sum(len(arg) + 1 for arg in cmd[1:]) <= threshold:
+        yield cmd
+        return
+    import tempfile  # pylint: disable=import-outside-toplevel
+    (fd, path) = tempfile.mkstemp(prefix='wllvm-', suffix='.rsp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write('\n'.join(quoteResponseArg(arg) for arg in cmd[1:]).encode(sys.getfilesystemencoding(),
+                                                                            'surrogateescape'))
+            f.write(b'\n')
+        _logger.debug('Passing %d arguments in the response file %s', len(cmd) - 1, path)
+        yield [cmd[0], f'@{path}']
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -12,13 +12,13 @@ linked into a library or executable.
 
 import sys
 
-from .compilers import wcompile
+from .launcher import launch
 
 
 def main():
     """ The entry point to wllvm.
     """
-    return wcompile("wfortran")
+    return launch("wfortran")
 
 
 if __name__ == '__main__':
@@ -10,13 +10,13 @@ into a library or executable.
 
 import sys
 
-from .compilers import wcompile
+from .launcher import launch
 
 
 def main():
     """ The entry point to wllvm++.
     """
-    return wcompile("wllvm++")
+    return launch("wllvm++")
 
 
 if __name__ == '__main__':
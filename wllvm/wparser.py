@@ -1,22 +1,174 @@
 #!/usr/bin/env python
-"""This is a wrapper around the real compiler.
-
-It first invokes a real compiler to generate
-an object file.  Then it invokes a bitcode
-compiler to generate a parallel bitcode file.
-It records the location of the bitcode in an
-ELF section of the object file so that it can be
-found later after all of the objects are
-linked into a library or executable.
+"""wparse-args: shows how ArgumentListFilter splits up the arguments it
+is given, into compile and link flags and input and output files.
+
+With --batch it does the same for every command in a
+compile_commands.json, or in a log of one shell quoted command per line
+(the compiler first), and reports how the flags were matched, the ones
+that were not, and how many commands a second it got through.
 """
 
+import os
 import sys
 
 from .arglistfilter import ArgumentListFilter
 
+# Only --batch needs json, shlex, argparse and the like, so it imports them.
+# pylint: disable=import-outside-toplevel
+
+batchFlag = '--batch'
+
+
+def newCounts():
+    """ Empty counts of how flags were matched, for CountingFilter.
+    """
+    return {'exact': {}, 'group': {}, 'pattern': {}, 'unrecognized': {}}
+
+
+class CountingFilter(ArgumentListFilter):
+    """ An ArgumentListFilter that counts how each flag was matched, in counts (see newCounts).
+    """
+
+    def __init__(self, inputList, counts):
+        self.counts = counts
+        super().__init__(inputList)
+
+    def countMatch(self, kind, key):
+        counts = self.counts[kind]
+        counts[key] = counts.get(key, 0) + 1
+
+
+def readCommands(path):
+    """ The (directory, file, argv) of each command in path, less the compiler.
+
+    path is a compile_commands.json, or has one shell quoted command per line.
+    """
+    import json
+    import shlex
+    with open(path, encoding='utf-8', errors='surrogateescape') as f:
+        text = f.read()
+    commands = []
+    if text.lstrip().startswith('['):
+        for entry in json.loads(text):
+            argv = entry.get('arguments') or shlex.split(entry.get('command', ''))
+            commands.append((entry.get('directory'), entry.get('file'), argv[1:]))
+        return commands
+    for line in text.splitlines():
+        if line.strip() and not line.lstrip().startswith('#'):
+            commands.append((None, None, shlex.split(line)[1:]))
+    return commands
+
+
+def classify(af):
+    """ What af made of its arguments.
+    """
+    (skipit, reason) = af.skipBitcodeGeneration()
+    return {
+        'compileArgs': af.compileArgs,
+        'linkArgs': af.linkArgs,
+        'inputFiles': af.inputFiles,
+        'objectFiles': af.objectFiles,
+        'outputFile': af.outputFilename,
+        'isCompileOnly': af.isCompileOnly,
+        'skipReason': reason if skipit else None,
+    }
+
+
+def parseCommands(commands, repeat=1):
+    """ Classifies each command, counting how its flags were matched, then times repeat more parses of them all.
+
+    Returns the classifications, the counts, and the seconds the timed parses took.
+    """
+    import time
+    cwd = os.getcwd()
+    counts = newCounts()
+    results = []
+    seconds = 0.0
+    try:
+        for (directory, fileName, argv) in commands:
+            # response files are relative to where the command ran
+            if directory and os.path.isdir(directory):
+                os.chdir(directory)
+            result = classify(CountingFilter(argv, counts))
+            result['directory'] = directory
+            result['file'] = fileName
+            results.append(result)
+        os.chdir(cwd)
+        for _ in range(repeat):
+            for (directory, _, argv) in commands:
+                if directory and os.path.isdir(directory):
+                    os.chdir(directory)
+                start = time.perf_counter()
+                ArgumentListFilter(argv)
+                seconds += time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    return (results, counts, seconds)
+
+
+def _top(counts, n):
+    return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+
+def batch(argv):
+    """ The --batch mode of wparse-args.
+    """
+    import argparse
+    import json
+    import logging
+    parser = argparse.ArgumentParser(prog=f'wparse-args {batchFlag}',
+                                     description='Runs the argument parser over a whole build.')
+    parser.add_argument('commands', help='A compile_commands.json, or a file of one command per line.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print every classification, and the summary, as JSON.')
+    parser.add_argument('--top', '-n', type=int, default=20,
+                        help='How many of the most used flags and patterns to list. Default %(default)s')
+    parser.add_argument('--repeat', '-r', type=int, default=1,
+                        help='Time this many parses of every command, for steadier timings. Default %(default)s')
+    args = parser.parse_args(argv)
+
+    commands = readCommands(args.commands)
+    # we count the unrecognized flags ourselves; a warning for each is just noise
+    logging.getLogger('wllvm.arglistfilter').setLevel(logging.ERROR)
+    (results, counts, seconds) = parseCommands(commands, max(1, args.repeat))
+
+    parsed = len(commands) * max(1, args.repeat)
+    summary = {
+        'commands': len(commands),
+        'arguments': sum(len(argv) for (_, _, argv) in commands),
+        'seconds': seconds,
+        'commandsPerSecond': parsed / seconds if seconds else 0.0,
+        'skipReasons': {},
+        'exact': dict(_top(counts['exact'], args.top)),
+        'patterns': dict(_top(counts['pattern'], args.top)),
+        'groups': sum(counts['group'].values()),
+        'unrecognized': dict(_top(counts['unrecognized'], len(counts['unrecognized']))),
+    }
+    for result in results:
+        reason = result['skipReason'] or 'none'
+        summary['skipReasons'][reason] = summary['skipReasons'].get(reason, 0) + 1
+
+    if args.json:
+        print(json.dumps({'entries': results, 'summary': summary}, indent=2))
+        return 0
+
+    print(f'{summary["commands"]} commands, {summary["arguments"]} arguments, parsed {parsed} times in '
+          f'{seconds:.3f} s: {summary["commandsPerSecond"]:.0f} commands/s')
+    print('skip reasons: ' + ', '.join(f'{reason} {count}' for (reason, count) in _top(summary['skipReasons'], 100)))
+    for (title, table) in (('exact matches', summary['exact']), ('patterns', summary['patterns']),
+                           ('not recognized', summary['unrecognized'])):
+        print()
+        print(f'{title}:')
+        for (key, count) in table.items():
+            print(f'{count:10}  {key}')
+    return 0
+
+
 def main():
     cmd = list(sys.argv)
     cmd = cmd[1:]
+    if cmd and cmd[0] == batchFlag:
+        return batch(cmd[1:])
     args = ArgumentListFilter(cmd)
     args.dump()
     return 0